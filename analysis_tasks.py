@@ -0,0 +1,246 @@
+# analysis_tasks.py
+# Tareas de análisis (un canal o todos) y el ejecutor que las reparte. Lo comparten la app
+# web, worker.py y el planificador; importarlo no arranca workers ni el planificador.
+import os
+import uuid
+import time
+import json
+import cProfile
+from collections import deque
+
+from dotenv import load_dotenv
+
+import youtube_logic
+import llm_cache
+import batch_analysis
+import raw_store
+from db_pool import get_connection
+from job_queue import AnalysisExecutor, DbJobQueue, JOB_QUEUE_MODE
+from job_events import events
+from metrics import JobTimings
+
+load_dotenv()
+
+# Streaming del LLM: el texto parcial se manda a los clientes y se guarda en la base de datos por lotes.
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+LLM_STREAM_PUBLISH_SECONDS = float(os.getenv("LLM_STREAM_PUBLISH_SECONDS", 0.5))
+LLM_STREAM_FLUSH_SECONDS = float(os.getenv("LLM_STREAM_FLUSH_SECONDS", 3))
+
+# Con ?profile=1 en /analizar, el análisis se ejecuta bajo cProfile y el perfil se guarda aquí.
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Últimos tiempos hasta la primera salida visible (ms), para /stats.
+first_output_times = deque(maxlen=100)
+
+def _update_job(job_id, **fields):
+    """Actualiza columnas de un job. Toma una conexión del pool y la devuelve enseguida,
+    para no retenerla mientras esperamos a YouTube o al LLM."""
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+    with get_connection() as db:
+        db.cursor().execute(f"UPDATE analysis_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        db.commit()
+
+def _fail_job(job_id, error, timings=None):
+    print(f"Error en el job {job_id}: {error}")
+    fields = {"timings": json.dumps(timings.finish("failed"))} if timings else {}
+    _update_job(job_id, status="failed", result=str(error), **fields)
+    events.publish(job_id, "failed", result=str(error))
+
+class _StreamFlusher:
+    """
+    Recibe los fragmentos del LLM en streaming. Publica el texto acumulado a los clientes
+    y lo guarda en `analysis_jobs.result` cada pocos segundos, no por cada token.
+    """
+
+    def __init__(self, job_id, started):
+        self.job_id = job_id
+        self.started = started
+        self.parts = []
+        self.first_output_ms = None
+        self.last_publish = self.last_flush = time.monotonic()
+
+    def __call__(self, delta):
+        self.parts.append(delta)
+        now = time.monotonic()
+        if self.first_output_ms is None:
+            self.mark_first_output()
+            self.last_publish = 0
+        if now - self.last_publish >= LLM_STREAM_PUBLISH_SECONDS:
+            events.publish(self.job_id, "calling_llm", partial="".join(self.parts))
+            self.last_publish = now
+        if now - self.last_flush >= LLM_STREAM_FLUSH_SECONDS:
+            _update_job(self.job_id, result="".join(self.parts))
+            self.last_flush = now
+
+    def mark_first_output(self):
+        if self.first_output_ms is None:
+            self.first_output_ms = int((time.monotonic() - self.started) * 1000)
+            first_output_times.append(self.first_output_ms)
+
+def _run_profiled(job_id, task, *args):
+    """
+    Ejecuta la tarea bajo cProfile y guarda el perfil en PROFILE_DIR/<job_id>.prof.
+    Solo se perfila el hilo del worker (no los hilos auxiliares de YouTube o del LLM).
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(task, job_id, *args)
+    finally:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{job_id}.prof"))
+        print(f"Job {job_id}: perfil guardado en {PROFILE_DIR}/{job_id}.prof")
+
+def _llm_timings(timings, usage, cache_hit, stream):
+    timings.set(tokens_sent=usage.get('tokens_sent', 0), payload_bytes=usage.get('payload_bytes', 0),
+                llm_requests=usage.get('requests', 0), llm_cache_hit=cache_hit, first_output_ms=stream.first_output_ms)
+    if 'topic_ranking_ms' in usage:
+        timings.set(topic_ranking_ms=usage['topic_ranking_ms'])
+
+def _stored_videos(job_id, timings):
+    """
+    Datos crudos que guardó un intento anterior del mismo job (p. ej. un worker que murió
+    esperando al LLM). Así el reintento empieza en la etapa del LLM sin gastar cuota.
+    """
+    with timings.stage("db_read"):
+        blob = raw_store.load(job_id)
+    if blob is None:
+        return None
+    videos = raw_store.decode(blob)
+    timings.set(resumed_from="raw_data")
+    print(f"Job {job_id}: se reanuda con los datos de YouTube ya guardados.")
+    return videos
+
+def run_analysis_task(job_id, channel_id, force_refresh=False, profile=False):
+    if profile:
+        return _run_profiled(job_id, run_analysis_task, channel_id, force_refresh)
+    print(f"Iniciando análisis para el job_id: {job_id}")
+    timings = JobTimings("channel")
+    timings.record("queued", executor.queued_seconds(job_id))
+    try:
+        started = time.monotonic()
+        # 1. Obtener datos de YouTube (o los ya guardados, si un intento anterior llegó a descargarlos)
+        events.publish(job_id, "fetching_videos")
+        quota = youtube_logic.QuotaTracker()
+        videos = _stored_videos(job_id, timings)
+        if videos is None:
+            with timings.stage("youtube_fetch"):
+                videos = youtube_logic.get_channel_videos_last_week(channel_id, quota=quota, force_refresh=force_refresh)
+            quota_report = quota.report()
+            timings.set(api_calls=quota_report['calls'], quota_units=quota_report['units'], video_count=len(videos))
+            print(f"Job {job_id}: {quota_report['units']} unidades de cuota de YouTube ({quota_report['calls']}).")
+            with timings.stage("db_write"):
+                _update_job(job_id, quota_units=quota_report['units'])
+            if not videos:
+                raise ValueError(f"No se encontraron videos recientes para el canal {channel_id}.")
+
+            # ¡NUEVO! Convertimos los datos a un string JSON y los guardamos inmediatamente.
+            with timings.stage("db_write"):
+                raw_store.save(job_id, videos)
+
+        # 2. Analizar con el LLM
+        events.publish(job_id, "calling_llm", video_count=len(videos), quota_units=quota.report()['units'])
+        usage = {}
+        stream = _StreamFlusher(job_id, started)
+        with timings.stage("llm"):
+            analysis_result, cache_hit = llm_cache.analyze(youtube_logic.GROK_ECONOMIC_CONCERN, videos, usage=usage,
+                                                           on_chunk=stream if LLM_STREAMING else None)
+        stream.mark_first_output()
+        _llm_timings(timings, usage, cache_hit, stream)
+        print(f"Job {job_id}: {usage.get('tokens_sent', 0)} tokens enviados al LLM en {usage.get('requests', 0)} peticiones, "
+              f"primera salida a los {stream.first_output_ms} ms.")
+
+        # 3. Guardar el resultado final en la base de datos
+        with timings.stage("db_write"):
+            _update_job(job_id, status="completed", result=analysis_result, llm_cache_hit=int(cache_hit),
+                        tokens_sent=usage.get('tokens_sent', 0), first_output_ms=stream.first_output_ms,
+                        timings=json.dumps(timings.finish("completed")))
+        events.publish(job_id, "completed", result=analysis_result, llm_cache_hit=cache_hit)
+        print(f"Job {job_id} completado con éxito en {timings.values['total_seconds']}s: {timings.stages}")
+
+    except Exception as e:
+        _fail_job(job_id, e, timings)
+
+def run_batch_analysis_task(job_id, channel_key, force_refresh=False, profile=False):
+    """Analiza todos los canales guardados en un único job."""
+    if profile:
+        return _run_profiled(job_id, run_batch_analysis_task, channel_key, force_refresh)
+    print(f"Iniciando análisis de todos los canales para el job_id: {job_id}")
+    timings = JobTimings("batch")
+    timings.record("queued", executor.queued_seconds(job_id))
+    try:
+        started = time.monotonic()
+        events.publish(job_id, "fetching_videos")
+        channels = youtube_logic.get_all_saved_channels()
+        if not channels:
+            raise ValueError("No hay canales guardados para analizar.")
+        quota = youtube_logic.QuotaTracker()
+        llm_started = {}
+        stored = _stored_videos(job_id, timings)
+
+        def on_videos(grouped):
+            if stored is not None:
+                llm_started['value'] = time.monotonic()
+                events.publish(job_id, "calling_llm", video_count=sum(len(v) for v in grouped.values()))
+                return
+            timings.record("youtube_fetch", time.monotonic() - started)
+            quota_report = quota.report()
+            timings.set(api_calls=quota_report['calls'], quota_units=quota_report['units'],
+                        channel_count=len(channels), video_count=sum(len(v) for v in grouped.values()))
+            print(f"Job {job_id}: {len(channels)} canales descargados en {time.monotonic() - started:.1f}s, "
+                  f"{quota_report['units']} unidades de cuota ({quota_report['calls']}).")
+            with timings.stage("db_write"):
+                _update_job(job_id, quota_units=quota_report['units'])
+                raw_store.save(job_id, grouped)
+            events.publish(job_id, "calling_llm", video_count=sum(len(v) for v in grouped.values()),
+                           quota_units=quota_report['units'])
+            llm_started['value'] = time.monotonic()
+
+        usage = {}
+        stream = _StreamFlusher(job_id, started)
+        analysis_result, _, _, cache_hit = batch_analysis.run_batch_analysis(
+            channels, quota=quota, force_refresh=force_refresh, on_videos=on_videos, usage=usage,
+            on_chunk=stream if LLM_STREAMING else None, videos=stored)
+        timings.record("llm", time.monotonic() - llm_started['value'])
+        stream.mark_first_output()
+        _llm_timings(timings, usage, cache_hit, stream)
+
+        with timings.stage("db_write"):
+            _update_job(job_id, status="completed", result=analysis_result, llm_cache_hit=int(cache_hit),
+                        tokens_sent=usage.get('tokens_sent', 0), first_output_ms=stream.first_output_ms,
+                        timings=json.dumps(timings.finish("completed")))
+        events.publish(job_id, "completed", result=analysis_result, llm_cache_hit=cache_hit)
+        print(f"Job {job_id} completado con éxito.")
+
+    except Exception as e:
+        _fail_job(job_id, e, timings)
+
+def _task_for(channel_id):
+    return run_batch_analysis_task if channel_id == batch_analysis.BATCH_CHANNEL_KEY else run_analysis_task
+
+# Un único ejecutor con workers limitados para todos los análisis del proceso, o la cola
+# compartida en la base de datos (JOB_QUEUE_MODE=db) que también atienden los `worker.py`.
+# Se crea sin arrancar: la cola en memoria lanza sus hilos con el primer job y la
+# compartida la arranca quien vaya a atenderla (la app si JOB_WORKERS_IN_WEB, o worker.py).
+if JOB_QUEUE_MODE == "db":
+    executor = DbJobQueue(_task_for)
+else:
+    executor = AnalysisExecutor(run_analysis_task)
+
+def create_job(channel_name, channel_id=None, db=None):
+    """Crea el job 'pending'. Con `db`, dentro de la transacción de quien llama (que confirma y avisa)."""
+    job_id = str(uuid.uuid4())
+    if db is not None:
+        db.cursor().execute("INSERT INTO analysis_jobs (id, status, channel_name, channel_id) VALUES (?, ?, ?, ?)",
+                            (job_id, "pending", channel_name, channel_id))
+        return job_id
+    with get_connection() as db:
+        db.cursor().execute("INSERT INTO analysis_jobs (id, status, channel_name, channel_id) VALUES (?, ?, ?, ?)",
+                            (job_id, "pending", channel_name, channel_id))
+        db.commit()
+    events.publish(job_id, "queued")
+    return job_id
+
+def submit_scheduled(channel_id, channel_name):
+    """Encola el análisis de un canal para el planificador y devuelve su job_id."""
+    job_id, _ = executor.submit(channel_id, lambda db=None: create_job(channel_name, channel_id, db))
+    return job_id
@@ -0,0 +1,54 @@
+# analyze_all.py
+# Analiza todos los canales guardados desde la línea de comandos.
+# Uso: python analyze_all.py [--concurrency 4] [--force-refresh] [--output resultado.json]
+import argparse
+import json
+import time
+
+import batch_analysis
+import youtube_logic
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analiza todos los canales guardados en un único análisis combinado.")
+    parser.add_argument("--concurrency", type=int, default=batch_analysis.BATCH_MAX_CONCURRENCY,
+                        help="Máximo de canales descargándose a la vez")
+    parser.add_argument("--force-refresh", action="store_true", help="Ignorar la caché de YouTube")
+    parser.add_argument("--output", help="Guardar los datos y el resumen por canal en este fichero JSON")
+    args = parser.parse_args()
+
+    channels = youtube_logic.get_all_saved_channels()
+    if not channels:
+        print("No hay canales.")
+        return
+
+    print(f"Analizando {len(channels)} canales (concurrencia {args.concurrency})...")
+    quota = youtube_logic.QuotaTracker()
+    usage = {}
+    started = time.monotonic()
+    download_seconds = {}
+
+    def on_videos(grouped):
+        download_seconds['value'] = time.monotonic() - started
+        print(f"Videos descargados en {download_seconds['value']:.1f}s. Llamando al LLM...")
+
+    result, grouped, breakdown, cache_hit = batch_analysis.run_batch_analysis(
+        channels, max_concurrency=args.concurrency, quota=quota, force_refresh=args.force_refresh,
+        on_videos=on_videos, usage=usage)
+
+    if cache_hit:
+        print("Resultado servido desde la caché del LLM.")
+    print("\n" + result)
+    print(f"\nTiempo total: {time.monotonic() - started:.1f}s. Cuota de YouTube: {quota.report()}. "
+          f"Tokens enviados al LLM: {usage.get('tokens_sent', 0)} en {usage.get('requests', 0)} peticiones.")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"videos": grouped, "breakdown": breakdown, "quota": quota.report(),
+                       "download_seconds": round(download_seconds.get('value', 0), 3)},
+                      f, indent=2, ensure_ascii=False)
+        print(f"Datos guardados en '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
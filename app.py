@@ -1,51 +1,67 @@
 # app.py (Versión con Descarga de JSON)
 import os
-import uuid
-import threading
 import secrets
+import queue
+import time
 import json # ¡NUEVO! Para manejar el formato JSON
-from flask import Flask, render_template, redirect, url_for, jsonify, request, flash, Response
+import io
+import pstats
+from flask import Flask, render_template, redirect, url_for, jsonify, request, flash, Response, g, send_file
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timezone
 
 import youtube_logic
 import llm_analyzer
+import llm_cache
+import batch_analysis
+import channel_import
+import raw_store
+import topic_ranking
+import video_store
+from db_pool import begin_request, get_connection, get_pool, get_read_connection, get_replica
+from job_queue import QueueFullError, JOB_QUEUE_MODE, JOB_WORKERS_IN_WEB
+from job_events import events, TERMINAL_STAGES
+from scheduler import Scheduler, SCHEDULER_ENABLED, fresh_result
+from analysis_tasks import (executor, create_job, run_batch_analysis_task, submit_scheduled, first_output_times,
+                            PROFILE_DIR)
+import metrics
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", secrets.token_hex(16))
 
-# --- Lógica de la Tarea en Segundo Plano ---
-def run_analysis_task(job_id, channel_id):
-    print(f"Iniciando análisis para el job_id: {job_id}")
-    db = youtube_logic.get_db_connection()
-    cursor = db.cursor()
-    try:
-        # 1. Obtener datos de YouTube
-        videos = youtube_logic.get_channel_videos_last_week(channel_id)
-        if not videos:
-            raise ValueError(f"No se encontraron videos recientes para el canal {channel_id}.")
-
-        # ¡NUEVO! Convertimos los datos a un string JSON y los guardamos inmediatamente.
-        json_data_string = json.dumps(videos, indent=2, ensure_ascii=False)
-        cursor.execute("UPDATE analysis_jobs SET raw_json_data = ? WHERE id = ?", (json_data_string, job_id))
-        db.commit()
-
-        # 2. Analizar con el LLM
-        analysis_result = llm_analyzer.analyze_with_openrouter(youtube_logic.GROK_ECONOMIC_CONCERN, videos)
-
-        # 3. Guardar el resultado final en la base de datos
-        cursor.execute("UPDATE analysis_jobs SET status = ?, result = ? WHERE id = ?", ("completed", analysis_result, job_id))
-        db.commit()
-        print(f"Job {job_id} completado con éxito.")
-
-    except Exception as e:
-        print(f"Error en el job {job_id}: {e}")
-        cursor.execute("UPDATE analysis_jobs SET status = ?, result = ? WHERE id = ?", ("failed", str(e), job_id))
-        db.commit()
-    finally:
-        db.close()
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+    begin_request()
+
+@app.after_request
+def _observe_latency(response):
+    # Se etiqueta por la regla de la ruta (/status/<job_id>), no por la URL, para no crear una serie por job.
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "sin_ruta"
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route,
+                                     status=response.status_code)
+    return response
+
+# Cada cuánto revisa el stream SSE la posición en cola y cada cuánto manda un keepalive.
+SSE_TICK_SECONDS = 2
+SSE_KEEPALIVE_SECONDS = 15
+# Para jobs de otro proceso no hay eventos en memoria y se consulta la base de datos, pero sin prisa.
+SSE_DB_RECHECK_SECONDS = 10
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 25))
+
+# Las tareas y el ejecutor viven en analysis_tasks; es la app la que arranca sus workers
+# (con la cola compartida solo si JOB_WORKERS_IN_WEB) y el planificador.
+if JOB_QUEUE_MODE == "db" and JOB_WORKERS_IN_WEB:
+    executor.start()
+
+scheduler = Scheduler(submit_scheduled)
+if SCHEDULER_ENABLED:
+    scheduler.start()
 
 # --- Rutas de la Aplicación Web ---
 @app.route('/')
@@ -62,6 +78,29 @@ def add_channel():
         flash(message); return redirect(url_for('index'))
     return render_template('add_channel.html')
 
+@app.route('/importar', methods=['POST'])
+def import_channels():
+    """
+    Alta masiva de canales: CSV o JSON en el campo `file` de un formulario o en el cuerpo
+    de la petición. ?category= para las filas sin categoría y ?dry_run=1 para solo validar.
+    """
+    upload = request.files.get('file')
+    if upload:
+        try:
+            text = upload.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            return jsonify({"error": "El fichero debe estar codificado en UTF-8."}), 400
+        fmt = channel_import.format_for(upload.filename, upload.mimetype)
+    else:
+        text, fmt = request.get_data(as_text=True), channel_import.format_for(mimetype=request.mimetype)
+    try:
+        entries = channel_import.parse_entries(text, request.args.get('format') or fmt)
+    except channel_import.ImportFormatError as e:
+        return jsonify({"error": str(e)}), 400
+    report = channel_import.import_channels(entries, request.args.get('category') or channel_import.DEFAULT_CATEGORY,
+                                            dry_run=request.args.get('dry_run') == '1')
+    return jsonify(report)
+
 @app.route('/delete/<channel_id>', methods=['POST'])
 def delete_channel(channel_id):
     success, message = youtube_logic.delete_channel_from_db(channel_id)
@@ -71,60 +110,317 @@ def delete_channel(channel_id):
 # ... (start_analysis, show_result, get_status, historial se quedan casi igual) ...
 @app.route('/analizar/<channel_id>')
 def start_analysis(channel_id):
-    job_id = str(uuid.uuid4())
+    # ?force_refresh=1 ignora la caché de YouTube y vuelve a descargar los datos del canal.
+    # ?profile=1 ejecuta el análisis bajo cProfile (ver /profile/<job_id>).
+    force_refresh = request.args.get('force_refresh') in ('1', 'true')
+    profile = request.args.get('profile') in ('1', 'true')
+    if not force_refresh and not profile:
+        # Si el planificador (u otro usuario) ya tiene un resultado reciente, se muestra directamente.
+        fresh_job_id = fresh_result(channel_id)
+        if fresh_job_id:
+            return redirect(url_for('show_result', job_id=fresh_job_id))
     channel_name = youtube_logic.get_channel_name_from_db(channel_id) or "Desconocido"
-    db = youtube_logic.get_db_connection(); cursor = db.cursor()
-    cursor.execute("INSERT INTO analysis_jobs (id, status, channel_name) VALUES (?, ?, ?)",(job_id, "pending", channel_name))
-    db.commit(); db.close()
-    thread = threading.Thread(target=run_analysis_task, args=(job_id, channel_id)); thread.start()
+    try:
+        # Si ya hay un análisis en curso para este canal, nos unimos a él.
+        job_id, _ = executor.submit(channel_id, lambda db=None: create_job(channel_name, channel_id, db),
+                                    force_refresh, profile)
+    except QueueFullError as e:
+        flash(f"{e} Inténtalo de nuevo en unos minutos.")
+        return redirect(url_for('index'))
+    return redirect(url_for('show_result', job_id=job_id))
+
+@app.route('/analizar-todos')
+def start_batch_analysis():
+    force_refresh = request.args.get('force_refresh') in ('1', 'true')
+    profile = request.args.get('profile') in ('1', 'true')
+    try:
+        job_id, _ = executor.submit(batch_analysis.BATCH_CHANNEL_KEY, lambda db=None: create_job("Todos los canales", batch_analysis.BATCH_CHANNEL_KEY, db),
+                                    force_refresh, profile, task=run_batch_analysis_task)
+    except QueueFullError as e:
+        flash(f"{e} Inténtalo de nuevo en unos minutos.")
+        return redirect(url_for('index'))
     return redirect(url_for('show_result', job_id=job_id))
 
 @app.route('/resultado/<job_id>')
 def show_result(job_id):
-    db = youtube_logic.get_db_connection(); cursor = db.cursor()
-    cursor.execute("SELECT channel_name FROM analysis_jobs WHERE id = ?", (job_id,))
-    job = cursor.fetchone(); db.close()
+    with get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT channel_name FROM analysis_jobs WHERE id = ?", (job_id,))
+        job = cursor.fetchone()
     channel_name = job[0] if job else "Desconocido"
     return render_template('resultado.html', job_id=job_id, channel_name=channel_name)
 
 @app.route('/status/<job_id>')
 def get_status(job_id):
-    db = youtube_logic.get_db_connection(); cursor = db.cursor()
-    cursor.execute("SELECT status, result FROM analysis_jobs WHERE id = ?", (job_id,))
-    job = cursor.fetchone(); db.close()
-    if job: return jsonify({"status": job[0], "result": job[1]})
-    else: return jsonify({"status": "not_found"}), 404
+    with get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT status, result FROM analysis_jobs WHERE id = ?", (job_id,))
+        job = cursor.fetchone()
+    if not job: return jsonify({"status": "not_found"}), 404
+    if job[0] in TERMINAL_STAGES:
+        return jsonify({"status": job[0], "result": job[1], "queue_position": executor.queue_position(job_id)})
+    # Mientras el LLM responde en streaming, `result` contiene el texto parcial guardado hasta ahora.
+    return jsonify({"status": job[0], "result": None, "partial": job[1],
+                    "queue_position": executor.queue_position(job_id)})
+
+def _load_job_event(job_id):
+    """
+    Evento construido desde la base de datos, para jobs que no ejecuta este proceso. La
+    etapa sale del arrendamiento y de lo que el job ya ha guardado: `quota_units` al
+    terminar la descarga y el texto parcial del LLM en `result`.
+    """
+    with get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT j.status, j.result, j.quota_units, l.expires_at FROM analysis_jobs j "
+                       "LEFT JOIN job_leases l ON l.job_id = j.id WHERE j.id = ?", (job_id,))
+        job = cursor.fetchone()
+    if not job:
+        return None
+    status, result, quota_units, lease_expires_at = job
+    if status in TERMINAL_STAGES:
+        return {"job_id": job_id, "stage": status, "status": status, "result": result}
+    if lease_expires_at is not None and lease_expires_at < time.time():
+        stage = "queued"            # su worker murió: espera a que otro lo retome
+    elif result is not None or quota_units is not None:
+        stage = "calling_llm"
+    elif lease_expires_at is not None:
+        stage = "fetching_videos"
+    else:
+        stage = "queued"
+    event = {"job_id": job_id, "stage": stage, "status": status}
+    if stage == "calling_llm" and result:
+        event["partial"] = result
+    return event
+
+def _sse(event):
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@app.route('/events/<job_id>')
+def job_events(job_id):
+    """Stream SSE con las transiciones de etapa del job. Se cierra al completarse o fallar."""
+    def stream():
+        # Nos suscribimos antes de leer el estado actual para no perder ninguna transición.
+        subscriber = events.subscribe(job_id)
+        try:
+            # El bus solo sabe de los jobs de este proceso; los demás se leen de la base de datos.
+            event = (events.latest(job_id) if executor.runs_locally(job_id) else None) or _load_job_event(job_id)
+            if event is None:
+                yield _sse({"job_id": job_id, "stage": "not_found", "status": "not_found"})
+                return
+            position = executor.queue_position(job_id)
+            yield _sse({**event, "queue_position": position})
+
+            last_sent = last_db_check = time.monotonic()
+            while event["stage"] not in TERMINAL_STAGES:
+                try:
+                    event = subscriber.get(timeout=SSE_TICK_SECONDS)
+                    # Pasada la cola ya no hay posición que calcular.
+                    position = executor.queue_position(job_id) if event["stage"] == "queued" else 0
+                    yield _sse({**event, "queue_position": position})
+                    last_sent = time.monotonic()
+                    continue
+                except queue.Empty:
+                    pass
+
+                if executor.runs_locally(job_id):
+                    # La posición sale de la cola en memoria: se puede mirar en cada vuelta.
+                    new_position = executor.queue_position(job_id)
+                elif time.monotonic() - last_db_check >= SSE_DB_RECHECK_SECONDS:
+                    # El job corre (o espera) en otro proceso: no nos llegarán eventos, así que
+                    # estado y posición se consultan en la base de datos, pero sin prisa.
+                    last_db_check = time.monotonic()
+                    refreshed = _load_job_event(job_id)
+                    if refreshed and (refreshed["stage"], refreshed.get("partial")) != (event["stage"], event.get("partial")):
+                        event = refreshed
+                        yield _sse(event)
+                        last_sent = time.monotonic()
+                        continue
+                    new_position = executor.queue_position(job_id)
+                else:
+                    new_position = position
+
+                if new_position != position:
+                    position = new_position
+                    yield _sse({**event, "queue_position": position})
+                    last_sent = time.monotonic()
+                elif time.monotonic() - last_sent >= SSE_KEEPALIVE_SECONDS:
+                    yield ": keepalive\n\n"
+                    last_sent = time.monotonic()
+        finally:
+            events.unsubscribe(job_id, subscriber)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _first_output_stats():
+    times = sorted(first_output_times)
+    if not times:
+        return {"count": 0}
+    return {"count": len(times), "last": first_output_times[-1], "p50": times[len(times) // 2],
+            "max": times[-1], "avg": int(sum(times) / len(times))}
+
+@app.route('/stats')
+def stats():
+    replica = get_replica()
+    return jsonify({"queue": executor.stats(), "db_pool": get_pool().stats(),
+                    "db_replica": replica.stats() if replica else None,
+                    "youtube_quota": youtube_logic.quota_usage.report(),
+                    "youtube_cache": youtube_logic.channel_cache.stats(),
+                    "llm_cache": llm_cache.stats(),
+                    "llm": llm_analyzer.get_client().stats(),
+                    "scheduler": scheduler.stats(),
+                    "first_output_ms": _first_output_stats()})
+
+def _runtime_metrics():
+    queue_stats = executor.stats()
+    pool_stats = get_pool().stats()
+    quota = youtube_logic.quota_usage.report()
+    return [
+        ("analysis_queue_depth", "gauge", "Análisis esperando un worker.", [({}, queue_stats["queue_depth"])]),
+        ("analysis_active_workers", "gauge", "Workers ejecutando un análisis.", [({}, queue_stats["active_workers"])]),
+        ("analysis_jobs_completed_total", "counter", "Análisis terminados por este proceso.", [({}, queue_stats["completed"])]),
+        ("youtube_api_calls_total", "counter", "Llamadas a la API de YouTube por método.",
+         [({"method": method}, count) for method, count in quota["calls"].items()]),
+        ("youtube_quota_units_total", "counter", "Unidades de cuota de YouTube consumidas.", [({}, quota["units"])]),
+        ("db_pool_connections", "gauge", "Conexiones del pool por estado.",
+         [({"state": key}, value) for key, value in pool_stats.items() if key in ("idle", "in_use")]),
+    ]
+
+metrics.register_collector(_runtime_metrics)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/profile/<job_id>')
+def job_profile(job_id):
+    """Resumen del perfil de un análisis lanzado con ?profile=1. ?format=raw descarga el .prof."""
+    path = os.path.join(PROFILE_DIR, f"{job_id}.prof")
+    if not os.path.exists(path):
+        return jsonify({"error": "No hay perfil para este análisis."}), 404
+    if request.args.get('format') == 'raw':
+        return send_file(os.path.abspath(path), as_attachment=True, download_name=f"{job_id}.prof")
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats("cumulative").print_stats(int(request.args.get('limit', 40)))
+    return Response(output.getvalue(), mimetype="text/plain")
 
 @app.route('/historial')
 def historial():
-    db = youtube_logic.get_db_connection(); cursor = db.cursor()
-    cursor.execute("SELECT id, channel_name, status, created_at FROM analysis_jobs ORDER BY created_at DESC")
-    jobs = cursor.fetchall(); db.close()
-    return render_template('historial.html', jobs=jobs)
+    """
+    Historial paginado por cursor (created_at, id), con filtros por estado y canal.
+    Los contadores salen de un único GROUP BY en lugar de filtrar la lista en la plantilla.
+    """
+    status = request.args.get('status') or None
+    channel = request.args.get('channel') or None
+    before = request.args.get('before') or None
+    before_id = request.args.get('before_id') or ""
+
+    conditions, params = [], []
+    if channel:
+        conditions.append("channel_name = ?"); params.append(channel)
+    count_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    count_params = list(params)
+
+    if status:
+        conditions.append("status = ?"); params.append(status)
+    if before:
+        conditions.append("(created_at < ? OR (created_at = ? AND id < ?))"); params.extend([before, before, before_id])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with get_read_connection() as db:
+        cursor = db.cursor()
+        # Pedimos una fila de más para saber si hay página siguiente.
+        cursor.execute(f"SELECT id, channel_name, status, created_at FROM analysis_jobs {where} "
+                       f"ORDER BY created_at DESC, id DESC LIMIT ?", (*params, HISTORY_PAGE_SIZE + 1))
+        jobs = cursor.fetchall()
+        cursor.execute(f"SELECT status, COUNT(*) FROM analysis_jobs {count_where} GROUP BY status", count_params)
+        counts = {row[0]: row[1] for row in cursor.fetchall()}
+    counts['total'] = sum(counts.values())
+
+    next_cursor = None
+    if len(jobs) > HISTORY_PAGE_SIZE:
+        jobs = jobs[:HISTORY_PAGE_SIZE]
+        next_cursor = {'before': jobs[-1][3], 'before_id': jobs[-1][0]}
+
+    channels = youtube_logic.get_all_saved_channels()
+    return render_template('historial.html', jobs=jobs, counts=counts, status=status, channel=channel,
+                           channels=channels, next_cursor=next_cursor, is_first_page=not before)
+
+@app.route('/temas')
+def topics():
+    """
+    Ranking de temas por vistas calculado en local, sin LLM. Por defecto usa los videos
+    de la ventana de todos los canales guardados; ?channel_id= filtra un canal y ?job_id=
+    usa exactamente los videos que analizó ese job. ?rank_by=velocity ordena por vistas por hora.
+    """
+    top = request.args.get('top', topic_ranking.TOPIC_TOP_VIDEOS, type=int)
+    rank_by = request.args.get('rank_by', topic_ranking.TOPIC_RANK_BY)
+    if rank_by not in topic_ranking.RANK_BY_OPTIONS:
+        return jsonify({"error": f"rank_by debe ser uno de {', '.join(topic_ranking.RANK_BY_OPTIONS)}."}), 400
+    job_id = request.args.get('job_id')
+    if job_id:
+        blob = raw_store.load(job_id)
+        if blob is None:
+            return jsonify({"error": "No hay datos guardados para este análisis."}), 404
+        video_data = raw_store.decode(blob)
+    else:
+        video_data = video_store.get_window_videos(youtube_logic.window_start(), request.args.get('channel_id'))
+    return jsonify(topic_ranking.rank_topics(video_data, top_videos=max(0, top), rank_by=rank_by))
+
+@app.route('/velocidad')
+def video_velocity():
+    """Videos de la ventana ordenados por vistas por hora. ?channel_id= filtra un canal."""
+    limit = request.args.get('limit', 50, type=int)
+    videos = video_store.rank_by_velocity(youtube_logic.window_start(), request.args.get('channel_id'),
+                                          limit=max(1, min(limit, 1000)))
+    return jsonify({"window_hours": video_store.VELOCITY_WINDOW_HOURS, "videos": videos})
+
+@app.route('/velocidad/<video_id>')
+def video_view_series(video_id):
+    """Serie temporal de vistas de un video, con la velocidad entre fotos consecutivas."""
+    series = video_store.get_view_series(video_id)
+    if not series:
+        return jsonify({"error": "No hay estadísticas guardadas para este video."}), 404
+    points = []
+    for i, (observed_at, views) in enumerate(series):
+        point = {"observed_at": datetime.fromtimestamp(observed_at, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'), "views": views}
+        if i:
+            hours = (observed_at - series[i - 1][0]) / 3600
+            point["views_per_hour"] = round((views - series[i - 1][1]) / hours, 1) if hours else None
+        points.append(point)
+    return jsonify({"video_id": video_id, "points": points})
 
 # --- ¡NUEVA RUTA PARA DESCARGAR EL JSON! ---
 @app.route('/download/<job_id>')
 def download_json(job_id):
-    db = youtube_logic.get_db_connection()
-    cursor = db.cursor()
-    cursor.execute("SELECT raw_json_data, channel_name FROM analysis_jobs WHERE id = ?", (job_id,))
-    job = cursor.fetchone()
-    db.close()
-
-    if job and job[0]:
-        json_data = job[0]
-        channel_name = job[1].replace(" ", "_")
-        filename = f"datos_{channel_name}_{job_id[:8]}.json"
-        
-        return Response(
-            json_data,
-            mimetype="application/json",
-            headers={"Content-disposition": f"attachment; filename={filename}"}
-        )
-    else:
+    """
+    Descarga los datos crudos por trozos. Si el cliente acepta gzip se envía el blob
+    guardado tal cual; con ?format=ndjson se envía un video por línea.
+    """
+    with get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT channel_name FROM analysis_jobs WHERE id = ?", (job_id,))
+        job = cursor.fetchone()
+    blob = raw_store.load(job_id) if job else None
+
+    if not blob:
         flash("No se encontraron datos JSON para descargar para este análisis.")
         return redirect(url_for('historial'))
 
+    channel_name = (job[0] or "canal").replace(" ", "_")
+    if request.args.get('format') == 'ndjson':
+        filename = f"datos_{channel_name}_{job_id[:8]}.ndjson"
+        return Response(raw_store.iter_ndjson(blob), mimetype="application/x-ndjson",
+                        headers={"Content-disposition": f"attachment; filename={filename}"})
+
+    filename = f"datos_{channel_name}_{job_id[:8]}.json"
+    headers = {"Content-disposition": f"attachment; filename={filename}", "Vary": "Accept-Encoding"}
+    if "gzip" in request.accept_encodings:
+        headers["Content-Encoding"] = "gzip"
+        headers["Content-Length"] = str(len(blob))
+        return Response(raw_store.iter_gzip(blob), mimetype="application/json", headers=headers)
+    return Response(raw_store.iter_json(blob), mimetype="application/json", headers=headers)
+
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
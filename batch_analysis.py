@@ -0,0 +1,144 @@
+# batch_analysis.py
+# Análisis de todos los canales guardados a la vez: las ingestas de cada canal corren
+# en paralelo (con un límite) y los IDs de todos los canales se empaquetan juntos en
+# peticiones videos.list de 50, en lugar de que cada canal gaste sus propios lotes incompletos.
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import llm_cache
+import video_store
+import youtube_logic
+from youtube_cache import channel_cache
+
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 4))
+# Clave con la que el ejecutor agrupa los análisis "de todos los canales".
+BATCH_CHANNEL_KEY = "__all__"
+
+BATCH_ECONOMIC_CONCERN = youtube_logic.GROK_ECONOMIC_CONCERN + """ The JSON groups the videos by channel name. Answer first for all channels combined, then add a short section per channel with its main topic and its most viewed videos."""
+
+
+def _collect_channel(channel, since, quota, force_refresh):
+    """Devuelve (videos_en_caché, ids_a_refrescar) para un canal."""
+    channel_id = channel['channel_id']
+    if not force_refresh:
+        cached = channel_cache.get(youtube_logic.videos_cache_key(channel_id), channel_cache.ttl_for(channel_id))
+        if cached is not None:
+            return cached, []
+    try:
+        return None, youtube_logic.collect_window_video_ids(channel_id, since, quota)
+    except Exception as e:
+        print(f"Error al obtener videos de YouTube para {channel_id}: {e}")
+        return [], []
+
+
+def fetch_all_channels(channels, max_concurrency=BATCH_MAX_CONCURRENCY, quota=None, force_refresh=False):
+    """
+    Descarga los videos de la ventana de todos los canales. Devuelve un dict
+    channel_id -> lista de videos (mismo formato que get_channel_videos_last_week).
+    """
+    youtube_logic.get_youtube()   # ConnectionError si la API no está configurada
+
+    since = youtube_logic.window_start()
+    workers = max(1, min(max_concurrency, len(channels)))
+    results = {}
+    ids_to_fetch = {}   # channel_id -> ids
+
+    # 1. Recorrer las playlists de subidas de todos los canales en paralelo.
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        collected = pool.map(lambda c: _collect_channel(c, since, quota, force_refresh), channels)
+        for channel, (cached, video_ids) in zip(channels, collected):
+            if cached is not None:
+                results[channel['channel_id']] = cached
+            elif video_ids:
+                ids_to_fetch[channel['channel_id']] = video_ids
+            else:
+                results[channel['channel_id']] = []
+
+    # 2. Empaquetar los IDs de todos los canales en lotes completos de 50 y pedirlos en paralelo.
+    all_ids = [video_id for video_ids in ids_to_fetch.values() for video_id in video_ids]
+    batches = [all_ids[i:i+50] for i in range(0, len(all_ids), 50)]
+    details = []
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(batches)))) as pool:
+            for batch_details in pool.map(lambda ids: youtube_logic.fetch_video_details(ids, quota), batches):
+                details.extend(batch_details)
+    details = [d for d in details if d['published_at'] >= since]
+    video_store.upsert_videos(details)
+    velocities = video_store.get_velocities([d['video_id'] for d in details])
+
+    # 3. Repartir por canal y guardar en caché igual que el análisis individual.
+    by_channel = {}
+    for d in details:
+        by_channel.setdefault(d['channel_id'], []).append(d)
+    for channel_id in ids_to_fetch:
+        videos = youtube_logic.to_analysis_videos(by_channel.get(channel_id, []), velocities)
+        results[channel_id] = videos
+        if videos:
+            channel_cache.set(youtube_logic.videos_cache_key(channel_id), videos)
+
+    return results
+
+
+def channel_labels(channels):
+    """
+    channel_id -> nombre con el que el canal aparece ante el LLM y en los datos guardados.
+    Los canales se agrupan siempre por ID; si dos comparten nombre se añade el ID para
+    que no se mezclen.
+    """
+    counts = {}
+    for channel in channels:
+        counts[channel['channel_name']] = counts.get(channel['channel_name'], 0) + 1
+    return {c['channel_id']: c['channel_name'] if counts[c['channel_name']] == 1 else f"{c['channel_name']} ({c['channel_id']})"
+            for c in channels}
+
+
+def channel_breakdown(channels, videos_by_channel, top=5):
+    """Resumen local por canal: número de videos, vistas totales y los más vistos."""
+    breakdown = []
+    for channel in channels:
+        videos = videos_by_channel.get(channel['channel_id'], [])
+        breakdown.append({
+            'channel_id': channel['channel_id'],
+            'channel_name': channel['channel_name'],
+            'video_count': len(videos),
+            'total_views': sum(v['views'] for v in videos),
+            'top_videos': sorted(videos, key=lambda v: v['views'], reverse=True)[:top],
+        })
+    breakdown.sort(key=lambda b: b['total_views'], reverse=True)
+    return breakdown
+
+
+def format_breakdown(breakdown):
+    lines = ["", "---", "Resumen por canal (calculado localmente):"]
+    for entry in breakdown:
+        lines.append(f"\n• {entry['channel_name']}: {entry['video_count']} videos, {entry['total_views']:,} vistas")
+        for video in entry['top_videos']:
+            lines.append(f"    - {video['title']} ({video['views']:,} vistas) {video['url']}")
+    return "\n".join(lines)
+
+
+def run_batch_analysis(channels, max_concurrency=BATCH_MAX_CONCURRENCY, quota=None, force_refresh=False,
+                       on_videos=None, usage=None, on_chunk=None, videos=None):
+    """
+    Analiza todos los canales juntos. Devuelve (texto_resultado, datos_por_canal, breakdown, cache_hit).
+    El LLM recibe un único JSON agrupado por canal, con el nombre de `channel_labels`
+    como clave. `on_videos(datos_por_canal)`
+    se llama con los datos ya descargados, justo antes de llamar al LLM. En `usage`
+    se anotan los tokens enviados y `on_chunk` recibe la respuesta del LLM en streaming.
+    Con `videos` (datos por nombre de canal de un intento anterior) no se llama a YouTube.
+    """
+    labels = channel_labels(channels)
+    if videos is None:
+        videos_by_channel = fetch_all_channels(channels, max_concurrency, quota, force_refresh)
+    else:
+        videos_by_channel = {channel_id: videos.get(label, []) for channel_id, label in labels.items()}
+    grouped = {labels[c['channel_id']]: videos_by_channel[c['channel_id']] for c in channels
+               if videos_by_channel.get(c['channel_id'])}
+    if not grouped:
+        raise ValueError("No se encontraron videos recientes en ninguno de los canales.")
+    if on_videos:
+        on_videos(grouped)
+
+    breakdown = channel_breakdown(channels, videos_by_channel)
+    analysis, cache_hit = llm_cache.analyze(BATCH_ECONOMIC_CONCERN, grouped, usage=usage, on_chunk=on_chunk)
+    return analysis + "\n" + format_breakdown(breakdown), grouped, breakdown, cache_hit
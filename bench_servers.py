@@ -0,0 +1,187 @@
+# bench_servers.py
+# Servidores HTTP locales que imitan a la API de YouTube Data v3 y a OpenRouter, con
+# latencia, número de páginas y tasa de errores configurables. Los usa benchmark.py para
+# medir la app sin red ni cuota: el cliente de YouTube se apunta a ellos con
+# YOUTUBE_API_ENDPOINT y el del LLM con OPENROUTER_API_URL.
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.server.fake.handle_get(self)
+
+    def do_POST(self):
+        self.server.fake.handle_post(self)
+
+
+class _FakeServer:
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = Counter()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._server = None
+
+    def _should_fail(self):
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    def start(self, port=0):
+        """Arranca el servidor en un hilo y devuelve su URL base."""
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def handle_get(self, handler):
+        handler.send_json(404, {"error": "not found"})
+
+    def handle_post(self, handler):
+        handler.send_json(404, {"error": "not found"})
+
+
+class FakeYouTube(_FakeServer):
+    """
+    Canales `UCbench000`, `UCbench001`... con `videos_per_channel` videos cada uno, uno cada
+    `hours_between_videos` horas hacia atrás. La playlist de subidas se pagina de 50 en 50.
+    channels.list responde por ID o por handle (@bench000...).
+    """
+
+    def __init__(self, channels=10, videos_per_channel=120, hours_between_videos=1.0, **kwargs):
+        super().__init__(**kwargs)
+        now = datetime.now(timezone.utc)
+        self.channel_ids = [f"UCbench{i:03d}" for i in range(channels)]
+        self.videos = {}
+        for channel_id in self.channel_ids:
+            self.videos[channel_id] = [
+                (f"{channel_id}v{j:05d}",
+                 (now - timedelta(hours=j * hours_between_videos)).strftime('%Y-%m-%dT%H:%M:%SZ'))
+                for j in range(videos_per_channel)
+            ]
+        self.video_index = {video_id: (channel_id, published) for channel_id, videos in self.videos.items()
+                            for video_id, published in videos}
+
+    def handle_get(self, handler):
+        url = urlparse(handler.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        method = url.path.rsplit("/", 1)[-1]
+        self.requests[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self._should_fail():
+            return handler.send_json(503, {"error": {"code": 503, "message": "Backend Error"}})
+
+        if method == "channels":
+            if "forHandle" in params:
+                # El handle de cada canal es su ID sin el prefijo UC: @bench000, @bench001...
+                handle = params["forHandle"].lstrip("@").lower()
+                ids = [cid for cid in self.videos if cid[2:].lower() == handle]
+            else:
+                ids = [cid for cid in params.get("id", "").split(",") if cid in self.videos]
+            items = [{"id": cid, "snippet": {"title": f"Canal {cid[2:]}"},
+                      "contentDetails": {"relatedPlaylists": {"uploads": "UU" + cid[2:]}}} for cid in ids]
+            return handler.send_json(200, {"items": items})
+
+        if method == "playlistItems":
+            channel_id = "UC" + params.get("playlistId", "")[2:]
+            videos = self.videos.get(channel_id)
+            if videos is None:
+                return handler.send_json(404, {"error": {"code": 404, "message": "playlistNotFound"}})
+            start = int(params.get("pageToken") or 0)
+            size = int(params.get("maxResults", 5))
+            body = {"items": [{"contentDetails": {"videoId": video_id, "videoPublishedAt": published}}
+                              for video_id, published in videos[start:start + size]]}
+            if start + size < len(videos):
+                body["nextPageToken"] = str(start + size)
+            return handler.send_json(200, body)
+
+        if method == "videos":
+            items = []
+            for video_id in params.get("id", "").split(","):
+                if video_id not in self.video_index:
+                    continue
+                channel_id, published = self.video_index[video_id]
+                items.append({
+                    "id": video_id,
+                    "snippet": {"channelId": channel_id, "publishedAt": published,
+                                "title": f"Inflación, precios y empleo: análisis {video_id}"},
+                    "statistics": {"viewCount": str(zlib.crc32(video_id.encode()) % 1000000)},
+                })
+            return handler.send_json(200, {"items": items})
+
+        handler.send_json(404, {"error": {"code": 404, "message": "notFound"}})
+
+
+class FakeOpenRouter(_FakeServer):
+    """
+    Responde a /api/v1/chat/completions tras `latency` segundos, con o sin streaming.
+    Los errores simulados son 429 con Retry-After, como los del modelo gratuito.
+    """
+
+    def __init__(self, response_words=200, chunk_delay=0.0, retry_after=0.1, **kwargs):
+        super().__init__(**kwargs)
+        self.response_words = response_words
+        self.chunk_delay = chunk_delay
+        self.retry_after = retry_after
+
+    def handle_post(self, handler):
+        length = int(handler.headers.get("Content-Length", 0))
+        body = json.loads(handler.rfile.read(length) or b"{}")
+        self.requests[body.get("model", "?")] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self._should_fail():
+            return handler.send_json(429, {"error": {"code": 429, "message": "Rate limit exceeded"}},
+                                     {"Retry-After": str(self.retry_after)})
+
+        words = [f"palabra{i} " for i in range(self.response_words)]
+        if not body.get("stream"):
+            return handler.send_json(200, {"choices": [{"message": {"content": "".join(words)}}]})
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+        handler.wfile.write(b": OPENROUTER PROCESSING\n\n")
+        for start in range(0, len(words), 10):
+            if self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            delta = {"choices": [{"delta": {"content": "".join(words[start:start + 10])}}]}
+            handler.wfile.write(f"data: {json.dumps(delta)}\n\n".encode("utf-8"))
+            handler.wfile.flush()
+        # Como OpenRouter, el stream termina con un fragmento que solo trae el uso de tokens.
+        usage = {"choices": [], "usage": {"prompt_tokens": len(json.dumps(body)) // 4,
+                                          "completion_tokens": len(words), "total_tokens": len(json.dumps(body)) // 4 + len(words)}}
+        handler.wfile.write(f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+        handler.wfile.write(b"data: [DONE]\n\n")
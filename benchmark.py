@@ -0,0 +1,220 @@
+# benchmark.py
+"""
+Benchmark sin red: YouTube y OpenRouter se sustituyen por los servidores falsos de
+bench_servers.py y Turso por un fichero libsql local, que se recrea en cada ejecución.
+Mide bajo carga concurrente la descarga de videos, el análisis completo y las rutas
+de la app, y escribe throughput y latencias p50/p95/p99 en JSON.
+
+Uso:
+    python benchmark.py --output bench.json
+    python benchmark.py --scenarios routes --requests 2000 --concurrency 16
+    python benchmark.py --youtube-latency 0.05 --youtube-error-rate 0.02 --llm-latency 0.5
+    DB_POOL_SIZE=0 python benchmark.py ...   # sin pool: una conexión nueva por petición
+    python benchmark.py --scenarios routes --replica   # lecturas de / y /historial desde una réplica local
+    python benchmark.py --replica --check              # termina con código 1 si hubo algún error
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+
+from bench_servers import FakeOpenRouter, FakeYouTube
+
+SCENARIOS = ("youtube", "analysis", "routes")
+
+
+def percentile(sorted_values, pct):
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def measure(name, operation, total, concurrency):
+    """
+    Ejecuta `operation(i)` `total` veces repartidas en `concurrency` hilos. La operación
+    devuelve True si fue bien; una excepción también cuenta como error.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                error = None if operation(i) else "operación fallida"
+            except Exception as e:
+                error = repr(e)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if error:
+                    errors.append(error)
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(concurrency, total)))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        "name": name, "requests": len(latencies), "errors": len(errors), "concurrency": concurrency,
+        "seconds": round(elapsed, 3), "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 50)), "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)), "max_ms": ms(latencies[-1] if latencies else None),
+        "sample_errors": sorted(set(errors))[:3],
+    }
+
+
+def seed_database(channel_ids, history_jobs):
+    """Guarda los canales del YouTube falso y un historial de jobs. Devuelve el id de un job completado."""
+    import raw_store
+    from db_pool import get_connection
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("INSERT OR IGNORE INTO channels (channel_id, channel_name, category) VALUES (?, ?, ?)",
+                           [(cid, f"Canal {cid[-3:]}", "Noticias") for cid in channel_ids])
+        jobs = [(str(uuid.uuid4()), "completed" if i % 5 else "failed", "Resultado de prueba " * 200,
+                 f"Canal {channel_ids[i % len(channel_ids)][-3:]}", channel_ids[i % len(channel_ids)])
+                for i in range(history_jobs)]
+        cursor.executemany("INSERT INTO analysis_jobs (id, status, result, channel_name, channel_id) VALUES (?, ?, ?, ?, ?)",
+                           jobs)
+        conn.commit()
+    job_id = jobs[1][0]
+    raw_store.save(job_id, [{"title": f"Video {i}", "views": i * 1000, "url": f"https://www.youtube.com/watch?v=v{i:010d}"}
+                            for i in range(200)])
+    return job_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench.db", help="Fichero libsql local que hace de base de datos (se borra)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Separados por comas: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=500, help="Peticiones por ruta")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--videos-per-channel", type=int, default=120, help="Define cuántas páginas tiene cada playlist")
+    parser.add_argument("--hours-between-videos", type=float, default=1.0)
+    parser.add_argument("--youtube-latency", type=float, default=0.02)
+    parser.add_argument("--youtube-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--analyses", type=int, default=20, help="Análisis completos a ejecutar")
+    parser.add_argument("--history-jobs", type=int, default=300)
+    parser.add_argument("--replica", action="store_true", help="Servir las lecturas desde una réplica local (<db>.replica)")
+    parser.add_argument("--check", action="store_true",
+                        help="Terminar con código 1 si alguna operación o sincronización de la réplica falló")
+    parser.add_argument("--output", help="Guardar el informe JSON en este fichero además de imprimirlo")
+    args = parser.parse_args()
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+
+    fake_youtube = FakeYouTube(channels=args.channels, videos_per_channel=args.videos_per_channel,
+                               hours_between_videos=args.hours_between_videos, latency=args.youtube_latency,
+                               error_rate=args.youtube_error_rate, seed=1)
+    fake_llm = FakeOpenRouter(latency=args.llm_latency, error_rate=args.llm_error_rate, seed=1)
+    youtube_url = fake_youtube.start()
+    llm_url = fake_llm.start()
+
+    # Los módulos de la app leen la configuración al importarse, así que hay que fijarla antes.
+    replica_path = f"{args.db}.replica"
+    for path in (args.db, replica_path):
+        if os.path.exists(path):
+            os.remove(path)
+    if args.replica:
+        os.environ["DB_REPLICA_PATH"] = replica_path
+    os.environ.update({
+        "DB_URL": args.db, "DB_AUTH_TOKEN": "local",
+        "YOUTUBE_API_KEY": "bench", "YOUTUBE_API_ENDPOINT": youtube_url,
+        "OPENROUTER_API_KEY": "bench", "OPENROUTER_API_URL": f"{llm_url}/api/v1/chat/completions",
+        "LLM_CACHE_ENABLED": "0", "LLM_BACKOFF_BASE": "0.05", "SCHEDULER_ENABLED": "0",
+    })
+    import migrations
+    import analysis_tasks
+    import app as webapp
+    import youtube_logic
+    from db_pool import get_pool, get_replica
+
+    migrations.migrate()
+    job_id = seed_database(fake_youtube.channel_ids, args.history_jobs)
+    channel_ids = fake_youtube.channel_ids
+    results = []
+
+    if "youtube" in scenarios:
+        def fetch(i, force_refresh):
+            return bool(youtube_logic.get_channel_videos_last_week(channel_ids[i % len(channel_ids)],
+                                                                   force_refresh=force_refresh))
+        total = len(channel_ids) * 5
+        results.append(measure("get_channel_videos_last_week (sin caché)", lambda i: fetch(i, True), total, args.concurrency))
+        results.append(measure("get_channel_videos_last_week (con caché)", lambda i: fetch(i, False), total, args.concurrency))
+
+    if "analysis" in scenarios:
+        def analyze(i):
+            channel_id = channel_ids[i % len(channel_ids)]
+            new_job_id = analysis_tasks.create_job(f"Canal {channel_id[-3:]}", channel_id)
+            analysis_tasks.run_analysis_task(new_job_id, channel_id, force_refresh=True)
+            status = webapp.app.test_client().get(f"/status/{new_job_id}").get_json()["status"]
+            return status == "completed"
+        results.append(measure("run_analysis_task", analyze, args.analyses, args.concurrency))
+
+    if "routes" in scenarios:
+        local = threading.local()
+
+        def get(path, headers=None):
+            def operation(_):
+                if not hasattr(local, "client"):
+                    local.client = webapp.app.test_client()
+                response = local.client.get(path, headers=headers)
+                response.get_data()
+                return response.status_code < 400
+            return operation
+
+        for path, headers in (("/", None), (f"/status/{job_id}", None), ("/historial", None),
+                              ("/historial?status=completed", None), (f"/download/{job_id}", None),
+                              (f"/download/{job_id}", {"Accept-Encoding": "gzip"})):
+            name = f"GET {path}" + (" (gzip)" if headers else "")
+            results.append(measure(name, get(path, headers), args.requests, args.concurrency))
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "check")},
+        "results": results,
+        "db_pool": get_pool().stats(),
+        "db_replica": get_replica().stats() if get_replica() else None,
+        "youtube_requests": dict(fake_youtube.requests),
+        "youtube_quota": youtube_logic.quota_usage.report(),
+        "llm_requests": dict(fake_llm.requests),
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    fake_youtube.stop()
+    fake_llm.stop()
+
+    if args.check:
+        failed = [f"{result['name']}: {result['errors']} errores {result['sample_errors']}"
+                  for result in results if result["errors"]]
+        if report["db_replica"] and report["db_replica"]["sync_errors"]:
+            failed.append(f"réplica: {report['db_replica']['sync_errors']} sincronizaciones fallidas "
+                          f"({report['db_replica']['last_error']})")
+        if failed:
+            print("\n".join(["El benchmark ha tenido errores:"] + failed))
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
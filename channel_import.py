@@ -0,0 +1,305 @@
+# channel_import.py
+"""
+Alta masiva de canales desde un CSV o un JSON con IDs (UC...), @handles o URLs de YouTube.
+
+Cada canal se valida contra la API antes de guardarlo: los IDs con channels.list en
+lotes de 50 (1 unidad de cuota por lote) y los @handles y las URL /user/ con una
+petición cada uno, porque la API solo acepta uno. Los canales ya guardados con su
+playlist de subidas no se consultan. Se guardan el título y la playlist de subidas y
+todo se inserta en una sola transacción. El informe trae el resultado de cada fila y
+las llamadas a la API que se han hecho.
+
+El CSV puede tener cabecera (columnas `channel`, `channel_id`, `handle` o `url`, y
+`category`) o no tenerla: entonces la primera columna es el canal y la segunda, si la
+hay, la categoría. El JSON es una lista de cadenas o de objetos con esas mismas claves.
+
+Uso:
+    python channel_import.py canales.csv [--category Noticias] [--dry-run]
+    python channel_import.py canales.json
+"""
+import argparse
+import csv
+import io
+import json
+import re
+from urllib.parse import unquote, urlparse
+
+import youtube_logic
+from db_pool import get_connection
+
+DEFAULT_CATEGORY = "Noticias"
+ID_PATTERN = re.compile(r"^UC[A-Za-z0-9_-]{22}$")
+HANDLE_PATTERN = re.compile(r"^@[A-Za-z0-9._-]{3,30}$")
+YOUTUBE_HOSTS = ("youtube.com", "www.youtube.com", "m.youtube.com")
+# Columnas (o claves del JSON) que pueden traer el canal, por orden de preferencia.
+VALUE_KEYS = ("channel", "channel_id", "handle", "url", "canal")
+CATEGORY_KEYS = ("category", "categoria", "categoría")
+# Filas por INSERT: cada una lleva 4 parámetros.
+INSERT_BATCH_SIZE = 100
+
+
+class ImportFormatError(ValueError):
+    """El fichero no se puede leer como una lista de canales."""
+
+
+# --- Lectura del fichero ---
+
+def format_for(filename=None, mimetype=None):
+    """'csv' o 'json' según la extensión o el tipo MIME; None para deducirlo del contenido."""
+    name = (filename or "").lower()
+    if name.endswith(".json") or mimetype == "application/json":
+        return "json"
+    if name.endswith(".csv") or mimetype == "text/csv":
+        return "csv"
+    return None
+
+
+def _pick(mapping, keys):
+    for key in keys:
+        value = mapping.get(key)
+        if value not in (None, ""):
+            return str(value).strip()
+    return None
+
+
+def _json_entries(text):
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ImportFormatError(f"El JSON no es válido: {e}")
+    if isinstance(data, dict):
+        data = data.get("channels")
+    if not isinstance(data, list):
+        raise ImportFormatError("El JSON debe ser una lista de canales (o un objeto con la clave 'channels').")
+    entries = []
+    for row, item in enumerate(data, start=1):
+        if isinstance(item, dict):
+            item = {str(key).lower(): value for key, value in item.items()}
+            entries.append({"row": row, "input": _pick(item, VALUE_KEYS) or "", "category": _pick(item, CATEGORY_KEYS)})
+        else:
+            entries.append({"row": row, "input": str(item).strip(), "category": None})
+    return entries
+
+
+def _csv_entries(text):
+    rows = [(row, cells) for row, cells in enumerate(csv.reader(io.StringIO(text)), start=1)
+            if cells and any(cell.strip() for cell in cells) and not cells[0].lstrip().startswith("#")]
+    if not rows:
+        return []
+    header = [cell.strip().lower() for cell in rows[0][1]]
+    if any(key in header for key in VALUE_KEYS):
+        rows = rows[1:]
+        records = [(row, dict(zip(header, cells))) for row, cells in rows]
+        return [{"row": row, "input": _pick(record, VALUE_KEYS) or "", "category": _pick(record, CATEGORY_KEYS)}
+                for row, record in records]
+    return [{"row": row, "input": cells[0].strip(), "category": cells[1].strip() if len(cells) > 1 and cells[1].strip() else None}
+            for row, cells in rows]
+
+
+def parse_entries(text, fmt=None):
+    """
+    Lee el CSV o JSON. Devuelve [{'row', 'input', 'category'}], con `row` la línea del CSV
+    o la posición en la lista JSON. Sin `fmt`, el formato se deduce del contenido.
+    """
+    text = text.lstrip("\ufeff")
+    if fmt is None:
+        fmt = "json" if text.lstrip()[:1] in ("[", "{") else "csv"
+    entries = _json_entries(text) if fmt == "json" else _csv_entries(text)
+    if not entries:
+        raise ImportFormatError("El fichero no contiene canales.")
+    return entries
+
+
+def classify(value):
+    """
+    ('id', channel_id), ('handle', '@handle') o ('username', nombre) para un ID, un @handle
+    o una URL de canal; (None, motivo) si no se reconoce.
+    """
+    value = (value or "").strip()
+    if ID_PATTERN.match(value):
+        return "id", value
+    if HANDLE_PATTERN.match(value):
+        return "handle", value
+    if "youtube.com" in value:
+        url = urlparse(value if "://" in value else "https://" + value)
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        if url.hostname in YOUTUBE_HOSTS and parts:
+            if parts[0] == "channel" and len(parts) > 1 and ID_PATTERN.match(parts[1]):
+                return "id", parts[1]
+            if HANDLE_PATTERN.match(parts[0]):
+                return "handle", parts[0]
+            if parts[0] == "user" and len(parts) > 1:
+                return "username", parts[1]
+            if parts[0] == "c":
+                return None, "Las URL /c/ no se pueden resolver con la API: usa el ID o el @handle del canal."
+    return None, "No es un ID de canal (UC...), un @handle ni una URL de canal de YouTube."
+
+
+# --- Validación y alta ---
+
+def _saved_channels(conn, channel_ids):
+    """{channel_id: (nombre, playlist de subidas)} de los que ya están en `channels`."""
+    saved = {}
+    cursor = conn.cursor()
+    for i in range(0, len(channel_ids), 500):
+        batch = channel_ids[i:i + 500]
+        placeholders = ",".join("?" for _ in batch)
+        cursor.execute(f"SELECT channel_id, channel_name, uploads_playlist_id FROM channels "
+                       f"WHERE channel_id IN ({placeholders})", batch)
+        saved.update({row[0]: (row[1], row[2]) for row in cursor.fetchall()})
+    return saved
+
+
+def _resolve(reports, quota):
+    """Consulta la API por los canales pendientes y anota en cada informe su canal o el error."""
+    by_id = {report["key"]: report for report in reports if report["kind"] == "id"}
+    ids = list(by_id)
+    for i in range(0, len(ids), youtube_logic.CHANNELS_BATCH_SIZE):
+        batch_ids = ids[i:i + youtube_logic.CHANNELS_BATCH_SIZE]
+        try:
+            found = youtube_logic.fetch_channels(batch_ids, quota=quota)
+        except Exception as e:
+            found, error = {}, f"Error consultando la API de YouTube: {e}"
+        else:
+            error = None
+        for channel_id in batch_ids:
+            by_id[channel_id].update(channel=found.get(channel_id), error=error)
+
+    for report in reports:
+        if report["kind"] == "id":
+            continue
+        try:
+            if report["kind"] == "handle":
+                report["channel"] = youtube_logic.find_channel(handle=report["key"], quota=quota)
+            else:
+                report["channel"] = youtube_logic.find_channel(username=report["key"], quota=quota)
+            report["error"] = None
+        except Exception as e:
+            report["channel"], report["error"] = None, f"Error consultando la API de YouTube: {e}"
+
+
+def import_channels(entries, default_category=DEFAULT_CATEGORY, dry_run=False, quota=None):
+    """
+    Valida y guarda los canales de `entries` (ver parse_entries). Con `dry_run` no escribe
+    nada. Devuelve {'rows': [...], 'summary': {estado: filas}, 'api_calls', 'quota_units'};
+    el estado de cada fila es added, exists, duplicate, invalid, not_found o error.
+    """
+    quota = quota or youtube_logic.QuotaTracker()
+    rows, pending, seen = [], [], {}
+    for entry in entries:
+        row = {"row": entry["row"], "input": entry["input"]}
+        rows.append(row)
+        kind, key = classify(entry["input"])
+        if kind is None:
+            row.update(status="invalid", message=key)
+            continue
+        # Los handles y nombres de usuario no distinguen mayúsculas; los IDs sí.
+        seen_key = (kind, key if kind == "id" else key.lower())
+        if seen_key in seen:
+            row.update(status="duplicate", message=f"Repetido de la fila {seen[seen_key]}.")
+            continue
+        seen[seen_key] = entry["row"]
+        pending.append({"row": row, "kind": kind, "key": key,
+                        "category": entry.get("category") or default_category})
+
+    # Los IDs ya guardados con su playlist no gastan cuota.
+    with get_connection() as conn:
+        saved = _saved_channels(conn, [p["key"] for p in pending if p["kind"] == "id"])
+    to_resolve = []
+    for p in pending:
+        known = saved.get(p["key"]) if p["kind"] == "id" else None
+        if known and known[1]:
+            p["row"].update(status="exists", channel_id=p["key"], channel_name=known[0])
+        else:
+            to_resolve.append(p)
+    # Sin conexión prestada mientras se espera a YouTube.
+    _resolve(to_resolve, quota)
+
+    with get_connection() as conn:
+        resolved_ids = [p["channel"]["channel_id"] for p in to_resolve if p["channel"]]
+        saved = _saved_channels(conn, resolved_ids)
+        inserts, inserted_rows, backfills, claimed = [], [], [], {}
+        for p in to_resolve:
+            row, channel = p["row"], p["channel"]
+            if p["error"]:
+                row.update(status="error", message=p["error"])
+                continue
+            if not channel:
+                row.update(status="not_found", message="El canal no existe en YouTube.")
+                continue
+            channel_id = channel["channel_id"]
+            row.update(channel_id=channel_id, channel_name=channel["channel_name"])
+            if channel_id in claimed:
+                row.update(status="duplicate", message=f"Es el mismo canal que la fila {claimed[channel_id]}.")
+            elif channel_id in saved:
+                row.update(status="exists", channel_name=saved[channel_id][0])
+                if not saved[channel_id][1]:
+                    backfills.append((channel["uploads_playlist_id"], channel_id))
+            else:
+                row.update(status="added", category=p["category"])
+                inserted_rows.append(row)
+                inserts.append((channel["channel_name"], channel_id, p["category"], channel["uploads_playlist_id"]))
+            claimed.setdefault(channel_id, row["row"])
+
+        if not dry_run and (inserts or backfills):
+            cursor = conn.cursor()
+            added = set()
+            for i in range(0, len(inserts), INSERT_BATCH_SIZE):
+                batch = inserts[i:i + INSERT_BATCH_SIZE]
+                # Otra importación simultánea puede haber guardado ya alguno: no se pisa y
+                # RETURNING dice cuáles ha insertado esta.
+                cursor.execute("INSERT INTO channels (channel_name, channel_id, category, uploads_playlist_id) VALUES "
+                               + ", ".join("(?, ?, ?, ?)" for _ in batch)
+                               + " ON CONFLICT(channel_id) DO NOTHING RETURNING channel_id",
+                               [value for values in batch for value in values])
+                added.update(row[0] for row in cursor.fetchall())
+            if backfills:
+                cursor.executemany("UPDATE channels SET uploads_playlist_id = ? "
+                                   "WHERE channel_id = ? AND uploads_playlist_id IS NULL", backfills)
+            conn.commit()
+            for row in inserted_rows:
+                if row["channel_id"] not in added:
+                    del row["category"]
+                    row.update(status="duplicate", message="Lo ha guardado otra importación al mismo tiempo.")
+
+    summary = {}
+    for row in rows:
+        summary[row["status"]] = summary.get(row["status"], 0) + 1
+    usage = quota.report()
+    return {"rows": rows, "summary": summary, "dry_run": dry_run,
+            "api_calls": sum(usage["calls"].values()), "quota_units": usage["units"]}
+
+
+def import_file(path, default_category=DEFAULT_CATEGORY, dry_run=False):
+    with open(path, encoding="utf-8-sig") as f:
+        text = f.read()
+    return import_channels(parse_entries(text, format_for(path)), default_category, dry_run)
+
+
+def print_report(report):
+    for row in report["rows"]:
+        channel = f" -> {row['channel_id']} ({row['channel_name']})" if row.get("channel_id") else ""
+        message = f": {row['message']}" if row.get("message") else ""
+        print(f"Fila {row['row']} [{row['status']}] {row['input']}{channel}{message}")
+    counts = ", ".join(f"{status}: {count}" for status, count in sorted(report["summary"].items()))
+    suffix = " (simulación: no se ha guardado nada)" if report["dry_run"] else ""
+    print(f"\n{counts}. {report['api_calls']} llamadas a la API de YouTube, "
+          f"{report['quota_units']} unidades de cuota{suffix}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="Fichero CSV o JSON con los canales")
+    parser.add_argument("--category", default=DEFAULT_CATEGORY, help="Categoría de las filas que no traen una")
+    parser.add_argument("--dry-run", action="store_true", help="Validar sin guardar nada")
+    args = parser.parse_args()
+    try:
+        report = import_file(args.path, args.category, args.dry_run)
+    except (OSError, ImportFormatError) as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
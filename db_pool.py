@@ -0,0 +1,550 @@
+# db_pool.py
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+DB_URL = os.getenv("DB_URL")
+DB_AUTH_TOKEN = os.getenv("DB_AUTH_TOKEN")
+
+# Configuración del pool (todas opcionales en el .env)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))                    # 0 = sin pool, una conexión nueva por uso
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))           # segundos esperando una conexión libre
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", 300))  # se cierran las conexiones ociosas más viejas
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", 30))   # se verifica con SELECT 1 si llevaba más tiempo ociosa
+# Con un fichero local, modo WAL: las lecturas no bloquean las escrituras de otros procesos
+# (varios worker.py sobre la misma base de datos). No afecta a las bases remotas.
+DB_LOCAL_WAL = os.getenv("DB_LOCAL_WAL", "1") == "1"
+DB_LOCAL_BUSY_TIMEOUT = float(os.getenv("DB_LOCAL_BUSY_TIMEOUT", 30))  # segundos esperando el bloqueo de escritura
+
+# Réplica local para lecturas (opcional). Con DB_REPLICA_PATH, las lecturas de la página
+# principal y del historial se hacen contra ese fichero; las escrituras siguen yendo al primario.
+DB_REPLICA_PATH = os.getenv("DB_REPLICA_PATH")
+DB_REPLICA_SYNC_INTERVAL = float(os.getenv("DB_REPLICA_SYNC_INTERVAL", 60))  # segundos entre sincronizaciones
+# Retraso máximo tolerado tras una escritura de este proceso: si el hilo de fondo aún no ha
+# sincronizado pasado este tiempo, las lecturas van al primario.
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", 5))
+
+REMOTE_SCHEMES = ("libsql://", "https://", "http://", "wss://", "ws://")
+
+
+class PoolTimeoutError(Exception):
+    """No se liberó ninguna conexión del pool dentro del tiempo de espera."""
+
+
+def is_remote_url(url):
+    return bool(url) and url.startswith(REMOTE_SCHEMES)
+
+
+def _local_path(url):
+    return url[len("file:"):] if url.startswith("file:") else url
+
+
+def _connect(url, auth_token):
+    """Abre una conexión nueva. Para ficheros locales no hace falta token."""
+    import libsql
+
+    if not url:
+        raise ValueError("DB_URL debe estar configurado en el archivo .env")
+    if is_remote_url(url):
+        if not auth_token:
+            raise ValueError("DB_URL y DB_AUTH_TOKEN deben estar configurados en el archivo .env")
+        return libsql.connect(database=url, auth_token=auth_token)
+    # La espera por el bloqueo la hace _LocalConnection: libsql no suelta el GIL mientras
+    # espera con su propio timeout y dejaría parados al resto de hilos del proceso.
+    return _LocalConnection(libsql.connect(database=url, timeout=0), DB_LOCAL_BUSY_TIMEOUT)
+
+
+def _is_locked(error):
+    return "database is locked" in str(error)
+
+
+class _LocalConnection:
+    """
+    Conexión a un fichero local que, si otro proceso o hilo tiene el bloqueo de escritura,
+    reintenta con esperas cortas hasta `busy_timeout` segundos. Solo se reintenta la
+    sentencia que abre la transacción: a mitad de una, el error llega al llamador.
+    """
+
+    def __init__(self, conn, busy_timeout):
+        self._conn = conn
+        self.busy_timeout = busy_timeout
+
+    def _retry(self, run):
+        deadline = time.monotonic() + self.busy_timeout
+        delay = 0.005
+        while True:
+            in_transaction = self._conn.in_transaction
+            try:
+                return run()
+            except Exception as e:
+                if not _is_locked(e) or in_transaction or time.monotonic() >= deadline:
+                    raise
+            if self._conn.in_transaction:
+                self._conn.rollback()
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, 0.2)
+
+    def execute(self, *args):
+        return self._retry(lambda: self._conn.execute(*args))
+
+    def executemany(self, *args):
+        return self._retry(lambda: self._conn.executemany(*args))
+
+    def cursor(self):
+        return _LocalCursor(self, self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class _LocalCursor:
+    def __init__(self, conn, cursor):
+        self._conn = conn
+        self._cursor = cursor
+        self._rows = None
+
+    def execute(self, sql, *args):
+        self._rows = None
+        if "RETURNING" in sql.upper():
+            # Con RETURNING, libsql no pide el bloqueo hasta leer la primera fila.
+            self._rows = self._conn._retry(lambda: self._cursor.execute(sql, *args).fetchall())
+        else:
+            self._conn._retry(lambda: self._cursor.execute(sql, *args))
+        return self
+
+    def fetchone(self):
+        if self._rows is None:
+            return self._cursor.fetchone()
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        if self._rows is None:
+            return self._cursor.fetchall()
+        rows, self._rows = self._rows, []
+        return rows
+
+    def executemany(self, *args):
+        self._rows = None
+        self._conn._retry(lambda: self._cursor.executemany(*args))
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones libsql seguro entre hilos.
+    Reutiliza conexiones ociosas (la más reciente primero), las verifica si llevan
+    tiempo sin usarse, cierra las que superan el tiempo ocioso máximo y descarta
+    las que fallan para reconectar en el siguiente uso.
+    """
+
+    def __init__(self, url, auth_token=None, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 idle_timeout=DB_POOL_IDLE_TIMEOUT, check_after=DB_POOL_CHECK_AFTER):
+        self.url = url
+        self.auth_token = auth_token
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self._cond = threading.Condition()
+        self._idle = []      # [(conn, último_uso)]
+        self._size = 0       # conexiones abiertas (ociosas + prestadas)
+        self._generation = 0
+        self._born = {}      # id(conn) -> generación en la que se abrió
+        self._created = 0
+        self._reused = 0
+        self._discarded = 0
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self, now):
+        # Se llama con el lock tomado. Las conexiones más viejas están al principio.
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.pop(0)
+            self._born.pop(id(conn), None)
+            self._size -= 1
+            self._discarded += 1
+            self._close_quietly(conn)
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        if self.max_size <= 0:
+            return _connect(self.url, self.auth_token)
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                self._evict_idle(now)
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    self._reused += 1
+                elif self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise PoolTimeoutError(f"No hay conexiones libres en el pool (máximo {self.max_size}).")
+                    self._cond.wait(remaining)
+                    continue
+
+            if conn is None:
+                try:
+                    conn = _connect(self.url, self.auth_token)
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created += 1
+                    self._born[id(conn)] = self._generation
+                return conn
+
+            if time.monotonic() - last_used < self.check_after or self._is_healthy(conn):
+                return conn
+            # La conexión estaba rota: la descartamos y probamos otra vez.
+            self._discard(conn)
+
+    def release(self, conn, broken=False):
+        if self.max_size <= 0:
+            self._close_quietly(conn)
+            return
+        with self._cond:
+            stale = self._born.get(id(conn)) != self._generation
+        if broken or stale:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, conn):
+        self._close_quietly(conn)
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._size -= 1
+            self._discarded += 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            # Deshacemos lo que quedara a medias; si ni eso funciona, la conexión no vale.
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            broken = broken or not self._is_healthy(conn)
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            for conn, _ in idle:
+                self._born.pop(id(conn), None)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def reset(self):
+        """Cierra las conexiones ociosas; las prestadas se cierran al devolverse."""
+        with self._cond:
+            self._generation += 1
+        self.close_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "open": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "created": self._created,
+                "reused": self._reused,
+                "discarded": self._discarded,
+            }
+
+
+class ReadReplica:
+    """
+    Copia local de la base de datos para servir lecturas a velocidad de disco.
+
+    Si el primario es remoto se usa el modo "embedded replica" de libsql (`sync()` solo
+    trae los cambios nuevos); si es un fichero local, la réplica se copia entera con
+    VACUUM INTO. Siempre sincroniza el hilo de fondo: cada `sync_interval` segundos y,
+    además, cuando este proceso confirma una escritura en el primario (`mark_dirty()`),
+    como mucho una vez cada `max_lag / 2` segundos. Las lecturas no esperan a la copia:
+    si la réplica lleva más de `max_lag` segundos por detrás de una escritura, leen del
+    primario. Solo quien acaba de escribir en la misma petición fuerza una
+    sincronización, para ver su propio cambio (ver `get_read_connection`).
+    """
+
+    def __init__(self, path, primary_url, auth_token=None, sync_interval=DB_REPLICA_SYNC_INTERVAL,
+                 max_size=DB_POOL_SIZE, max_lag=DB_REPLICA_MAX_LAG_SECONDS):
+        if not primary_url:
+            raise ValueError("DB_URL debe estar configurado en el archivo .env")
+        if not is_remote_url(primary_url) and os.path.abspath(_local_path(primary_url)) == os.path.abspath(path):
+            raise ValueError("DB_REPLICA_PATH no puede ser el mismo fichero que DB_URL.")
+        self.path = path
+        self.primary_url = primary_url
+        self.auth_token = auth_token
+        self.sync_interval = sync_interval
+        self.max_lag = max_lag
+        self.mode = "embedded" if is_remote_url(primary_url) else "copy"
+        self.pool = ConnectionPool(path, None, max_size)
+        self._lock = threading.Lock()        # una sola sincronización a la vez
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._sync_conn = None               # conexión embedded replica (primario remoto)
+        self._copy_conn = None               # conexión al primario local para copiarlo
+        self._dirty = True                   # todavía no se ha sincronizado nunca
+        self._dirty_since = None             # primera escritura que la réplica aún no tiene
+        self._synced_at = None
+        self._syncs = 0
+        self._errors = 0
+        self._sync_seconds = 0.0
+        self._last_error = None
+        self._reads = 0
+        self._fallback_reads = 0
+        self._forced_syncs = 0
+
+    def _sync_embedded(self):
+        import libsql
+
+        if self._sync_conn is None:
+            self._sync_conn = libsql.connect(self.path, sync_url=self.primary_url, auth_token=self.auth_token or "")
+        self._sync_conn.sync()
+
+    def _sync_copy(self):
+        import libsql
+
+        # Se copia a un temporal y se sustituye de golpe: las lecturas en curso siguen con
+        # el fichero anterior y las conexiones nuevas abren ya la copia completa. La copia
+        # la hace el propio libsql (VACUUM INTO): abrir el primario en WAL con otra
+        # biblioteca de SQLite en el mismo proceso corrompe sus lecturas.
+        tmp_path = f"{self.path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if self._copy_conn is None:
+            self._copy_conn = _connect(self.primary_url, None)
+        self._copy_conn.execute("VACUUM INTO ?", (tmp_path,))
+        target = libsql.connect(tmp_path)
+        try:
+            target.execute("PRAGMA journal_mode=DELETE").fetchall()
+        finally:
+            target.close()
+        os.replace(tmp_path, self.path)
+        self.pool.reset()
+
+    def sync(self):
+        """Trae los cambios del primario. Devuelve True si la réplica quedó al día."""
+        with self._lock:
+            # Se limpia antes de sincronizar: una escritura durante la copia vuelve a marcarla.
+            self._dirty = False
+            dirty_since, self._dirty_since = self._dirty_since, None
+            start = time.monotonic()
+            try:
+                self._sync_embedded() if self.mode == "embedded" else self._sync_copy()
+            except Exception as e:
+                self._dirty = True
+                if self._dirty_since is None:
+                    self._dirty_since = dirty_since
+                self._errors += 1
+                self._last_error = str(e)
+                print(f"Error sincronizando la réplica '{self.path}': {e}")
+                return False
+            self._sync_seconds += time.monotonic() - start
+            self._syncs += 1
+            self._synced_at = time.time()
+            return True
+
+    def mark_dirty(self):
+        if self._dirty_since is None:
+            self._dirty_since = time.monotonic()
+        self._dirty = True
+        self._wake.set()
+
+    def refresh(self, wrote=False):
+        """
+        True si la lectura puede ir a la réplica. Con `wrote` (quien lee acaba de escribir)
+        se sincroniza antes si hace falta; si no, la réplica se usa mientras no supere el
+        retraso máximo y, si lo supera o nunca se ha sincronizado, se lee del primario.
+        """
+        if wrote and self._dirty:
+            with self._lock:
+                dirty = self._dirty
+            if dirty:
+                self._forced_syncs += 1
+                self.sync()
+        dirty_since = self._dirty_since
+        if self._synced_at is None or (dirty_since is not None and time.monotonic() - dirty_since > self.max_lag):
+            self._fallback_reads += 1
+            return False
+        return True
+
+    @contextmanager
+    def connection(self):
+        self._reads += 1
+        with self.pool.connection() as conn:
+            yield conn
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.sync_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            started = time.monotonic()
+            self.sync()
+            # Con escrituras continuas (streaming, latidos...) no se copia sin parar.
+            self._stop.wait(max(0.0, self.max_lag / 2 - (time.monotonic() - started)))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="db-replica-sync", daemon=True)
+            self._wake.set()     # primera copia en cuanto arranca; hasta entonces se lee del primario
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self.pool.close_all()
+        with self._lock:
+            if self._copy_conn is not None:
+                self._copy_conn.close()
+                self._copy_conn = None
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "mode": self.mode,
+            "sync_interval": self.sync_interval,
+            "max_lag": self.max_lag,
+            "dirty": self._dirty,
+            "syncs": self._syncs,
+            "sync_errors": self._errors,
+            "last_error": self._last_error,
+            "seconds_since_sync": round(time.time() - self._synced_at, 1) if self._synced_at else None,
+            "avg_sync_ms": round(self._sync_seconds / self._syncs * 1000, 1) if self._syncs else None,
+            "reads": self._reads,
+            "fallback_reads": self._fallback_reads,
+            "forced_syncs": self._forced_syncs,
+            "pool": self.pool.stats(),
+        }
+
+
+# Escrituras confirmadas por el hilo actual que la réplica quizá aún no tiene.
+_writes = threading.local()
+
+
+def begin_request():
+    """Se llama al empezar cada petición: solo sus propias escrituras fuerzan una sincronización."""
+    _writes.pending = False
+
+
+class _TrackedConnection:
+    """Conexión del primario que avisa a la réplica cada vez que se confirma una escritura."""
+
+    def __init__(self, conn, on_commit):
+        self._conn = conn
+        self._on_commit = on_commit
+
+    def commit(self):
+        self._conn.commit()
+        _writes.pending = True
+        self._on_commit()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_replica = None
+
+
+def _enable_wal(url):
+    """El modo WAL queda guardado en el fichero, así que basta con activarlo una vez."""
+    try:
+        conn = _connect(url, None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL").fetchall()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"No se pudo activar el modo WAL en '{url}': {e}")
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if DB_LOCAL_WAL and DB_URL and not is_remote_url(DB_URL):
+                    _enable_wal(DB_URL)
+                _pool = ConnectionPool(DB_URL, DB_AUTH_TOKEN)
+    return _pool
+
+
+def get_replica():
+    """La réplica de lectura global, o None si DB_REPLICA_PATH no está configurado."""
+    global _replica
+    if _replica is None and DB_REPLICA_PATH:
+        with _pool_lock:
+            if _replica is None:
+                replica = ReadReplica(DB_REPLICA_PATH, DB_URL, DB_AUTH_TOKEN)
+                replica.start()
+                _replica = replica
+    return _replica
+
+
+@contextmanager
+def get_connection():
+    """Presta una conexión del pool global. Uso: `with get_connection() as conn: ...`"""
+    replica = get_replica()
+    with get_pool().connection() as conn:
+        yield _TrackedConnection(conn, replica.mark_dirty) if replica else conn
+
+
+@contextmanager
+def get_read_connection():
+    """
+    Conexión para consultas de solo lectura: de la réplica local si está configurada y
+    no va demasiado retrasada, y del primario si no. Nunca se debe escribir con ella.
+    """
+    replica = get_replica()
+    wrote = getattr(_writes, "pending", False)
+    if replica is not None and replica.refresh(wrote=wrote):
+        if wrote:
+            _writes.pending = False
+        with replica.connection() as conn:
+            yield conn
+    else:
+        with get_pool().connection() as conn:
+            yield conn
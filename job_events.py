@@ -0,0 +1,78 @@
+# job_events.py
+import queue
+import threading
+import time
+
+# Etapas que recorre un análisis, en orden. Las dos últimas son finales.
+STAGES = ("queued", "fetching_videos", "calling_llm", "completed", "failed")
+TERMINAL_STAGES = ("completed", "failed")
+
+# Cuánto tiempo recordamos el último evento de un job ya terminado.
+FINISHED_TTL_SECONDS = 600
+# Y el de un job sin terminar que lleva este tiempo sin publicar nada: lo estará
+# ejecutando otro proceso (o el suyo murió) y aquí nunca llegará su evento final.
+STALE_TTL_SECONDS = 3600
+
+
+class JobEventBus:
+    """
+    Notificaciones en memoria del progreso de cada job.
+    `run_analysis_task` publica las transiciones de etapa y cada cliente SSE
+    se suscribe a su job, así la base de datos solo se toca una vez por transición.
+    """
+
+    def __init__(self, finished_ttl=FINISHED_TTL_SECONDS, stale_ttl=STALE_TTL_SECONDS):
+        self.finished_ttl = finished_ttl
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._latest = {}        # job_id -> último evento
+        self._expires_at = {}    # job_id -> momento a partir del cual se olvida
+        self._subscribers = {}   # job_id -> [queue.Queue]
+
+    def publish(self, job_id, stage, **data):
+        event = {"job_id": job_id, "stage": stage, "status": self._status_for(stage), **data}
+        with self._lock:
+            self._latest[job_id] = event
+            ttl = self.finished_ttl if stage in TERMINAL_STAGES else self.stale_ttl
+            self._expires_at[job_id] = time.monotonic() + ttl
+            subscribers = list(self._subscribers.get(job_id, ()))
+            self._forget_old_jobs()
+        for subscriber in subscribers:
+            subscriber.put(event)
+        return event
+
+    def latest(self, job_id):
+        with self._lock:
+            expires_at = self._expires_at.get(job_id)
+            if expires_at is not None and expires_at < time.monotonic():
+                return None
+            return self._latest.get(job_id)
+
+    def subscribe(self, job_id):
+        subscriber = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(job_id, []).append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, job_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+
+    def _forget_old_jobs(self):
+        # Se llama con el lock tomado.
+        now = time.monotonic()
+        expired = [job_id for job_id, expires_at in self._expires_at.items() if expires_at < now]
+        for job_id in expired:
+            self._expires_at.pop(job_id, None)
+            self._latest.pop(job_id, None)
+
+    @staticmethod
+    def _status_for(stage):
+        return stage if stage in TERMINAL_STAGES else "pending"
+
+
+events = JobEventBus()
@@ -0,0 +1,474 @@
+# job_queue.py
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+from db_pool import get_connection
+from job_events import events
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", 2))
+ANALYSIS_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", 20))
+
+# "local": los análisis corren en hilos de este proceso (AnalysisExecutor).
+# "db": cola compartida en `analysis_jobs` con arrendamientos (DbJobQueue); los ejecutan
+# los workers de `python worker.py`, en esta u otras máquinas, y opcionalmente la propia app.
+JOB_QUEUE_MODE = os.getenv("JOB_QUEUE_MODE", "local")
+JOB_WORKERS_IN_WEB = os.getenv("JOB_WORKERS_IN_WEB", "1") == "1"
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 60))          # un job sin latido durante esto se re-asigna
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", 15))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 2))             # espera entre búsquedas si no hay trabajo
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+
+
+class QueueFullError(Exception):
+    """Se lanza cuando la cola de análisis está llena y no admite más trabajos."""
+
+
+class AnalysisExecutor:
+    """
+    Ejecutor de análisis con un número fijo de workers y una cola acotada.
+    Si ya hay un trabajo en cola o en ejecución para el mismo canal, la nueva
+    petición se une a ese trabajo en lugar de lanzar otro.
+    """
+
+    def __init__(self, task, workers=ANALYSIS_WORKERS, max_queue=ANALYSIS_QUEUE_SIZE):
+        self.task = task
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self._cond = threading.Condition()
+        self._pending = deque()      # (job_id, channel_id, enqueued_at, task, args)
+        self._inflight = {}          # channel_id -> job_id, o un Event mientras se crea su job
+        self._reserved = 0           # huecos reservados por envíos que aún están creando su job
+        self._running = set()
+        self._threads = []
+        self._submitted = 0
+        self._coalesced = 0
+        self._rejected = 0
+        self._completed = 0
+        self._wait_times = deque(maxlen=100)
+        self._job_waits = {}         # job_id -> segundos en cola, mientras se ejecuta
+
+    def _ensure_started(self):
+        # Los workers se arrancan en el primer envío para no crear hilos al importar.
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker_loop, name=f"analysis-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def submit(self, channel_id, create_job, *args, task=None):
+        """
+        Encola un análisis para el canal. `create_job` se llama solo si no hay ya un
+        trabajo en curso y debe devolver el job_id nuevo. Se llama fuera del lock (hace
+        un INSERT en la base de datos) con el hueco del canal ya reservado: otro envío
+        del mismo canal espera a que termine y se une a ese job.
+        `task` reemplaza a la tarea por defecto para este trabajo.
+        Devuelve (job_id, coalesced). Lanza QueueFullError si la cola está llena.
+        """
+        while True:
+            with self._cond:
+                existing = self._inflight.get(channel_id)
+                if existing is None:
+                    if len(self._pending) + self._reserved >= self.max_queue:
+                        self._rejected += 1
+                        raise QueueFullError(f"La cola de análisis está llena ({self.max_queue} trabajos en espera).")
+                    reservation = self._inflight[channel_id] = threading.Event()
+                    self._reserved += 1
+                    break
+                if not isinstance(existing, threading.Event):
+                    self._coalesced += 1
+                    return existing, True
+            existing.wait()
+
+        try:
+            job_id = create_job()
+        except BaseException:
+            with self._cond:
+                self._reserved -= 1
+                del self._inflight[channel_id]
+            reservation.set()
+            raise
+        with self._cond:
+            self._reserved -= 1
+            self._pending.append((job_id, channel_id, time.monotonic(), task or self.task, args))
+            self._inflight[channel_id] = job_id
+            self._submitted += 1
+            self._ensure_started()
+            self._cond.notify()
+        reservation.set()
+        return job_id, False
+
+    def find_inflight(self, channel_id):
+        with self._cond:
+            existing = self._inflight.get(channel_id)
+            return None if isinstance(existing, threading.Event) else existing
+
+    def queue_position(self, job_id):
+        """Posición (1 = el siguiente) de un trabajo en la cola; 0 si ya se está ejecutando; None si no está."""
+        with self._cond:
+            if job_id in self._running:
+                return 0
+            for position, item in enumerate(self._pending, start=1):
+                if item[0] == job_id:
+                    return position
+            return None
+
+    def queued_seconds(self, job_id):
+        """Segundos que el trabajo pasó en la cola; None si no se está ejecutando."""
+        with self._cond:
+            return self._job_waits.get(job_id)
+
+    def runs_locally(self, job_id):
+        """True si el trabajo está en la cola o en ejecución en este proceso (y publica sus eventos aquí)."""
+        with self._cond:
+            return job_id in self._running or any(item[0] == job_id for item in self._pending)
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job_id, channel_id, enqueued_at, task, args = self._pending.popleft()
+                self._running.add(job_id)
+                self._job_waits[job_id] = time.monotonic() - enqueued_at
+                self._wait_times.append(self._job_waits[job_id])
+            try:
+                task(job_id, channel_id, *args)
+            except Exception as e:
+                print(f"Error no controlado en el worker para el job {job_id}: {e}")
+            finally:
+                with self._cond:
+                    self._running.discard(job_id)
+                    self._job_waits.pop(job_id, None)
+                    if self._inflight.get(channel_id) == job_id:
+                        del self._inflight[channel_id]
+                    self._completed += 1
+
+    def stats(self):
+        with self._cond:
+            waits = list(self._wait_times)
+            return {
+                "workers": self.workers,
+                "active_workers": len(self._running),
+                "queue_depth": len(self._pending),
+                "max_queue": self.max_queue,
+                "submitted": self._submitted,
+                "coalesced": self._coalesced,
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "max_wait_seconds": round(max(waits), 3) if waits else 0.0,
+            }
+
+
+def _db_timestamp(ts):
+    """Mismo formato que `analysis_jobs.created_at` (CURRENT_TIMESTAMP de SQLite, UTC)."""
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class DbJobQueue:
+    """
+    Cola de análisis compartida por varios procesos y máquinas. Los jobs pendientes son
+    las filas 'pending' de `analysis_jobs`; un worker se queda con uno insertando (o
+    renovando, si caducó) su fila en `job_leases` con una sola sentencia condicional, y
+    la mantiene viva con latidos. Si el proceso muere, el arrendamiento caduca y otro
+    worker retoma el job; tras JOB_MAX_ATTEMPTS intentos se da por fallido.
+
+    Tiene la misma interfaz que AnalysisExecutor para que la app no distinga el modo.
+    La tarea de cada job la decide `task_for(channel_id)`. Un job con el arrendamiento
+    perdido puede acabar ejecutándose dos veces: las tareas escriben el mismo resultado.
+    """
+
+    _CANDIDATES = """
+        SELECT j.id, j.channel_id, j.options, j.created_at FROM analysis_jobs j
+        LEFT JOIN job_leases l ON l.job_id = j.id
+        WHERE j.status = 'pending' AND (l.job_id IS NULL OR l.expires_at < ?)
+          AND (j.options IS NOT NULL OR j.created_at < ?)
+        ORDER BY j.created_at, j.id LIMIT 10
+    """
+    _CLAIM = """
+        INSERT INTO job_leases (job_id, worker_id, claimed_at, expires_at, heartbeat_at, attempts)
+        SELECT id, ?, ?, ?, ?, 1 FROM analysis_jobs WHERE id = ? AND status = 'pending'
+        ON CONFLICT(job_id) DO UPDATE SET worker_id = excluded.worker_id, claimed_at = excluded.claimed_at,
+            expires_at = excluded.expires_at, heartbeat_at = excluded.heartbeat_at,
+            attempts = job_leases.attempts + 1
+        WHERE job_leases.expires_at < ?
+        RETURNING attempts
+    """
+
+    def __init__(self, task_for, workers=ANALYSIS_WORKERS, max_queue=ANALYSIS_QUEUE_SIZE,
+                 lease_seconds=JOB_LEASE_SECONDS, heartbeat_seconds=JOB_HEARTBEAT_SECONDS,
+                 poll_seconds=JOB_POLL_SECONDS, max_attempts=JOB_MAX_ATTEMPTS, worker_id=None):
+        self.task_for = task_for
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._stop_heartbeat = threading.Event()
+        self._threads = []
+        self._heartbeat_thread = None
+        self._running = {}           # job_id -> channel_id
+        self._job_waits = {}         # job_id -> segundos desde que se creó hasta que se reclamó
+        self._wait_times = deque(maxlen=100)
+        self._submitted = 0
+        self._coalesced = 0
+        self._rejected = 0
+        self._claimed = 0
+        self._resumed = 0
+        self._abandoned = 0
+        self._lost = 0
+        self._completed = 0
+
+    # --- Lado de la app: encolar y consultar ---
+
+    def submit(self, channel_id, create_job, *args, task=None):
+        """
+        Crea el job como 'pending' con sus argumentos en `analysis_jobs.options`; lo
+        ejecutará el primer worker libre. `create_job(db)` debe insertar la fila con esa
+        conexión, sin confirmar. `task` se ignora: la elige `task_for`.
+        """
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # BEGIN IMMEDIATE toma el bloqueo de escritura antes de mirar: dos procesos (o
+            # hilos) que encolan el mismo canal a la vez no pueden crear dos jobs, ni pasarse
+            # del límite de la cola.
+            # (Si algo falla, el pool deshace la transacción al devolver la conexión.)
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT id FROM analysis_jobs WHERE channel_id = ? AND status = 'pending' "
+                           "ORDER BY created_at DESC, id DESC LIMIT 1", (channel_id,))
+            existing = cursor.fetchall()
+            if existing:
+                conn.rollback()
+                with self._lock:
+                    self._coalesced += 1
+                return existing[0][0], True
+            # Los de arrendamiento caducado también esperan worker (como en _CANDIDATES).
+            cursor.execute("SELECT COUNT(*) FROM analysis_jobs j LEFT JOIN job_leases l ON l.job_id = j.id "
+                           "WHERE j.status = 'pending' AND (l.job_id IS NULL OR l.expires_at < ?)", (time.time(),))
+            if cursor.fetchall()[0][0] >= self.max_queue:
+                with self._lock:
+                    self._rejected += 1
+                raise QueueFullError(f"La cola de análisis está llena ({self.max_queue} trabajos en espera).")
+            job_id = create_job(conn)
+            cursor.execute("UPDATE analysis_jobs SET options = ? WHERE id = ?", (json.dumps({"args": list(args)}), job_id))
+            conn.commit()
+        # No se publica "queued": lo más probable es que lo ejecute otro proceso y aquí
+        # nunca llegaría su evento final. Quien lo sigue lo lee de la base de datos.
+        with self._lock:
+            self._submitted += 1
+        self._wake.set()
+        return job_id, False
+
+    def find_inflight(self, channel_id):
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM analysis_jobs WHERE channel_id = ? AND status = 'pending' "
+                           "ORDER BY created_at DESC, id DESC LIMIT 1", (channel_id,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def queue_position(self, job_id):
+        """Posición (1 = el siguiente) entre los jobs sin worker; 0 si alguno lo ejecuta; None si no está pendiente."""
+        if self.runs_locally(job_id):
+            return 0
+        now = time.time()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT j.status, j.created_at, l.expires_at FROM analysis_jobs j "
+                           "LEFT JOIN job_leases l ON l.job_id = j.id WHERE j.id = ?", (job_id,))
+            job = cursor.fetchone()
+            if not job or job[0] != "pending":
+                return None
+            if job[2] is not None and job[2] >= now:
+                return 0
+            cursor.execute(
+                "SELECT COUNT(*) FROM analysis_jobs j LEFT JOIN job_leases l ON l.job_id = j.id "
+                "WHERE j.status = 'pending' AND (l.job_id IS NULL OR l.expires_at < ?) "
+                "AND (j.created_at < ? OR (j.created_at = ? AND j.id < ?))",
+                (now, job[1], job[1], job_id)
+            )
+            return cursor.fetchone()[0] + 1
+
+    def queued_seconds(self, job_id):
+        with self._lock:
+            return self._job_waits.get(job_id)
+
+    def runs_locally(self, job_id):
+        with self._lock:
+            return job_id in self._running
+
+    # --- Lado del worker: reclamar, latir y liberar ---
+
+    def _claim_next(self):
+        """Reclama el job pendiente más antiguo. Devuelve (job_id, channel_id, args, intento) o None."""
+        now = time.time()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # Los jobs sin opciones (anteriores a la cola o de una app en modo local) solo se
+            # toman pasado un arrendamiento, por si su proceso todavía los está ejecutando.
+            cursor.execute(self._CANDIDATES, (now, _db_timestamp(now - self.lease_seconds)))
+            candidates = cursor.fetchall()
+            for job_id, channel_id, options, created_at in candidates:
+                # El job se vuelve a comprobar: otro worker puede haberlo terminado (y soltado
+                # su arrendamiento) después de que leyéramos los candidatos.
+                cursor.execute(self._CLAIM, (self.worker_id, now, now + self.lease_seconds, now, job_id, now))
+                rows = cursor.fetchall()   # fetchall: el RETURNING debe terminar antes del commit
+                conn.commit()
+                if not rows:
+                    continue    # otro worker se adelantó
+                attempt = rows[0][0]
+                if attempt > self.max_attempts:
+                    message = f"Error: el análisis se abandonó tras {self.max_attempts} intentos sin terminar."
+                    cursor.execute("UPDATE analysis_jobs SET status = 'failed', result = ? WHERE id = ? AND status = 'pending'",
+                                   (message, job_id))
+                    cursor.execute("DELETE FROM job_leases WHERE job_id = ?", (job_id,))
+                    conn.commit()
+                    events.publish(job_id, "failed", result=message)
+                    with self._lock:
+                        self._abandoned += 1
+                    print(f"Job {job_id} abandonado tras {self.max_attempts} intentos.")
+                    continue
+                args = json.loads(options).get("args", []) if options else []
+                waited = max(0.0, now - datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
+                             .replace(tzinfo=timezone.utc).timestamp()) if created_at else None
+                with self._lock:
+                    self._running[job_id] = channel_id
+                    self._claimed += 1
+                    if attempt > 1:
+                        self._resumed += 1
+                    if waited is not None:
+                        self._job_waits[job_id] = waited
+                        self._wait_times.append(waited)
+                return job_id, channel_id, args, attempt
+        return None
+
+    def _release(self, job_id):
+        try:
+            with get_connection() as conn:
+                conn.cursor().execute("DELETE FROM job_leases WHERE job_id = ? AND worker_id = ?", (job_id, self.worker_id))
+                conn.commit()
+        except Exception as e:
+            print(f"Error liberando el arrendamiento del job {job_id}: {e}")
+        with self._lock:
+            self._running.pop(job_id, None)
+            self._job_waits.pop(job_id, None)
+            self._completed += 1
+
+    def heartbeat(self):
+        """Renueva los arrendamientos de los jobs de este proceso y limpia los huérfanos."""
+        now = time.time()
+        with self._lock:
+            running = set(self._running)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            if running:
+                cursor.execute("UPDATE job_leases SET expires_at = ?, heartbeat_at = ? WHERE worker_id = ?",
+                               (now + self.lease_seconds, now, self.worker_id))
+                if cursor.rowcount < len(running):
+                    cursor.execute("SELECT job_id FROM job_leases WHERE worker_id = ?", (self.worker_id,))
+                    lost = running - {row[0] for row in cursor.fetchall()}
+                    if lost:
+                        with self._lock:
+                            self._lost += len(lost)
+                        print(f"Arrendamiento perdido para {sorted(lost)}: otro worker los ha retomado.")
+            # Arrendamientos caducados de jobs que ya terminaron (el worker murió antes de liberarlos).
+            cursor.execute("DELETE FROM job_leases WHERE expires_at < ? AND job_id IN "
+                           "(SELECT id FROM analysis_jobs WHERE status != 'pending')", (now,))
+            conn.commit()
+
+    def _heartbeat_loop(self):
+        while not self._stop_heartbeat.wait(self.heartbeat_seconds):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"Error en el latido de los arrendamientos: {e}")
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self._claim_next()
+            except Exception as e:
+                print(f"Error reclamando un job: {e}")
+                claimed = None
+            if claimed is None:
+                # Con jitter, para que varios workers no consulten a la vez.
+                self._wake.wait(self.poll_seconds * random.uniform(0.5, 1.5))
+                self._wake.clear()
+                continue
+            job_id, channel_id, args, attempt = claimed
+            if attempt > 1:
+                print(f"Job {job_id}: reanudado por {self.worker_id} (intento {attempt}).")
+            try:
+                self.task_for(channel_id)(job_id, channel_id, *args)
+            except Exception as e:
+                print(f"Error no controlado en el worker para el job {job_id}: {e}")
+            finally:
+                self._release(job_id)
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        self._stop_heartbeat.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"analysis-worker-{i}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name="job-lease-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+
+    def stop(self, timeout=None):
+        """Deja de reclamar jobs y espera a que terminen los que están en ejecución."""
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        # Los latidos siguen hasta el final para no perder el arrendamiento de un job largo.
+        self._stop_heartbeat.set()
+        if self._heartbeat_thread:
+            self._heartbeat_thread.join(timeout)
+        self._threads = []
+        self._heartbeat_thread = None
+
+    def stats(self):
+        now = time.time()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM analysis_jobs j LEFT JOIN job_leases l ON l.job_id = j.id "
+                           "WHERE j.status = 'pending' AND (l.job_id IS NULL OR l.expires_at < ?)", (now,))
+            queue_depth = cursor.fetchone()[0]
+            cursor.execute("SELECT COUNT(*), COUNT(DISTINCT worker_id) FROM job_leases WHERE expires_at >= ?", (now,))
+            leased, active_nodes = cursor.fetchone()
+        with self._lock:
+            waits = list(self._wait_times)
+            return {
+                "mode": "db",
+                "worker_id": self.worker_id,
+                "workers": self.workers if self._threads else 0,
+                "active_workers": len(self._running),
+                "queue_depth": queue_depth,
+                "max_queue": self.max_queue,
+                "leased": leased,
+                "workers_with_leases": active_nodes,
+                "submitted": self._submitted,
+                "coalesced": self._coalesced,
+                "rejected": self._rejected,
+                "claimed": self._claimed,
+                "resumed": self._resumed,
+                "abandoned": self._abandoned,
+                "lost_leases": self._lost,
+                "completed": self._completed,
+                "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "max_wait_seconds": round(max(waits), 3) if waits else 0.0,
+            }
@@ -1,35 +1,408 @@
 # llm_analyzer.py
 import os
-import requests
 import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
 
+import payload_builder
+import topic_ranking
+
 load_dotenv()
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+# Configurable para poder apuntar a un servidor OpenRouter falso en pruebas y benchmarks.
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "tngtech/deepseek-r1t2-chimera:free")
+# Modelos de respaldo, en orden, separados por comas. Se usan cuando el principal agota sus reintentos.
+OPENROUTER_FALLBACK_MODELS = [m.strip() for m in os.getenv("OPENROUTER_FALLBACK_MODELS", "").split(",") if m.strip()]
+# Cuántos trozos se analizan a la vez cuando los datos no caben en una sola petición.
+LLM_MAP_CONCURRENCY = int(os.getenv("LLM_MAP_CONCURRENCY", 3))
+# Con 1, el LLM recibe el ranking de temas calculado en local (topic_ranking) en lugar de
+# todos los títulos, y la lista completa de videos se añade al resultado sin pasar por él.
+LLM_TOPIC_SUMMARY = os.getenv("LLM_TOPIC_SUMMARY", "1") == "1"
 
-def analyze_with_openrouter(prompt, video_data):
-    if not OPENROUTER_API_KEY:
-        return "Error: OPENROUTER_API_KEY no configurada en .env"
+# Reintentos por modelo y backoff exponencial con jitter (segundos).
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 1))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 30))
+# Si un Retry-After pide esperar más que esto, se pasa directamente al siguiente modelo.
+LLM_RETRY_AFTER_MAX = float(os.getenv("LLM_RETRY_AFTER_MAX", 60))
+# Si la respuesta tarda más de estos segundos, se lanza en paralelo la misma petición al
+# siguiente modelo y gana el primero en responder. 0 desactiva el hedging.
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", 0))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 180))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", 10))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# analyze_with_openrouter devuelve los fallos como texto con alguno de estos prefijos.
+ERROR_PREFIXES = ("Error: ", "Error de comunicación con el LLM")
+
+def is_error_result(text):
+    return not text or text.startswith(ERROR_PREFIXES)
+
+_usage_lock = threading.Lock()
+
+def _record_usage(usage, content):
+    if usage is None:
+        return
+    with _usage_lock:
+        usage["tokens_sent"] = usage.get("tokens_sent", 0) + payload_builder.estimate_tokens(content)
+        usage["payload_bytes"] = usage.get("payload_bytes", 0) + len(content.encode("utf-8"))
+        usage["requests"] = usage.get("requests", 0) + 1
+
+class LLMError(Exception):
+    """Fallo definitivo de una petición al LLM tras agotar reintentos y modelos."""
+
+
+class _Cancelled(Exception):
+    """El intento perdió la carrera frente a otro modelo."""
+
+
+class _RetryableError(LLMError):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(value):
+    """Retry-After puede venir en segundos o como fecha HTTP."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _stream_text(response, on_chunk):
+    """Lee el stream SSE de OpenRouter, llama a `on_chunk` con cada fragmento y devuelve el texto completo."""
+    parts = []
+    for line in response.iter_lines(decode_unicode=True):
+        # OpenRouter intercala comentarios (": OPENROUTER PROCESSING") para mantener viva la conexión.
+        if not line or not line.startswith("data: "):
+            continue
+        data = line[len("data: "):]
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        if "error" in chunk:
+            raise _RetryableError(f"Error en el stream: {chunk['error'].get('message', chunk['error'])}")
+        # El último fragmento puede traer solo el uso de tokens, con "choices" vacío.
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+        delta = (choices[0].get("delta") or {}).get("content")
+        if delta:
+            parts.append(delta)
+            on_chunk(delta)
+    return "".join(parts)
+
+
+class _Race:
+    """
+    Estado compartido por los intentos de una misma petición cuando hay hedging:
+    el primero que reclama la victoria se queda con la salida y los demás se cancelan.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.winner = None
+        self.cancelled = threading.Event()
+        self.responses = set()
+
+    def claim(self, model):
+        with self.lock:
+            if self.winner is None:
+                self.winner = model
+            return self.winner == model
+
+    def track(self, response):
+        with self.lock:
+            self.responses.add(response)
+
+    def untrack(self, response):
+        with self.lock:
+            self.responses.discard(response)
+
+    def cancel_losers(self):
+        """Cierra las respuestas de los intentos que no ganaron, cortando su descarga."""
+        self.cancelled.set()
+        with self.lock:
+            responses = list(self.responses)
+        for response in responses:
+            response.close()
+
+
+class LLMClient:
+    """
+    Cliente de OpenRouter con una sesión HTTP reutilizable (pool de conexiones), una lista
+    ordenada de modelos, reintentos con backoff exponencial con jitter que respeta Retry-After
+    y hedging opcional hacia el siguiente modelo cuando la respuesta tarda demasiado.
+    """
+
+    def __init__(self, api_url=None, api_key=None, models=None, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX, hedge_after=LLM_HEDGE_AFTER,
+                 timeout=LLM_TIMEOUT, pool_size=LLM_POOL_SIZE):
+        self.api_url = api_url or OPENROUTER_API_URL
+        self.api_key = api_key or OPENROUTER_API_KEY
+        self.models = list(models or [OPENROUTER_MODEL] + OPENROUTER_FALLBACK_MODELS)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.timeout = timeout
 
-    video_data_json = json.dumps(video_data, indent=2, ensure_ascii=False)
-    full_content = f"{prompt}\n\n### Video Data (JSON):\n\n{video_data_json}"
+        # requests se importa aquí y no al cargar el módulo, para que el arranque no pague su coste.
+        import requests
+        from requests.adapters import HTTPAdapter
 
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "model": "tngtech/deepseek-r1t2-chimera:free", 
-        "messages": [{"role": "user", "content": full_content}]
-    }
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="llm")
 
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    # --- Métricas por modelo ---
+
+    def _count(self, model, name, latency=None):
+        with self._lock:
+            counters = self._counters.setdefault(model, {
+                "requests": 0, "successes": 0, "errors": 0, "retries": 0, "hedges": 0,
+                "hedge_wins": 0, "cancelled": 0, "latency_total": 0.0, "latency_max": 0.0,
+            })
+            counters[name] += 1
+            if latency is not None:
+                counters["latency_total"] += latency
+                counters["latency_max"] = max(counters["latency_max"], latency)
+
+    def stats(self):
+        with self._lock:
+            per_model = {}
+            for model, c in self._counters.items():
+                per_model[model] = {
+                    **{k: v for k, v in c.items() if not k.startswith("latency_")},
+                    "latency_avg_ms": int(c["latency_total"] / c["successes"] * 1000) if c["successes"] else None,
+                    "latency_max_ms": int(c["latency_max"] * 1000),
+                }
+        return {"models": self.models, "hedge_after": self.hedge_after, "per_model": per_model}
+
+    # --- Peticiones ---
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _request_once(self, model, content, on_chunk, race):
+        import requests
+
+        payload = {"model": model, "messages": [{"role": "user", "content": content}]}
+        if on_chunk:
+            payload["stream"] = True
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+        try:
+            response = self.session.post(self.api_url, headers=headers, json=payload,
+                                         timeout=(10, self.timeout), stream=bool(on_chunk))
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise _RetryableError(f"{type(e).__name__}: {e}")
+
+        race.track(response)
+        try:
+            if race.cancelled.is_set():
+                raise _Cancelled()
+            if response.status_code in RETRYABLE_STATUS:
+                raise _RetryableError(f"HTTP {response.status_code}",
+                                      _parse_retry_after(response.headers.get("Retry-After")))
+            if not response.ok:
+                raise LLMError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+            if on_chunk:
+                def forward(delta):
+                    # En streaming gana el primer modelo que produce texto.
+                    if not race.claim(model):
+                        raise _Cancelled()
+                    on_chunk(delta)
+                try:
+                    return _stream_text(response, forward)
+                except (requests.RequestException, AttributeError, ValueError) as e:
+                    if race.cancelled.is_set() and race.winner != model:
+                        raise _Cancelled()
+                    raise _RetryableError(f"Stream interrumpido: {e}")
+
+            response_json = response.json()
+            if "error" in response_json:
+                raise _RetryableError(f"Error del proveedor: {response_json['error'].get('message', response_json['error'])}")
+            if not race.claim(model):
+                raise _Cancelled()
+            return response_json['choices'][0]['message']['content']
+        finally:
+            race.untrack(response)
+            response.close()
+
+    def _try_model(self, model, content, on_chunk, race, hedged=False):
+        """Intenta un modelo con reintentos. Lanza LLMError si se agotan, _Cancelled si otro ganó."""
+        if hedged:
+            self._count(model, "hedges")
+        for attempt in range(self.max_retries + 1):
+            if race.cancelled.is_set():
+                self._count(model, "cancelled")
+                raise _Cancelled()
+            self._count(model, "requests")
+            started = time.monotonic()
+            try:
+                text = self._request_once(model, content, on_chunk, race)
+            except _Cancelled:
+                self._count(model, "cancelled")
+                raise
+            except _RetryableError as e:
+                self._count(model, "errors")
+                # Si ya se mandó texto al cliente no se puede repetir la petición sin duplicarlo.
+                if race.winner == model:
+                    raise LLMError(f"{model}: {e}")
+                delay = self._backoff(attempt, e.retry_after)
+                if attempt == self.max_retries or delay > LLM_RETRY_AFTER_MAX:
+                    raise LLMError(f"{model}: {e}")
+                print(f"LLM {model}: {e}. Reintento {attempt + 1}/{self.max_retries} en {delay:.1f}s.")
+                self._count(model, "retries")
+                # Esperar en el evento permite abandonar el backoff si otro modelo ya ganó.
+                if race.cancelled.wait(delay):
+                    self._count(model, "cancelled")
+                    raise _Cancelled()
+                continue
+            except LLMError as e:
+                self._count(model, "errors")
+                raise LLMError(f"{model}: {e}")
+            self._count(model, "successes", latency=time.monotonic() - started)
+            if hedged:
+                self._count(model, "hedge_wins")
+            return model, text
+
+    def complete(self, content, on_chunk=None):
+        """
+        Envía `content` y devuelve (modelo, texto). Prueba los modelos en orden; con hedging,
+        si el intento en curso tarda más de `hedge_after` se lanza el siguiente modelo en
+        paralelo y se cancela el que pierda. Lanza LLMError si todos fallan.
+        """
+        race = _Race()
+        if not self.hedge_after or len(self.models) < 2:
+            errors = []
+            for model in self.models:
+                try:
+                    return self._try_model(model, content, on_chunk, race)
+                except LLMError as e:
+                    errors.append(str(e))
+                    if race.winner is not None:
+                        break
+            raise LLMError("; ".join(errors))
+
+        remaining = list(self.models)
+        pending = {}
+        errors = []
+
+        def launch(hedged):
+            model = remaining.pop(0)
+            pending[self._pool.submit(self._try_model, model, content, on_chunk, race, hedged)] = model
+
+        launch(False)
+        try:
+            while pending:
+                can_hedge = remaining and len(pending) == 1 and race.winner is None
+                done, _ = wait(pending, timeout=self.hedge_after if can_hedge else None, return_when=FIRST_COMPLETED)
+                if not done:
+                    print(f"LLM: sin respuesta tras {self.hedge_after}s, lanzando también {remaining[0]}.")
+                    launch(True)
+                    continue
+                for future in done:
+                    pending.pop(future)
+                    try:
+                        return future.result()
+                    except _Cancelled:
+                        pass
+                    except LLMError as e:
+                        errors.append(str(e))
+                if not pending and remaining and race.winner is None:
+                    launch(False)
+            raise LLMError("; ".join(errors) or "Sin respuesta de ningún modelo")
+        finally:
+            race.cancel_losers()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Cliente compartido por todo el proceso; se crea en la primera petición."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
+
+
+def call_openrouter(full_content, usage=None, on_chunk=None):
+    """
+    Envía un único mensaje al LLM y devuelve el texto de la respuesta (o un texto de error).
+    Con `on_chunk` se pide la respuesta en streaming y se le pasa cada fragmento según llega.
+    """
+    _record_usage(usage, full_content)
     try:
-        response = requests.post(OPENROUTER_API_URL, headers=headers, json=payload, timeout=180)
-        response.raise_for_status()
-        response_json = response.json()
-        return response_json['choices'][0]['message']['content']
-    except Exception as e:
+        model, text = get_client().complete(full_content, on_chunk)
+    except LLMError as e:
         print(f"Error en la solicitud a OpenRouter: {e}")
-        return f"Error de comunicación con el LLM: {e}"
\ No newline at end of file
+        return f"Error de comunicación con el LLM: {e}"
+    if usage is not None:
+        usage["model"] = model
+    return text
+
+def analyze_with_openrouter(prompt, video_data, usage=None, on_chunk=None):
+    """
+    Analiza los videos con el LLM usando la codificación compacta de payload_builder.
+    Si los datos superan LLM_TOKEN_BUDGET se parten en trozos que se analizan en paralelo
+    y se combinan con una última petición. Con LLM_TOPIC_SUMMARY se manda solo el ranking
+    de temas precalculado en local. Si se pasa un dict `usage`, se anotan en él
+    los tokens estimados enviados, las peticiones y los trozos. `on_chunk` recibe en
+    streaming la respuesta final (la de la única petición o la de la combinación).
+    """
+    if not OPENROUTER_API_KEY:
+        return "Error: OPENROUTER_API_KEY no configurada en .env"
+
+    if LLM_TOPIC_SUMMARY:
+        ranking = topic_ranking.rank_topics(video_data)
+        if usage is not None:
+            usage["chunks"] = 1
+            usage["topic_ranking_ms"] = ranking["elapsed_ms"]
+        content = payload_builder.build_summary_content(prompt, topic_ranking.llm_summary(ranking))
+        result = call_openrouter(content, usage, on_chunk)
+        if is_error_result(result):
+            return result
+        return result + "\n" + topic_ranking.format_video_list(video_data)
+
+    chunks = payload_builder.split_video_data(prompt, video_data)
+    if usage is not None:
+        usage["chunks"] = len(chunks)
+    if len(chunks) == 1:
+        return call_openrouter(payload_builder.build_content(prompt, video_data), usage, on_chunk)
+
+    print(f"Datos demasiado grandes para una petición: se analizan en {len(chunks)} partes.")
+    contents = [payload_builder.build_map_content(prompt, chunk, i, len(chunks)) for i, chunk in enumerate(chunks, start=1)]
+    with ThreadPoolExecutor(max_workers=max(1, min(LLM_MAP_CONCURRENCY, len(contents)))) as pool:
+        partial_results = list(pool.map(lambda content: call_openrouter(content, usage), contents))
+
+    failed = [text for text in partial_results if is_error_result(text)]
+    if failed:
+        return failed[0]
+    return call_openrouter(payload_builder.build_reduce_content(prompt, partial_results), usage, on_chunk)
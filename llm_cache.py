@@ -0,0 +1,124 @@
+# llm_cache.py
+# Caché persistente de respuestas del LLM, direccionada por contenido: la clave es un
+# hash del modelo, el prompt y los datos de los videos normalizados. Si un job nuevo
+# manda exactamente lo mismo que uno anterior, se responde al instante sin OpenRouter.
+import hashlib
+import json
+import os
+import threading
+import time
+
+import llm_analyzer
+from db_pool import get_connection
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 500))
+LLM_CACHE_MAX_AGE = float(os.getenv("LLM_CACHE_MAX_AGE", 7 * 24 * 3600))
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "stored": 0}
+
+
+def _normalize(data):
+    """Ordena listas de videos y claves para que el mismo contenido dé siempre la misma clave."""
+    if isinstance(data, dict):
+        return {key: _normalize(value) for key, value in data.items()}
+    if isinstance(data, list):
+        items = [_normalize(item) for item in data]
+        if all(isinstance(item, dict) for item in items):
+            items.sort(key=lambda item: json.dumps(item, sort_keys=True, ensure_ascii=False))
+        return items
+    if isinstance(data, str):
+        return " ".join(data.split())
+    return data
+
+
+def cache_key(model, prompt, video_data):
+    normalized = json.dumps(_normalize(video_data), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    digest = hashlib.sha256()
+    parts = (model, prompt, normalized)
+    if llm_analyzer.LLM_TOPIC_SUMMARY:
+        # El resumen por temas produce otra respuesta para los mismos datos.
+        parts += ("topic_summary",)
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _count(name):
+    with _lock:
+        _counters[name] += 1
+
+
+def get(key, max_age=LLM_CACHE_MAX_AGE):
+    now = time.time()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT result FROM llm_cache WHERE cache_key = ? AND created_at >= ?", (key, now - max_age))
+        row = cursor.fetchone()
+        if row:
+            cursor.execute("UPDATE llm_cache SET last_used_at = ?, hits = hits + 1 WHERE cache_key = ?", (now, key))
+            conn.commit()
+    return row[0] if row else None
+
+
+def put(key, model, result):
+    now = time.time()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO llm_cache (cache_key, model, result, created_at, last_used_at, hits) VALUES (?, ?, ?, ?, ?, 0) "
+            "ON CONFLICT(cache_key) DO UPDATE SET result = excluded.result, created_at = excluded.created_at, "
+            "last_used_at = excluded.last_used_at",
+            (key, model, result, now, now)
+        )
+        # Expulsión: primero lo que ha caducado, luego lo menos usado si pasamos del máximo.
+        cursor.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - LLM_CACHE_MAX_AGE,))
+        cursor.execute(
+            "DELETE FROM llm_cache WHERE cache_key IN ("
+            "SELECT cache_key FROM llm_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (LLM_CACHE_MAX_ENTRIES,)
+        )
+        conn.commit()
+
+
+def analyze(prompt, video_data, model=None, usage=None, on_chunk=None):
+    """
+    Como `llm_analyzer.analyze_with_openrouter`, pero consultando antes la caché.
+    Devuelve (resultado, cache_hit).
+    """
+    model = model or llm_analyzer.OPENROUTER_MODEL
+    if not LLM_CACHE_ENABLED:
+        return llm_analyzer.analyze_with_openrouter(prompt, video_data, usage, on_chunk), False
+
+    key = cache_key(model, prompt, video_data)
+    try:
+        cached = get(key)
+    except Exception as e:
+        print(f"Error leyendo la caché del LLM: {e}")
+        cached = None
+    if cached is not None:
+        _count("hits")
+        return cached, True
+
+    _count("misses")
+    usage = {} if usage is None else usage
+    result = llm_analyzer.analyze_with_openrouter(prompt, video_data, usage, on_chunk)
+    # Los errores de comunicación no se guardan: el próximo job debe volver a intentarlo.
+    if not llm_analyzer.is_error_result(result):
+        try:
+            # La clave usa el modelo principal; en la fila se anota el modelo que respondió de verdad.
+            put(key, usage.get("model", model), result)
+            _count("stored")
+        except Exception as e:
+            print(f"Error guardando en la caché del LLM: {e}")
+    return result, False
+
+
+def stats():
+    with _lock:
+        lookups = _counters["hits"] + _counters["misses"]
+        return {**_counters, "enabled": LLM_CACHE_ENABLED, "max_entries": LLM_CACHE_MAX_ENTRIES,
+                "max_age_seconds": LLM_CACHE_MAX_AGE,
+                "hit_rate": round(_counters["hits"] / lookups, 3) if lookups else 0.0}
@@ -1,23 +1,18 @@
 # manage_channels.py
-import os
 import libsql
 from dotenv import load_dotenv
 
-load_dotenv()
-
-DB_URL = os.getenv("DB_URL")
-DB_AUTH_TOKEN = os.getenv("DB_AUTH_TOKEN")
+import channel_import
+from db_pool import get_connection
 
-def get_db_connection():
-    return libsql.connect(database=DB_URL, auth_token=DB_AUTH_TOKEN)
+load_dotenv()
 
 def list_channels():
     print("\n--- Canales en la Base de Datos ---")
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT channel_name, channel_id, category FROM channels")
-    channels = cursor.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT channel_name, channel_id, category FROM channels")
+        channels = cursor.fetchall()
     if not channels:
         print("No hay canales.")
     else:
@@ -30,35 +25,45 @@ def add_channel():
     channel_id = input("Introduce el ID del canal (ej: UC_...): ")
     category = input("Introduce la categoría (ej: Noticias): ")
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "INSERT INTO channels (channel_name, channel_id, category) VALUES (?, ?, ?)",
-            (channel_name, channel_id, category)
-        )
-        conn.commit()
-        print(f"\n¡Canal '{channel_name}' añadido con éxito!")
-    except libsql.IntegrityError:
-        print("\nError: Ese ID de canal ya existe en la base de datos.")
-    except Exception as e:
-        print(f"\nOcurrió un error: {e}")
-    finally:
-        conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "INSERT INTO channels (channel_name, channel_id, category) VALUES (?, ?, ?)",
+                (channel_name, channel_id, category)
+            )
+            conn.commit()
+            print(f"\n¡Canal '{channel_name}' añadido con éxito!")
+        except libsql.IntegrityError:
+            conn.rollback()
+            print("\nError: Ese ID de canal ya existe en la base de datos.")
+        except Exception as e:
+            conn.rollback()
+            print(f"\nOcurrió un error: {e}")
 
 def delete_channel():
     channel_id = input("Introduce el ID del canal que quieres borrar: ")
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,))
-    conn.commit()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,))
+        conn.commit()
+        deleted = cursor.rows_affected > 0
     
-    if cursor.rows_affected > 0:
+    if deleted:
         print(f"\n¡Canal con ID '{channel_id}' borrado con éxito!")
     else:
         print(f"\nNo se encontró ningún canal con el ID '{channel_id}'.")
-    conn.close()
+
+def import_channels():
+    path = input("Ruta del fichero CSV o JSON con los canales: ").strip()
+    try:
+        report = channel_import.import_file(path)
+    except (OSError, channel_import.ImportFormatError) as e:
+        print(f"\nError: {e}")
+        return
+    print()
+    channel_import.print_report(report)
 
 def main():
     while True:
@@ -66,7 +71,8 @@ def main():
         print("1. Ver todos los canales")
         print("2. Añadir un nuevo canal")
         print("3. Borrar un canal")
-        print("4. Salir")
+        print("4. Importar canales desde un fichero (CSV o JSON)")
+        print("5. Salir")
         choice = input("Elige una opción: ")
 
         if choice == '1':
@@ -76,6 +82,8 @@ def main():
         elif choice == '3':
             delete_channel()
         elif choice == '4':
+            import_channels()
+        elif choice == '5':
             break
         else:
             print("Opción no válida. Inténtalo de nuevo.")
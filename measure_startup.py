@@ -0,0 +1,73 @@
+# measure_startup.py
+"""
+Mide el arranque en frío de la app y de los scripts: cada medida se hace en un
+proceso de Python nuevo que solo importa el módulo, y se repite varias veces.
+Escribe la mediana y el mínimo en JSON.
+
+Uso:
+    python measure_startup.py
+    python measure_startup.py --runs 10 --modules app,manage_channels
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Módulo -> código a ejecutar después de importarlo (vacío = solo importar).
+TARGETS = {
+    "app": "",
+    "manage_channels": "",
+    "analyze_all": "",
+    "scheduler": "",
+    "analysis_tasks": "",
+    "youtube_logic": "",
+    "youtube_logic (primer cliente)": "youtube_logic.get_youtube()",
+}
+
+SNIPPET = """
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+{after}
+elapsed = time.perf_counter() - start
+heavy = [name for name in ("googleapiclient.discovery", "httplib2", "requests", "libsql") if name in sys.modules]
+print(elapsed, ",".join(heavy))
+"""
+
+
+def measure(target, runs, root):
+    module = target.split(" ")[0]
+    after = TARGETS.get(target, "")
+    code = SNIPPET.format(root=root, module=module, after=after)
+    # Se mide la importación, no el trabajo que la app arranca en segundo plano: el .env
+    # no pisa estas variables.
+    env = {**os.environ, "SCHEDULER_ENABLED": "0", "JOB_WORKERS_IN_WEB": "0"}
+    timings = []
+    heavy = ""
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=root, env=env)
+        if output.returncode != 0:
+            return {"target": target, "error": output.stderr.strip().splitlines()[-1:]}
+        # La última línea es "<segundos> <módulos pesados>"; lo anterior son prints de los módulos.
+        elapsed, _, heavy = output.stdout.strip().splitlines()[-1].partition(" ")
+        timings.append(float(elapsed))
+    return {"target": target, "median_ms": round(statistics.median(timings) * 1000, 1),
+            "min_ms": round(min(timings) * 1000, 1), "heavy_modules_loaded": heavy.split(",") if heavy else []}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modules", default=",".join(TARGETS), help="Separados por comas")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    results = [measure(target.strip(), args.runs, root) for target in args.modules.split(",") if target.strip()]
+    print(json.dumps({"runs": args.runs, "results": results}, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# metrics.py
+# Métricas en formato de texto de Prometheus (sin dependencias): histogramas de la
+# duración de cada etapa de los análisis y de las rutas HTTP, más los valores que
+# otros módulos exponen al momento de cada scrape. También el cronometraje por job
+# que se guarda en `analysis_jobs.timings`.
+import threading
+import time
+from contextlib import contextmanager
+
+# Segundos: cubre desde consultas a la base de datos hasta llamadas largas al LLM.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._lock = threading.Lock()
+        self._series = {}   # valores de etiquetas -> [cuentas por bucket, suma, total]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total_sum, count) in sorted(self._series.items()):
+                labels = list(zip(self.labelnames, key))
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {bucket_count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total_sum)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("analysis_stage_seconds", "Duración de cada etapa de un análisis.", ("kind", "stage"))
+JOB_SECONDS = Histogram("analysis_job_seconds", "Duración total de un análisis, sin contar la cola.", ("kind", "status"))
+PAYLOAD_BYTES = Histogram("analysis_llm_payload_bytes", "Bytes enviados al LLM por análisis.", ("kind",), SIZE_BUCKETS)
+LLM_TOKENS = Counter("analysis_llm_tokens_sent_total", "Tokens estimados enviados al LLM.", ("kind",))
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "Latencia de las rutas HTTP.", ("method", "route", "status"))
+
+_metrics = [STAGE_SECONDS, JOB_SECONDS, PAYLOAD_BYTES, LLM_TOKENS, HTTP_SECONDS]
+_collectors = []
+
+
+def register_collector(collector):
+    """
+    `collector()` devuelve una lista de (nombre, tipo, ayuda, [(etiquetas_dict, valor)])
+    con valores que se leen en el momento del scrape (colas, cuota, pool...).
+    """
+    _collectors.append(collector)
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        try:
+            samples = collector()
+        except Exception as e:
+            print(f"Error en un colector de métricas: {e}")
+            continue
+        for name, metric_type, help_text, values in samples:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in values:
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class JobTimings:
+    """
+    Cronometraje de un análisis. Cada etapa se acumula en `stages` (segundos) y se
+    observa en los histogramas; `values` guarda contadores sueltos (llamadas a la API,
+    tokens, bytes...). `to_dict()` es lo que se guarda en `analysis_jobs.timings`.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.started = time.monotonic()
+        self.stages = {}
+        self.values = {}
+
+    def record(self, stage, seconds):
+        if seconds is None:
+            return
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, kind=self.kind, stage=stage)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - start)
+
+    def set(self, **values):
+        self.values.update(values)
+
+    def finish(self, status):
+        total = time.monotonic() - self.started
+        JOB_SECONDS.observe(total, kind=self.kind, status=status)
+        if self.values.get("payload_bytes"):
+            PAYLOAD_BYTES.observe(self.values["payload_bytes"], kind=self.kind)
+        if self.values.get("tokens_sent"):
+            LLM_TOKENS.inc(self.values["tokens_sent"], kind=self.kind)
+        self.values["total_seconds"] = round(total, 3)
+        return self.to_dict()
+
+    def to_dict(self):
+        return {"stages": {name: round(seconds, 3) for name, seconds in self.stages.items()}, **self.values}
@@ -0,0 +1,368 @@
+# migrations.py
+"""
+Migraciones versionadas del esquema y carga/descarga masiva de tablas.
+
+Cada migración se aplica una sola vez, en orden y dentro de una transacción, y queda
+anotada en la tabla `schema_migrations`. Las columnas se añaden comprobando
+PRAGMA table_info, así que también funcionan sobre bases de datos creadas con los
+scripts antiguos.
+
+Uso:
+    python migrations.py migrate                   # aplica las migraciones pendientes
+    python migrations.py status                    # versión actual y pendientes
+    python migrations.py export channels canales.jsonl
+    python migrations.py import channels canales.jsonl [--batch-size 500] [--replace]
+"""
+import argparse
+import base64
+import json
+import time
+
+import raw_store
+from db_pool import get_connection, get_replica
+
+IMPORT_BATCH_SIZE = 500
+
+
+def table_columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def table_exists(cursor, table):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    return cursor.fetchone() is not None
+
+
+def add_column(cursor, table, column, column_type):
+    if column not in table_columns(cursor, table):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+# --- Migraciones (nunca se editan una vez publicadas: los cambios van en una nueva) ---
+
+def _base_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            result TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    add_column(cursor, "analysis_jobs", "channel_name", "TEXT")
+    cursor.execute("CREATE TABLE IF NOT EXISTS channels (id INTEGER PRIMARY KEY, channel_id TEXT UNIQUE, channel_name TEXT, category TEXT)")
+
+
+def _history_indexes(cursor):
+    # (status, created_at, id) también sirve para los filtros que solo usan status.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_created_at ON analysis_jobs (created_at, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status_created_at ON analysis_jobs (status, created_at, id)")
+
+
+def _incremental_ingestion(cursor):
+    add_column(cursor, "channels", "uploads_playlist_id", "TEXT")
+    add_column(cursor, "analysis_jobs", "quota_units", "INTEGER")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS videos (
+            video_id TEXT PRIMARY KEY,
+            channel_id TEXT NOT NULL,
+            title TEXT,
+            published_at TEXT,
+            views INTEGER,
+            stats_updated_at TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_videos_channel_published ON videos (channel_id, published_at)")
+
+
+def _youtube_cache(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS youtube_cache (cache_key TEXT PRIMARY KEY, stored_at REAL NOT NULL, value TEXT NOT NULL)")
+
+
+def _llm_cache(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            hits INTEGER DEFAULT 0
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used_at)")
+    add_column(cursor, "analysis_jobs", "llm_cache_hit", "INTEGER DEFAULT 0")
+    add_column(cursor, "analysis_jobs", "tokens_sent", "INTEGER")
+    add_column(cursor, "analysis_jobs", "first_output_ms", "INTEGER")
+
+
+def _raw_data_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_raw_data (
+            job_id TEXT PRIMARY KEY,
+            raw_size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    """)
+    # Bases de datos antiguas: los datos crudos estaban en 'analysis_jobs.raw_json_data'.
+    if "raw_json_data" in table_columns(cursor, "analysis_jobs"):
+        moved, before, after = raw_store.migrate_legacy_rows(cursor)
+        if moved:
+            print(f"Datos crudos de {moved} jobs movidos a 'analysis_raw_data': {before:,} -> {after:,} bytes.")
+
+
+def _scheduler_state(cursor):
+    add_column(cursor, "analysis_jobs", "channel_id", "TEXT")
+    add_column(cursor, "channels", "refresh_interval", "INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_channel_status ON analysis_jobs (channel_id, status, created_at)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schedule_state (
+            channel_id TEXT PRIMARY KEY,
+            next_run_at REAL NOT NULL,
+            checked_at REAL,
+            fingerprint TEXT,
+            last_job_id TEXT
+        )
+    """)
+
+
+def _job_timings(cursor):
+    add_column(cursor, "analysis_jobs", "timings", "TEXT")
+
+
+def _channel_name_index(cursor):
+    # get_all_saved_channels ordena por nombre en cada carga de la página principal.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_channels_channel_name ON channels (channel_name)")
+
+
+def _video_stats(cursor):
+    # Serie temporal de vistas: una fila solo cuando el valor cambia. La clave primaria
+    # (video_id, observed_at) sirve a la vez para leer la serie de un video y el punto de referencia.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS video_stats (
+            video_id TEXT NOT NULL,
+            observed_at INTEGER NOT NULL,
+            views INTEGER NOT NULL,
+            PRIMARY KEY (video_id, observed_at)
+        ) WITHOUT ROWID
+    """)
+    # Los videos que ya estaban guardados arrancan la serie con su último valor conocido.
+    cursor.execute("""
+        INSERT OR IGNORE INTO video_stats (video_id, observed_at, views)
+        SELECT video_id, CAST(strftime('%s', stats_updated_at) AS INTEGER), views FROM videos
+        WHERE views IS NOT NULL AND stats_updated_at IS NOT NULL
+    """)
+
+
+def _job_leases(cursor):
+    # Opciones del análisis (force_refresh...) para que otro proceso pueda ejecutarlo.
+    add_column(cursor, "analysis_jobs", "options", "TEXT")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_leases (
+            job_id TEXT PRIMARY KEY,
+            worker_id TEXT NOT NULL,
+            claimed_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 1
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_leases_worker ON job_leases (worker_id)")
+
+
+def _history_channel_index(cursor):
+    # El filtro por canal de /historial va por channel_name: sin este índice cada página
+    # era un recorrido completo más un ordenamiento temporal.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_channel_name_created_at "
+                   "ON analysis_jobs (channel_name, created_at, id)")
+
+
+MIGRATIONS = [
+    (1, "tablas base", _base_tables),
+    (2, "índices del historial", _history_indexes),
+    (3, "ingesta incremental de videos", _incremental_ingestion),
+    (4, "caché de YouTube", _youtube_cache),
+    (5, "caché del LLM", _llm_cache),
+    (6, "datos crudos comprimidos", _raw_data_table),
+    (7, "estado del planificador", _scheduler_state),
+    (8, "tiempos por etapa", _job_timings),
+    (9, "índice de canales por nombre", _channel_name_index),
+    (10, "serie temporal de vistas", _video_stats),
+    (11, "arrendamientos de jobs", _job_leases),
+    (12, "índice del historial por canal", _history_channel_index),
+]
+
+
+def _ensure_version_table(conn):
+    conn.cursor().execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TEXT NOT NULL)"
+    )
+    conn.commit()
+
+
+def applied_versions(conn):
+    _ensure_version_table(conn)
+    cursor = conn.cursor()
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn=None):
+    """Aplica las migraciones pendientes. Devuelve la lista de versiones aplicadas."""
+    if conn is None:
+        with get_connection() as conn:
+            return migrate(conn)
+
+    done = applied_versions(conn)
+    applied = []
+    cursor = conn.cursor()
+    for version, name, apply in MIGRATIONS:
+        if version in done:
+            continue
+        start = time.monotonic()
+        # BEGIN explícito: así también los ALTER/CREATE se deshacen si la migración falla a medias.
+        cursor.execute("BEGIN")
+        try:
+            apply(cursor)
+            cursor.execute("INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, datetime('now'))",
+                           (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            print(f"La migración {version} ({name}) falló y se ha deshecho.")
+            raise
+        applied.append(version)
+        print(f"Migración {version} aplicada: {name} ({time.monotonic() - start:.2f}s).")
+    # La réplica de lectura no puede ir por detrás del esquema: sin esto, durante el retraso
+    # permitido se leería de una copia sin las tablas o columnas nuevas.
+    replica = get_replica()
+    if applied and replica is not None:
+        replica.sync()
+    return applied
+
+
+def status(conn):
+    done = applied_versions(conn)
+    return {"current_version": max(done, default=0),
+            "pending": [f"{version}: {name}" for version, name, _ in MIGRATIONS if version not in done]}
+
+
+# --- Importación y exportación masiva ---
+
+def _encode_value(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"$base64": base64.b64encode(bytes(value)).decode("ascii")}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "$base64" in value:
+        return base64.b64decode(value["$base64"])
+    return value
+
+
+def _check_table(cursor, table):
+    if not table_exists(cursor, table):
+        raise ValueError(f"La tabla '{table}' no existe.")
+
+
+def export_table(conn, table, path, batch_size=IMPORT_BATCH_SIZE):
+    """Escribe la tabla en JSON Lines (una fila por línea). Devuelve el número de filas."""
+    cursor = conn.cursor()
+    _check_table(cursor, table)
+    cursor.execute(f"SELECT * FROM {table}")
+    columns = [description[0] for description in cursor.description]
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                f.write(json.dumps({c: _encode_value(v) for c, v in zip(columns, row)}, ensure_ascii=False) + "\n")
+            count += len(rows)
+    return count
+
+
+def import_rows(conn, table, rows, batch_size=IMPORT_BATCH_SIZE, replace=False):
+    """
+    Inserta dicts en `table` con executemany, una transacción por lote. Las columnas que
+    no existen en la tabla se ignoran. Sin `replace`, las filas que ya existen se saltan.
+    Devuelve (filas_leídas, lotes).
+    """
+    cursor = conn.cursor()
+    _check_table(cursor, table)
+    known = set(table_columns(cursor, table))
+    verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+    total = batches = 0
+    batch, columns = [], None
+
+    def flush():
+        nonlocal batches
+        placeholders = ", ".join("?" for _ in columns)
+        cursor.executemany(f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", batch)
+        conn.commit()
+        batches += 1
+
+    for row in rows:
+        row_columns = [c for c in row if c in known]
+        # Un lote necesita columnas homogéneas; si cambian, se cierra el lote actual.
+        if batch and row_columns != columns:
+            flush()
+            batch = []
+        columns = row_columns
+        batch.append(tuple(_decode_value(row[c]) for c in columns))
+        total += 1
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+    if batch:
+        flush()
+    return total, batches
+
+
+def import_table(conn, table, path, batch_size=IMPORT_BATCH_SIZE, replace=False):
+    def rows():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    return import_rows(conn, table, rows(), batch_size, replace)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="Aplicar las migraciones pendientes")
+    subparsers.add_parser("status", help="Mostrar la versión del esquema")
+    export_parser = subparsers.add_parser("export", help="Exportar una tabla a JSON Lines")
+    export_parser.add_argument("table")
+    export_parser.add_argument("path")
+    import_parser = subparsers.add_parser("import", help="Importar una tabla desde JSON Lines")
+    import_parser.add_argument("table")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    import_parser.add_argument("--replace", action="store_true", help="Sobrescribir las filas que ya existen")
+    args = parser.parse_args()
+
+    with get_connection() as conn:
+        if args.command == "migrate":
+            applied = migrate(conn)
+            print(f"Esquema al día (versión {max(applied_versions(conn), default=0)})."
+                  if applied else "No había migraciones pendientes.")
+        elif args.command == "status":
+            print(json.dumps(status(conn), indent=2, ensure_ascii=False))
+        elif args.command == "export":
+            start = time.monotonic()
+            count = export_table(conn, args.table, args.path)
+            print(f"{count} filas de '{args.table}' exportadas a '{args.path}' en {time.monotonic() - start:.2f}s.")
+        elif args.command == "import":
+            start = time.monotonic()
+            total, batches = import_table(conn, args.table, args.path, args.batch_size, args.replace)
+            print(f"{total} filas procesadas para '{args.table}' en {batches} lotes ({time.monotonic() - start:.2f}s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# payload_builder.py
+# Construye el contenido que se envía al LLM: codificación compacta de los videos
+# (sin indentación, claves cortas, prefijo de URL común y títulos normalizados),
+# estimación de tokens y reparto en trozos cuando se supera el presupuesto.
+import json
+import os
+import unicodedata
+
+URL_PREFIX = "https://www.youtube.com/watch?v="
+LLM_TOKEN_BUDGET = int(os.getenv("LLM_TOKEN_BUDGET", 12000))
+# Aproximación habitual para texto en alfabeto latino; no necesitamos un tokenizador exacto.
+CHARS_PER_TOKEN = 4
+
+FORMAT_NOTE = ("The video data is compact JSON. Each video is [title, views, id] and its link is "
+               "url_prefix + id. A fourth value, when present, is the recent views per hour: use it so that "
+               "older videos are not favored just for having had more time to gather views. When videos are "
+               "grouped, the keys of \"channels\" are the channel names.")
+
+MAP_PROMPT = ("This is part {part} of {parts} of the data. Analyze only this part: list the economic topics "
+              "with the total views of their videos, and for each topic the titles, links and views of its "
+              "videos sorted by views in descending order. Do not write a conclusion yet.")
+
+SUMMARY_NOTE = ("The videos were pre-classified locally by economic topic from their titles. The JSON below "
+                "ranks the topics by \"ranked_by\" (total views or views per hour); for each topic, \"top\" "
+                "lists its leading videos as [title, views, id, views_per_hour] (views_per_hour may be missing "
+                "or null; the channel name follows when there are several channels) and the link is "
+                "url_prefix + id. \"unclassified_terms\" are frequent words in titles that matched no topic: "
+                "take them into account if they point to an economic concern. The complete list of videos is "
+                "appended automatically after your answer, so do not reproduce it.")
+
+REDUCE_PROMPT = ("The data was too large for one request, so it was split into {parts} parts and each part was "
+                 "analyzed separately. Below are the partial analyses. Combine them into a single final answer "
+                 "to this original request, adding up the views of the same topic across parts:\n\n{prompt}")
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def normalize_title(title):
+    """Quita emojis y símbolos decorativos y colapsa los espacios."""
+    title = unicodedata.normalize("NFKC", title)
+    title = "".join(ch for ch in title if unicodedata.category(ch) not in ("So", "Cs", "Cf"))
+    return " ".join(title.split())
+
+
+def compact_video(video):
+    url = video.get('url', '')
+    video_id = url[len(URL_PREFIX):] if url.startswith(URL_PREFIX) else url
+    compact = [normalize_title(video.get('title', '')), video.get('views', 0), video_id]
+    if video.get('views_per_hour') is not None:
+        compact.append(video['views_per_hour'])
+    return compact
+
+
+def encode(video_data):
+    """Codificación compacta de una lista de videos o de un dict canal -> lista de videos."""
+    if isinstance(video_data, dict):
+        body = {"url_prefix": URL_PREFIX,
+                "channels": {name: [compact_video(v) for v in videos] for name, videos in video_data.items()}}
+    else:
+        body = {"url_prefix": URL_PREFIX, "videos": [compact_video(v) for v in video_data]}
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":"))
+
+
+def build_content(prompt, video_data):
+    return f"{prompt}\n\n{FORMAT_NOTE}\n\n### Video Data (JSON):\n\n{encode(video_data)}"
+
+
+def _entries(video_data):
+    """Aplana los datos en (canal, video); canal es None para listas simples."""
+    if isinstance(video_data, dict):
+        return [(name, video) for name, videos in video_data.items() for video in videos]
+    return [(None, video) for video in video_data]
+
+
+def _rebuild(entries, grouped):
+    if not grouped:
+        return [video for _, video in entries]
+    data = {}
+    for name, video in entries:
+        data.setdefault(name, []).append(video)
+    return data
+
+
+def split_video_data(prompt, video_data, budget=LLM_TOKEN_BUDGET):
+    """
+    Devuelve una lista de trozos (con la misma forma que `video_data`) cuyo contenido
+    cabe en `budget` tokens. Si todo cabe, la lista tiene un solo elemento.
+    """
+    if estimate_tokens(build_content(prompt, video_data)) <= budget:
+        return [video_data]
+
+    grouped = isinstance(video_data, dict)
+    # Lo fijo de cada petición: prompt, nota de formato e instrucciones de la parte.
+    overhead = estimate_tokens(build_content(prompt + "\n\n" + MAP_PROMPT, [] if not grouped else {}))
+    available = max(1, budget - overhead)
+
+    chunks, current, current_tokens = [], [], 0
+    for name, video in _entries(video_data):
+        cost = estimate_tokens(json.dumps(compact_video(video), ensure_ascii=False)) + 1
+        if grouped and (not current or current[-1][0] != name):
+            cost += estimate_tokens(json.dumps(name, ensure_ascii=False)) + 1
+        if current and current_tokens + cost > available:
+            chunks.append(_rebuild(current, grouped))
+            current, current_tokens = [], 0
+        current.append((name, video))
+        current_tokens += cost
+    if current:
+        chunks.append(_rebuild(current, grouped))
+    return chunks
+
+
+def build_summary_content(prompt, summary):
+    """Contenido con el ranking de temas de topic_ranking en lugar de todos los videos."""
+    return f"{prompt}\n\n{SUMMARY_NOTE}\n\n### Topic ranking (JSON):\n\n{summary}"
+
+
+def build_map_content(prompt, chunk, part, parts):
+    return build_content(prompt + "\n\n" + MAP_PROMPT.format(part=part, parts=parts), chunk)
+
+
+def build_reduce_content(prompt, partial_results):
+    sections = [f"### Part {i} of {len(partial_results)}\n\n{text}" for i, text in enumerate(partial_results, start=1)]
+    return REDUCE_PROMPT.format(parts=len(partial_results), prompt=prompt) + "\n\n" + "\n\n".join(sections)
@@ -0,0 +1,165 @@
+# raw_store.py
+# Datos crudos de cada análisis (los videos enviados al LLM), fuera de `analysis_jobs`:
+# se guardan en `analysis_raw_data` como JSON compacto comprimido con gzip, para que
+# las consultas del historial no arrastren el blob y la descarga pueda servirse por trozos.
+import codecs
+import gzip
+import json
+import os
+import zlib
+
+from db_pool import get_connection
+
+RAW_DATA_COMPRESS_LEVEL = int(os.getenv("RAW_DATA_COMPRESS_LEVEL", 6))
+# Tamaño de los trozos con los que se envía la descarga.
+RAW_DATA_CHUNK_SIZE = int(os.getenv("RAW_DATA_CHUNK_SIZE", 64 * 1024))
+
+
+def encode(data):
+    """Devuelve (blob_gzip, tamaño_sin_comprimir) del JSON compacto de `data`."""
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return gzip.compress(raw, compresslevel=RAW_DATA_COMPRESS_LEVEL), len(raw)
+
+
+def save(job_id, data):
+    blob, raw_size = encode(data)
+    with get_connection() as conn:
+        conn.cursor().execute(
+            "INSERT INTO analysis_raw_data (job_id, raw_size, stored_size, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(job_id) DO UPDATE SET raw_size = excluded.raw_size, "
+            "stored_size = excluded.stored_size, data = excluded.data",
+            (job_id, raw_size, len(blob), blob)
+        )
+        conn.commit()
+    return raw_size, len(blob)
+
+
+def load(job_id):
+    """Devuelve el blob gzip de un job, o None si no hay datos."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT data FROM analysis_raw_data WHERE job_id = ?", (job_id,))
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] else None
+
+
+def decode(blob):
+    """Los datos originales (lista de videos o dict canal -> videos) a partir del blob."""
+    return json.loads(gzip.decompress(blob))
+
+
+def iter_gzip(blob, chunk_size=RAW_DATA_CHUNK_SIZE):
+    """El blob tal cual, por trozos, para clientes que aceptan Content-Encoding: gzip."""
+    for start in range(0, len(blob), chunk_size):
+        yield blob[start:start + chunk_size]
+
+
+def iter_json(blob, chunk_size=RAW_DATA_CHUNK_SIZE):
+    """Descomprime el blob poco a poco, sin tener nunca el JSON entero en memoria."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for compressed in iter_gzip(blob, chunk_size):
+        data = decompressor.decompress(compressed, chunk_size)
+        while data:
+            yield data
+            data = decompressor.decompress(decompressor.unconsumed_tail, chunk_size)
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+class _JsonReader:
+    """
+    Lee valores JSON del blob uno a uno, descomprimiendo solo lo necesario. Basta para
+    la forma de estos datos (una lista de videos o un objeto canal -> lista de videos):
+    comas, dos puntos y espacios se tratan como separadores.
+    """
+
+    _SEPARATORS = " \t\r\n,:"
+
+    def __init__(self, blob, chunk_size=RAW_DATA_CHUNK_SIZE):
+        self._chunks = iter_json(blob, chunk_size)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self._text = ""
+        self._pos = 0
+
+    def _read_more(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        self._text = self._text[self._pos:] + self._utf8.decode(chunk)
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """El siguiente carácter que no es un separador, sin consumirlo; None al final."""
+        while True:
+            while self._pos < len(self._text) and self._text[self._pos] in self._SEPARATORS:
+                self._pos += 1
+            if self._pos < len(self._text):
+                return self._text[self._pos]
+            if not self._read_more():
+                return None
+
+    def take(self):
+        char = self.peek()
+        self._pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, self._pos = self._decoder.raw_decode(self._text, self._pos)
+                return value
+            except json.JSONDecodeError:
+                # Valor cortado entre dos trozos: se lee el siguiente y se vuelve a intentar.
+                if not self._read_more():
+                    raise
+
+
+def _ndjson_line(record):
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def iter_ndjson(blob, chunk_size=RAW_DATA_CHUNK_SIZE):
+    """
+    Un video por línea. En los análisis de varios canales cada línea lleva además
+    el campo "channel" con el nombre del canal. Como iter_json, descomprime y decodifica
+    poco a poco: en memoria solo hay un trozo y el video que se está enviando.
+    """
+    reader = _JsonReader(blob, chunk_size)
+    if reader.take() == "{":
+        while reader.peek() != "}":
+            channel = reader.value()
+            reader.take()    # "["
+            while reader.peek() != "]":
+                yield _ndjson_line({"channel": channel, **reader.value()})
+            reader.take()
+    else:
+        while reader.peek() != "]":
+            yield _ndjson_line(reader.value())
+
+
+def migrate_legacy_rows(cursor, batch_size=100):
+    """
+    Mueve a `analysis_raw_data` los datos que aún están en `analysis_jobs.raw_json_data`
+    (JSON indentado en TEXT) y vacía esa columna. Devuelve (jobs, bytes_antes, bytes_después).
+    """
+    moved = before = after = 0
+    while True:
+        cursor.execute("SELECT id, raw_json_data FROM analysis_jobs WHERE raw_json_data IS NOT NULL LIMIT ?",
+                       (batch_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            return moved, before, after
+        for job_id, raw_json in rows:
+            blob, raw_size = encode(json.loads(raw_json))
+            cursor.execute(
+                "INSERT OR REPLACE INTO analysis_raw_data (job_id, raw_size, stored_size, data) VALUES (?, ?, ?, ?)",
+                (job_id, raw_size, len(blob), blob)
+            )
+            cursor.execute("UPDATE analysis_jobs SET raw_json_data = NULL WHERE id = ?", (job_id,))
+            moved += 1
+            before += len(raw_json.encode("utf-8"))
+            after += len(blob)
@@ -0,0 +1,242 @@
+# scheduler.py
+# Planificador que lanza análisis en segundo plano para que los resultados ya estén
+# calculados cuando alguien abre /analizar. Cada canal tiene su cadencia (propia, de su
+# categoría o la global) con jitter, y el estado vive en la tabla `schedule_state`, así
+# que sobrevive a reinicios y se puede compartir entre varios procesos.
+#
+# Dentro de la app se activa con SCHEDULER_ENABLED=1. También puede correr aparte:
+#     python scheduler.py           # bucle continuo
+#     python scheduler.py --once    # una sola pasada (para cron)
+import argparse
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import youtube_logic
+from db_pool import get_connection
+from youtube_cache import parse_ttl_overrides
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "0") == "1"
+# Cadencia por defecto (segundos) y por categoría, p. ej. "Noticias=3600,Economía=21600".
+# Un canal puede tener la suya propia en `channels.refresh_interval`.
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", 6 * 3600))
+SCHEDULER_CATEGORY_INTERVALS = parse_ttl_overrides(os.getenv("SCHEDULER_CATEGORY_INTERVALS", ""))
+# Variación aleatoria de la cadencia (0.1 = ±10 %) para no lanzar todos los canales a la vez.
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", 0.1))
+# Cada cuántos segundos se buscan canales pendientes.
+SCHEDULER_TICK = float(os.getenv("SCHEDULER_TICK", 60))
+# Aunque el canal no suba nada, un análisis más viejo que esto se repite: las vistas
+# siguen cambiando y el ranking con ellas.
+SCHEDULER_MAX_ANALYSIS_AGE = float(os.getenv("SCHEDULER_MAX_ANALYSIS_AGE", 24 * 3600))
+# Antigüedad máxima de un resultado para que /analizar lo devuelva sin recalcular. Sin el
+# planificador nadie lo mantiene al día, así que por defecto /analizar siempre recalcula.
+ANALYSIS_FRESH_SECONDS = float(os.getenv("ANALYSIS_FRESH_SECONDS", SCHEDULER_INTERVAL if SCHEDULER_ENABLED else 0))
+
+
+def _parse_db_timestamp(value):
+    """`created_at` se guarda como 'YYYY-MM-DD HH:MM:SS' en UTC (CURRENT_TIMESTAMP de SQLite)."""
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+
+
+def fresh_result(channel_id, max_age=ANALYSIS_FRESH_SECONDS):
+    """
+    Devuelve el id del último análisis completado del canal si es lo bastante reciente,
+    o None. Un resultado viejo también vale si el planificador ha comprobado hace poco
+    que el canal no ha subido nada desde entonces, pero nunca si supera
+    SCHEDULER_MAX_ANALYSIS_AGE.
+    """
+    if max_age <= 0:
+        return None
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, created_at FROM analysis_jobs WHERE channel_id = ? AND status = 'completed' "
+            "ORDER BY created_at DESC, id DESC LIMIT 1", (channel_id,)
+        )
+        job = cursor.fetchone()
+        if not job:
+            return None
+        cursor.execute("SELECT last_job_id, checked_at FROM schedule_state WHERE channel_id = ?", (channel_id,))
+        state = cursor.fetchone()
+
+    now = time.time()
+    age = now - _parse_db_timestamp(job[1])
+    if age <= max_age:
+        return job[0]
+    if (state and state[0] == job[0] and state[1] and now - state[1] <= max_age
+            and age <= SCHEDULER_MAX_ANALYSIS_AGE):
+        return job[0]
+    return None
+
+
+class Scheduler:
+    """
+    `submit(channel_id, channel_name)` encola un análisis y devuelve su job_id
+    (en la app, a través del AnalysisExecutor, que ya agrupa duplicados).
+    """
+
+    def __init__(self, submit, interval=SCHEDULER_INTERVAL, category_intervals=None,
+                 jitter=SCHEDULER_JITTER, tick=SCHEDULER_TICK, max_analysis_age=SCHEDULER_MAX_ANALYSIS_AGE):
+        self.submit = submit
+        self.interval = interval
+        self.max_analysis_age = max_analysis_age
+        self.category_intervals = SCHEDULER_CATEGORY_INTERVALS if category_intervals is None else category_intervals
+        self.jitter = jitter
+        self.tick = tick
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._counters = {"ticks": 0, "enqueued": 0, "skipped_unchanged": 0, "errors": 0}
+        self._last_tick = None
+
+    def interval_for(self, category, refresh_interval):
+        if refresh_interval:
+            return float(refresh_interval)
+        return self.category_intervals.get(category, self.interval)
+
+    def _next_run(self, now, interval):
+        return now + interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _due_channels(self, now):
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # Los canales nuevos entran escalonados dentro de la primera ventana de jitter.
+            cursor.execute(
+                "SELECT c.channel_id, c.category, c.refresh_interval FROM channels c "
+                "LEFT JOIN schedule_state s ON s.channel_id = c.channel_id WHERE s.channel_id IS NULL"
+            )
+            new_rows = [
+                (channel_id, now + random.uniform(0, self.interval_for(category, refresh) * self.jitter))
+                for channel_id, category, refresh in cursor.fetchall()
+            ]
+            if new_rows:
+                cursor.executemany(
+                    "INSERT INTO schedule_state (channel_id, next_run_at) VALUES (?, ?) "
+                    "ON CONFLICT(channel_id) DO NOTHING", new_rows
+                )
+                conn.commit()
+            cursor.execute(
+                "SELECT c.channel_id, c.channel_name, c.category, c.refresh_interval, s.next_run_at, "
+                "s.fingerprint, j.status, j.created_at FROM channels c "
+                "JOIN schedule_state s ON s.channel_id = c.channel_id "
+                "LEFT JOIN analysis_jobs j ON j.id = s.last_job_id "
+                "WHERE s.next_run_at <= ? ORDER BY s.next_run_at", (now,)
+            )
+            return cursor.fetchall()
+
+    def _claim(self, channel_id, expected_next_run, next_run):
+        """Reserva el canal moviendo su próxima ejecución; falla si otro proceso se adelantó."""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE schedule_state SET next_run_at = ? WHERE channel_id = ? AND next_run_at = ?",
+                           (next_run, channel_id, expected_next_run))
+            conn.commit()
+            return cursor.rowcount > 0
+
+    def _record(self, channel_id, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with get_connection() as conn:
+            conn.cursor().execute(f"UPDATE schedule_state SET {columns} WHERE channel_id = ?",
+                                  (*fields.values(), channel_id))
+            conn.commit()
+
+    def run_once(self, now=None):
+        """Una pasada: encola los canales pendientes. Devuelve un resumen de lo hecho."""
+        now = now or time.time()
+        summary = {"enqueued": 0, "skipped_unchanged": 0, "errors": 0}
+        for (channel_id, channel_name, category, refresh, next_run_at, fingerprint, last_status,
+             last_created_at) in self._due_channels(now):
+            if not self._claim(channel_id, next_run_at, self._next_run(now, self.interval_for(category, refresh))):
+                continue
+            try:
+                # Último video subido (1 unidad): si no ha cambiado y el último análisis salió bien
+                # y no es demasiado viejo, no se repite.
+                latest = youtube_logic.latest_upload_id(channel_id)
+                if (latest and latest == fingerprint and last_status == "completed"
+                        and now - _parse_db_timestamp(last_created_at) <= self.max_analysis_age):
+                    self._record(channel_id, checked_at=now)
+                    summary["skipped_unchanged"] += 1
+                    continue
+                job_id = self.submit(channel_id, channel_name)
+                self._record(channel_id, fingerprint=latest, last_job_id=job_id, checked_at=now)
+                summary["enqueued"] += 1
+            except Exception as e:
+                # Se reintenta en el siguiente tick en lugar de esperar a la próxima cadencia completa.
+                print(f"Planificador: error con el canal {channel_id}: {e}")
+                self._record(channel_id, next_run_at=now + self.tick)
+                summary["errors"] += 1
+        for name, amount in summary.items():
+            self._count(name, amount)
+        self._count("ticks")
+        self._last_tick = now
+        return summary
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                summary = self.run_once()
+                if summary["enqueued"] or summary["errors"]:
+                    print(f"Planificador: {summary}")
+            except Exception as e:
+                print(f"Planificador: error en la pasada: {e}")
+            self._stop.wait(self.tick)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+        print(f"Planificador iniciado: cadencia {self.interval:.0f}s, jitter ±{self.jitter:.0%}, tick {self.tick:.0f}s.")
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, "running": bool(self._thread and self._thread.is_alive()),
+                    "interval": self.interval, "category_intervals": self.category_intervals,
+                    "max_analysis_age": self.max_analysis_age,
+                    "jitter": self.jitter, "last_tick": self._last_tick}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lanza periódicamente los análisis de todos los canales.")
+    parser.add_argument("--once", action="store_true", help="Hacer una sola pasada y esperar a que terminen los análisis")
+    args = parser.parse_args()
+
+    # Se reutilizan el ejecutor y las tareas de la app (sin importar la app); este proceso
+    # hace de worker igual que lo haría la web.
+    import analysis_tasks
+    from job_queue import JOB_QUEUE_MODE, JOB_WORKERS_IN_WEB
+
+    executor = analysis_tasks.executor
+    if JOB_QUEUE_MODE == "db" and JOB_WORKERS_IN_WEB:
+        executor.start()
+    scheduler = Scheduler(analysis_tasks.submit_scheduled)
+
+    if not args.once:
+        scheduler.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            scheduler.stop()
+        return
+
+    print(f"Pasada del planificador: {scheduler.run_once()}")
+    while True:
+        queue_stats = executor.stats()
+        if not queue_stats["active_workers"] and not queue_stats["queue_depth"]:
+            break
+        time.sleep(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,26 @@
 # setup_db.py
+# Prepara la base de datos aplicando las migraciones pendientes (ver migrations.py).
 import os
-import libsql
 from dotenv import load_dotenv
 
+import migrations
+from db_pool import get_connection, is_remote_url
+
 load_dotenv()
 
 DB_URL = os.getenv("DB_URL")
 DB_AUTH_TOKEN = os.getenv("DB_AUTH_TOKEN")
 
-if not all([DB_URL, DB_AUTH_TOKEN]):
+if not DB_URL or (is_remote_url(DB_URL) and not DB_AUTH_TOKEN):
     print("Error: Revisa que DB_URL y DB_AUTH_TOKEN están en tu archivo .env")
     exit()
 
 try:
-    print("Conectando a la base de datos de Turso...")
-    conn = libsql.connect(database=DB_URL, auth_token=DB_AUTH_TOKEN)
-    cursor = conn.cursor()
-    print("Conexión exitosa.")
-
-    print("Creando la tabla 'analysis_jobs' si no existe...")
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS analysis_jobs (
-            id TEXT PRIMARY KEY,
-            status TEXT NOT NULL,
-            result TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    conn.commit()
-    print("Tabla 'analysis_jobs' asegurada con éxito.")
-
-    conn.close()
+    print("Conectando a la base de datos...")
+    with get_connection() as conn:
+        print("Conexión exitosa.")
+        applied = migrations.migrate(conn)
+        print(f"Migraciones aplicadas: {applied}." if applied else "El esquema ya estaba al día.")
 
 except Exception as e:
-    print(f"Ocurrió un error: {e}")
\ No newline at end of file
+    print(f"Ocurrió un error: {e}")
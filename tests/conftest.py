@@ -0,0 +1,25 @@
+# tests/conftest.py
+# Los módulos de la app leen la configuración al importarse: las pruebas usan una base de
+# datos local temporal y nunca la del .env.
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp_dir = tempfile.mkdtemp(prefix="tests-db-")
+os.environ.update({"DB_URL": os.path.join(_tmp_dir, "test.db"), "DB_AUTH_TOKEN": "local",
+                   "SCHEDULER_ENABLED": "0", "LLM_CACHE_ENABLED": "0"})
+os.environ.pop("DB_REPLICA_PATH", None)
+
+
+@pytest.fixture(scope="session")
+def db():
+    """Base de datos temporal con todas las migraciones aplicadas."""
+    import migrations
+
+    migrations.migrate()
+    return os.environ["DB_URL"]
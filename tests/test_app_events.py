@@ -0,0 +1,43 @@
+# tests/test_app_events.py
+import json
+import time
+import uuid
+
+from db_pool import get_connection
+
+
+def _job(status="pending", result=None, quota_units=None, lease_expires_at=None):
+    job_id = str(uuid.uuid4())
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO analysis_jobs (id, status, channel_name, channel_id, result, quota_units) "
+                       "VALUES (?, ?, 'Canal', 'UCeventos', ?, ?)", (job_id, status, result, quota_units))
+        if lease_expires_at is not None:
+            cursor.execute("INSERT INTO job_leases (job_id, worker_id, claimed_at, expires_at, heartbeat_at, attempts) "
+                           "VALUES (?, 'otro', 0, ?, 0, 1)", (job_id, lease_expires_at))
+        conn.commit()
+    return job_id
+
+
+def test_stage_of_jobs_run_by_other_processes(db):
+    import app
+
+    future, past = time.time() + 60, time.time() - 60
+    assert app._load_job_event(_job())["stage"] == "queued"
+    assert app._load_job_event(_job(lease_expires_at=future))["stage"] == "fetching_videos"
+    assert app._load_job_event(_job(quota_units=3, lease_expires_at=future))["stage"] == "calling_llm"
+    event = app._load_job_event(_job(result="texto a medias", quota_units=3, lease_expires_at=future))
+    assert (event["stage"], event["partial"]) == ("calling_llm", "texto a medias")
+    assert app._load_job_event(_job(quota_units=3, lease_expires_at=past))["stage"] == "queued"
+
+
+def test_events_ignore_stale_bus_entry_for_remote_job(db):
+    import app
+
+    job_id = _job(status="completed", result="listo")
+    app.events.publish(job_id, "queued")   # lo que dejaba la web al encolar en la cola compartida
+    response = app.app.test_client().get(f"/events/{job_id}")
+    first = next(response.response).decode()
+    response.close()
+    event = json.loads(first[len("data: "):])
+    assert (event["stage"], event["result"]) == ("completed", "listo")
@@ -0,0 +1,27 @@
+# tests/test_batch_analysis.py
+import batch_analysis
+import llm_cache
+
+CHANNELS = [{"channel_id": "UC1", "channel_name": "Noticias"}, {"channel_id": "UC2", "channel_name": "Noticias"},
+            {"channel_id": "UC3", "channel_name": "Economía"}]
+
+
+def _video(title, views):
+    return {"title": title, "views": views, "url": f"https://www.youtube.com/watch?v={title}"}
+
+
+def test_channels_with_the_same_name_are_not_merged(monkeypatch):
+    videos = {"UC1": [_video("a", 10)], "UC2": [_video("b", 20), _video("c", 5)], "UC3": [_video("d", 1)]}
+    sent = {}
+    monkeypatch.setattr(batch_analysis, "fetch_all_channels", lambda *args, **kwargs: videos)
+    monkeypatch.setattr(llm_cache, "analyze", lambda prompt, data, **kwargs: (sent.update(data) or "ok", False))
+
+    _, grouped, breakdown, _ = batch_analysis.run_batch_analysis(CHANNELS)
+
+    assert grouped == sent == {"Noticias (UC1)": videos["UC1"], "Noticias (UC2)": videos["UC2"], "Economía": videos["UC3"]}
+    assert [(b["channel_id"], b["channel_name"], b["video_count"], b["total_views"]) for b in breakdown] == [
+        ("UC2", "Noticias", 2, 25), ("UC1", "Noticias", 1, 10), ("UC3", "Economía", 1, 1)]
+
+    # Al reanudar con los datos guardados se reparten igual.
+    _, _, resumed, _ = batch_analysis.run_batch_analysis(CHANNELS, videos=grouped)
+    assert resumed == breakdown
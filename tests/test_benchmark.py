@@ -0,0 +1,17 @@
+# tests/test_benchmark.py
+# Ejecuta el benchmark con la réplica local y falla si alguna operación da error.
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_replica_benchmark_has_no_errors(tmp_path):
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "benchmark.py"), "--replica", "--check",
+         "--db", str(tmp_path / "bench.db"), "--requests", "100", "--analyses", "8", "--channels", "4",
+         "--videos-per-channel", "60", "--youtube-latency", "0.005", "--llm-latency", "0.05"],
+        cwd=tmp_path, capture_output=True, text=True, timeout=600,
+    )
+    assert result.returncode == 0, result.stdout[-3000:] + result.stderr[-3000:]
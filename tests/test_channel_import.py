@@ -0,0 +1,45 @@
+# tests/test_channel_import.py
+import io
+
+import channel_import
+from db_pool import get_connection
+
+SAVED = "UC" + "a" * 22
+NEW = "UC" + "b" * 22
+
+
+def _fake_resolve(reports, quota):
+    for report in reports:
+        report.update(channel={"channel_id": report["key"], "channel_name": f"Canal {report['key'][-1]}",
+                               "uploads_playlist_id": "UU" + report["key"][2:]}, error=None)
+
+
+def test_concurrent_import_counts_existing_channel_as_duplicate(db, monkeypatch):
+    with get_connection() as conn:
+        conn.cursor().execute("DELETE FROM channels WHERE channel_id IN (?, ?)", (SAVED, NEW))
+        conn.cursor().execute("INSERT INTO channels (channel_name, channel_id, category, uploads_playlist_id) "
+                              "VALUES ('Otro', ?, 'Noticias', ?)", (SAVED, "UU" + SAVED[2:]))
+        conn.commit()
+    # Como si otra importación hubiera guardado SAVED entre la comprobación y el INSERT.
+    monkeypatch.setattr(channel_import, "_saved_channels", lambda conn, channel_ids: {})
+    monkeypatch.setattr(channel_import, "_resolve", _fake_resolve)
+
+    report = channel_import.import_channels(channel_import.parse_entries(f"{SAVED}\n{NEW}\n", "csv"))
+
+    assert report["summary"] == {"duplicate": 1, "added": 1}
+    assert [row["status"] for row in report["rows"]] == ["duplicate", "added"]
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT channel_id, channel_name FROM channels WHERE channel_id IN (?, ?) ORDER BY channel_id",
+                       (SAVED, NEW))
+        assert cursor.fetchall() == [(SAVED, "Otro"), (NEW, "Canal b")]
+
+
+def test_upload_that_is_not_utf8_is_rejected(db):
+    import app
+
+    response = app.app.test_client().post(
+        "/importar", data={"file": (io.BytesIO("canal,categoría\nUCñ,Economía\n".encode("latin-1")), "canales.csv")},
+        content_type="multipart/form-data")
+    assert response.status_code == 400
+    assert "UTF-8" in response.get_json()["error"]
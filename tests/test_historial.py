@@ -0,0 +1,30 @@
+# tests/test_historial.py
+from db_pool import get_connection
+
+
+def _plan(sql, params):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return " ".join(row[-1] for row in cursor.fetchall())
+
+
+def test_channel_filter_uses_index_without_temp_sort(db):
+    for where, params in [("channel_name = ?", ("Canal",)),
+                          ("channel_name = ? AND status = ?", ("Canal", "completed"))]:
+        plan = _plan(f"SELECT id, channel_name, status, created_at FROM analysis_jobs WHERE {where} "
+                     f"ORDER BY created_at DESC, id DESC LIMIT 21", params)
+        assert "idx_analysis_jobs_channel_name_created_at" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+def test_historial_filters_by_channel(db):
+    import app
+
+    with get_connection() as conn:
+        conn.cursor().execute("INSERT INTO analysis_jobs (id, status, channel_name, channel_id) "
+                              "VALUES ('hist-1', 'completed', 'Canal Historial', 'UChist')")
+        conn.commit()
+    response = app.app.test_client().get("/historial?channel=Canal+Historial")
+    assert response.status_code == 200
+    assert b"Canal Historial" in response.data
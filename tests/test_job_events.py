@@ -0,0 +1,17 @@
+# tests/test_job_events.py
+import time
+
+from job_events import JobEventBus
+
+
+def test_unfinished_jobs_are_forgotten_after_stale_ttl():
+    bus = JobEventBus(finished_ttl=60, stale_ttl=0.05)
+    bus.publish("remoto", "queued")
+    bus.publish("local", "completed", result="ok")
+    assert bus.latest("remoto")["stage"] == "queued"
+
+    time.sleep(0.1)
+    assert bus.latest("remoto") is None
+    bus.publish("otro", "queued")
+    assert "remoto" not in bus._latest
+    assert bus.latest("local")["result"] == "ok"
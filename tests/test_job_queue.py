@@ -0,0 +1,250 @@
+# tests/test_job_queue.py
+import threading
+import time
+import uuid
+
+import pytest
+
+from db_pool import get_connection
+from job_queue import AnalysisExecutor, DbJobQueue, QueueFullError
+
+
+@pytest.fixture
+def jobs(db):
+    """Tablas de la cola vacías al empezar cada prueba."""
+    with get_connection() as conn:
+        conn.cursor().execute("DELETE FROM job_leases")
+        conn.cursor().execute("DELETE FROM analysis_jobs")
+        conn.commit()
+
+
+def _create_job(channel_id):
+    def create(db):
+        job_id = str(uuid.uuid4())
+        db.cursor().execute("INSERT INTO analysis_jobs (id, status, channel_name, channel_id) VALUES (?, 'pending', ?, ?)",
+                            (job_id, f"Canal {channel_id}", channel_id))
+        return job_id
+    return create
+
+
+def _lease(job_id, expires_at, attempts=1, worker_id="muerto"):
+    with get_connection() as conn:
+        conn.cursor().execute("INSERT INTO job_leases (job_id, worker_id, claimed_at, expires_at, heartbeat_at, attempts) "
+                              "VALUES (?, ?, 0, ?, 0, ?)", (job_id, worker_id, expires_at, attempts))
+        conn.commit()
+
+
+def test_queue_limit_counts_jobs_with_expired_leases(jobs):
+    queue = DbJobQueue(lambda channel_id: None, max_queue=2)
+    for channel_id in ("UC1", "UC2"):
+        job_id, _ = queue.submit(channel_id, _create_job(channel_id))
+        _lease(job_id, time.time() - 10)     # su worker murió: vuelven a esperar
+    with pytest.raises(QueueFullError):
+        queue.submit("UC3", _create_job("UC3"))
+
+
+def _claim_all(queues):
+    """Cada cola intenta reclamar a la vez; devuelve lo que ha conseguido cada una."""
+    barrier = threading.Barrier(len(queues))
+    results = [None] * len(queues)
+
+    def claim(i):
+        barrier.wait()
+        results[i] = queues[i]._claim_next()
+
+    threads = [threading.Thread(target=claim, args=(i,)) for i in range(len(queues))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_submit_coalesces_pending_job_of_the_same_channel(jobs):
+    queue = DbJobQueue(lambda channel_id: None)
+    job_id, coalesced = queue.submit("UC1", _create_job("UC1"), True)
+    assert coalesced is False
+    assert queue.submit("UC1", _create_job("UC1")) == (job_id, True)
+
+
+# Candidatos sin mirar los arrendamientos: como si cada worker hubiera leído la lista antes
+# de que otro reclamara el job, que es la carrera que debe resolver el propio _CLAIM.
+_STALE_CANDIDATES = """
+    SELECT id, channel_id, options, created_at FROM analysis_jobs
+    WHERE status = 'pending' AND ? IS NOT NULL AND ? IS NOT NULL ORDER BY created_at, id LIMIT 10
+"""
+
+
+def test_only_one_queue_wins_the_claim(jobs):
+    queues = [DbJobQueue(lambda channel_id: None, worker_id=f"w{i}") for i in range(4)]
+    for queue in queues:
+        queue._CANDIDATES = _STALE_CANDIDATES
+    for _ in range(5):
+        job_id, _ = queues[0].submit("UC1", _create_job("UC1"), True)
+        claims = [claim for claim in _claim_all(queues) if claim]
+        assert len(claims) == 1
+        assert claims[0][:4] == (job_id, "UC1", [True], 1)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM job_leases WHERE job_id = ?", (job_id,))
+            assert cursor.fetchall()[0][0] == 1
+            cursor.execute("UPDATE analysis_jobs SET status = 'completed' WHERE id = ?", (job_id,))
+            conn.commit()
+
+
+def test_expired_lease_is_reclaimed_with_one_more_attempt(jobs):
+    queue = DbJobQueue(lambda channel_id: None, worker_id="nuevo", max_attempts=3)
+    job_id, _ = queue.submit("UC1", _create_job("UC1"))
+    _lease(job_id, time.time() + 60)
+    assert queue._claim_next() is None        # el otro worker sigue vivo
+
+    with get_connection() as conn:
+        conn.cursor().execute("UPDATE job_leases SET expires_at = ? WHERE job_id = ?", (time.time() - 1, job_id))
+        conn.commit()
+    assert queue._claim_next() == (job_id, "UC1", [], 2)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT worker_id, attempts FROM job_leases WHERE job_id = ?", (job_id,))
+        assert cursor.fetchall() == [("nuevo", 2)]
+    assert queue.stats()["resumed"] == 1
+
+
+def test_job_is_abandoned_after_max_attempts(jobs):
+    queue = DbJobQueue(lambda channel_id: None, max_attempts=3)
+    job_id, _ = queue.submit("UC1", _create_job("UC1"))
+    _lease(job_id, time.time() - 1, attempts=3)
+
+    assert queue._claim_next() is None
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT status, result FROM analysis_jobs WHERE id = ?", (job_id,))
+        status, result = cursor.fetchall()[0]
+        cursor.execute("SELECT COUNT(*) FROM job_leases WHERE job_id = ?", (job_id,))
+        leases = cursor.fetchall()[0][0]
+    assert status == "failed" and "3 intentos" in result
+    assert leases == 0
+    assert queue.stats()["abandoned"] == 1
+
+
+def test_heartbeat_renews_leases_and_detects_lost_ones(jobs):
+    queue = DbJobQueue(lambda channel_id: None, worker_id="vivo", lease_seconds=30)
+    queue.submit("UC1", _create_job("UC1"))
+    queue.submit("UC2", _create_job("UC2"))
+    kept, stolen = queue._claim_next()[0], queue._claim_next()[0]
+    with get_connection() as conn:
+        conn.cursor().execute("UPDATE job_leases SET worker_id = 'otro', expires_at = 0 WHERE job_id = ?", (stolen,))
+        conn.commit()
+
+    before = time.time()
+    queue.heartbeat()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT expires_at FROM job_leases WHERE job_id = ?", (kept,))
+        assert cursor.fetchall()[0][0] >= before + 30
+    assert queue.stats()["lost_leases"] == 1
+
+
+def test_resumed_job_skips_the_youtube_fetch(jobs, monkeypatch):
+    import analysis_tasks
+    import llm_cache
+    import raw_store
+    import youtube_logic
+
+    job_id = analysis_tasks.create_job("Canal", "UC1")
+    videos = [{"title": "Inflación", "views": 10, "url": "https://www.youtube.com/watch?v=x"}]
+    raw_store.save(job_id, videos)
+
+    def no_youtube(*args, **kwargs):
+        raise AssertionError("no debería llamar a YouTube")
+
+    analyzed = []
+    monkeypatch.setattr(youtube_logic, "get_channel_videos_last_week", no_youtube)
+    monkeypatch.setattr(llm_cache, "analyze", lambda prompt, data, **kwargs: (analyzed.append(data) or "análisis", False))
+
+    analysis_tasks.run_analysis_task(job_id, "UC1")
+
+    assert analyzed == [videos]
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT status, result, timings FROM analysis_jobs WHERE id = ?", (job_id,))
+        status, result, timings = cursor.fetchall()[0]
+    assert (status, result) == ("completed", "análisis")
+    assert '"resumed_from": "raw_data"' in timings
+
+
+# --- AnalysisExecutor (cola en memoria) ---
+
+class _Creator:
+    """create_job de prueba: cuenta las llamadas y puede tardar o fallar."""
+
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("sin base de datos")
+        return str(uuid.uuid4())
+
+
+def _blocking_executor(**kwargs):
+    release = threading.Event()
+    executor = AnalysisExecutor(lambda job_id, channel_id: release.wait(5), **kwargs)
+    return executor, release
+
+
+def test_executor_coalesces_and_bounds_the_queue():
+    executor, release = _blocking_executor(workers=1, max_queue=1)
+    try:
+        running, coalesced = executor.submit("UC1", _Creator())
+        assert coalesced is False
+        assert executor.submit("UC1", _Creator()) == (running, True)
+        deadline = time.time() + 5
+        while executor.queue_position(running) != 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+        waiting, _ = executor.submit("UC2", _Creator())
+        assert executor.queue_position(waiting) == 1
+        with pytest.raises(QueueFullError):
+            executor.submit("UC3", _Creator())
+        assert executor.stats()["coalesced"] == 1 and executor.stats()["rejected"] == 1
+    finally:
+        release.set()
+
+
+def test_executor_creates_jobs_outside_its_lock():
+    executor, release = _blocking_executor(workers=1)
+    creator = _Creator(delay=0.3)
+    results = []
+    try:
+        threads = [threading.Thread(target=lambda: results.append(executor.submit("UC1", creator)))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        # Mientras se crea el job, el resto del ejecutor sigue respondiendo.
+        started = time.monotonic()
+        executor.stats()
+        executor.runs_locally("otro")
+        assert time.monotonic() - started < 0.1
+        for thread in threads:
+            thread.join()
+    finally:
+        release.set()
+    assert creator.calls == 1
+    assert sorted(coalesced for _, coalesced in results) == [False, True]
+    assert results[0][0] == results[1][0]
+
+
+def test_executor_releases_the_slot_when_create_job_fails():
+    executor, release = _blocking_executor(workers=1, max_queue=1)
+    try:
+        with pytest.raises(RuntimeError):
+            executor.submit("UC1", _Creator(fail=True))
+        job_id, coalesced = executor.submit("UC1", _Creator())
+        assert job_id and coalesced is False
+    finally:
+        release.set()
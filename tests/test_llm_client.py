@@ -0,0 +1,116 @@
+# tests/test_llm_client.py
+# Reintentos, modelos de respaldo y hedging de LLMClient contra una sesión HTTP falsa.
+import json
+import threading
+import time
+
+import llm_analyzer
+from llm_analyzer import LLMClient
+
+
+class _Response:
+    def __init__(self, status=200, body=None, headers=None, lines=None):
+        self.status_code = status
+        self.ok = status < 400
+        self.headers = headers or {}
+        self._body = body or {}
+        self.text = json.dumps(self._body)
+        self._lines = lines or []
+        self.closed = False
+
+    def json(self):
+        return self._body
+
+    def iter_lines(self, decode_unicode=False):
+        for line in self._lines:
+            time.sleep(0.02)
+            if self.closed:
+                raise AttributeError("respuesta cerrada")
+            yield line
+
+    def close(self):
+        self.closed = True
+
+
+def ok(text):
+    return lambda: _Response(body={"choices": [{"message": {"content": text}}]})
+
+
+def streamed(*parts):
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': part}}]})}" for part in parts]
+    return lambda: _Response(lines=lines + ["data: [DONE]"])
+
+
+def error(status, retry_after=None):
+    return lambda: _Response(status, {"error": {"message": "no"}}, {"Retry-After": retry_after} if retry_after else {})
+
+
+class _Session:
+    """Responde a cada modelo según su guion de (retraso, respuesta); el último paso se repite."""
+
+    def __init__(self, script):
+        self.script = {model: list(steps) for model, steps in script.items()}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def post(self, url, headers=None, json=None, timeout=None, stream=False):
+        model = json["model"]
+        with self._lock:
+            self.calls.append((model, time.monotonic()))
+            steps = self.script[model]
+            delay, response = steps.pop(0) if len(steps) > 1 else steps[0]
+        time.sleep(delay)
+        return response()
+
+
+def _client(script, **kwargs):
+    options = {"api_url": "http://llm.invalid", "api_key": "k", "models": list(script), "max_retries": 2,
+               "backoff_base": 0.01, "backoff_max": 0.01, "hedge_after": 0, **kwargs}
+    client = LLMClient(**options)
+    client.session = _Session(script)
+    return client
+
+
+def test_retry_after_is_honoured(monkeypatch):
+    # Sin Retry-After el backoff sería de 5 s.
+    monkeypatch.setattr(llm_analyzer.random, "uniform", lambda a, b: 5)
+    client = _client({"a": [(0, error(429, "0.2")), (0, ok("hola"))]})
+
+    assert client.complete("x") == ("a", "hola")
+    (_, first), (_, second) = client.session.calls
+    assert 0.2 <= second - first < 1
+    assert client.stats()["per_model"]["a"]["retries"] == 1
+
+
+def test_falls_back_to_the_next_model(monkeypatch):
+    monkeypatch.setattr(llm_analyzer, "LLM_RETRY_AFTER_MAX", 60)
+    client = _client({"a": [(0, error(503))], "b": [(0, error(429, "3600"))], "c": [(0, ok("de respaldo"))]})
+
+    assert client.complete("x") == ("c", "de respaldo")
+    models = [model for model, _ in client.session.calls]
+    # `a` agota sus reintentos; `b` pide esperar más de lo admitido y se salta sin esperar.
+    assert models == ["a", "a", "a", "b", "c"]
+
+
+def test_hedge_returns_the_winner_and_ignores_the_loser():
+    # El hedge sale a los 0.1 s y empieza a emitir a los ~0.14 s; el lento empieza a los
+    # ~0.27 s, cuando el ganador aún está emitiendo (termina hacia los 0.34 s).
+    winner = [f"r{i} " for i in range(10)]
+    client = _client({"lento": [(0.25, streamed("lento ", "y ", "tarde"))], "rapido": [(0.02, streamed(*winner))]},
+                     hedge_after=0.1)
+    chunks = []
+
+    assert client.complete("x", on_chunk=chunks.append) == ("rapido", "".join(winner))
+    client._pool.shutdown(wait=True)     # deja terminar al perdedor
+    assert chunks == winner
+    stats = client.stats()["per_model"]
+    assert stats["rapido"]["hedge_wins"] == 1
+    assert stats["lento"]["cancelled"] == 1 and stats["lento"]["successes"] == 0
+
+
+def test_hedge_without_streaming_ignores_the_slower_answer():
+    client = _client({"lento": [(0.4, ok("lento"))], "rapido": [(0, ok("rápido"))]}, hedge_after=0.1)
+
+    assert client.complete("x") == ("rapido", "rápido")
+    client._pool.shutdown(wait=True)
+    assert client.stats()["per_model"]["lento"]["successes"] == 0
@@ -0,0 +1,20 @@
+# tests/test_llm_stream.py
+# Lectura del stream SSE de OpenRouter contra el servidor falso de bench_servers.
+import requests
+
+import llm_analyzer
+from bench_servers import FakeOpenRouter
+
+
+def test_stream_ending_with_usage_only_chunk():
+    server = FakeOpenRouter(response_words=25)
+    url = server.start()
+    try:
+        response = requests.post(f"{url}/api/v1/chat/completions", json={"model": "m", "stream": True},
+                                 stream=True, timeout=10)
+        chunks = []
+        text = llm_analyzer._stream_text(response, chunks.append)
+    finally:
+        server.stop()
+    assert text == "".join(f"palabra{i} " for i in range(25))
+    assert len(chunks) == 3
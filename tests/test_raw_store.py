@@ -0,0 +1,43 @@
+# tests/test_raw_store.py
+import json
+
+import pytest
+
+import raw_store
+
+VIDEOS = [{"title": f"Inflación «{i}» 📈", "views": i * 1000, "url": f"https://www.youtube.com/watch?v={i}",
+           "tags": ["a, b", "c:d"], "ratio": i / 7} for i in range(40)]
+
+
+def _lines(blob, chunk_size):
+    return [json.loads(line) for line in b"".join(raw_store.iter_ndjson(blob, chunk_size)).decode("utf-8").splitlines()]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+def test_ndjson_of_a_video_list(chunk_size):
+    blob, _ = raw_store.encode(VIDEOS)
+    assert _lines(blob, chunk_size) == VIDEOS
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+def test_ndjson_of_several_channels(chunk_size):
+    data = {"Canal «uno»": VIDEOS[:25], "Vacío": [], "Canal, dos (UC2)": VIDEOS[25:]}
+    blob, _ = raw_store.encode(data)
+    expected = [{"channel": name, **video} for name, videos in data.items() for video in videos]
+    assert _lines(blob, chunk_size) == expected
+
+
+def test_ndjson_is_streamed_without_decompressing_everything(monkeypatch):
+    blob, raw_size = raw_store.encode(VIDEOS * 50)
+
+    def whole_blob(*args, **kwargs):
+        raise AssertionError("no debería descomprimir el blob entero")
+
+    monkeypatch.setattr(raw_store.gzip, "decompress", whole_blob)
+    consumed = []
+    original = raw_store.iter_json
+    monkeypatch.setattr(raw_store, "iter_json",
+                        lambda *args: (consumed.append(len(chunk)) or chunk for chunk in original(*args)))
+    first = next(raw_store.iter_ndjson(blob, 1024))
+    assert json.loads(first) == VIDEOS[0]
+    assert sum(consumed) < raw_size / 10
@@ -0,0 +1,51 @@
+# tests/test_video_store.py
+import video_store
+from db_pool import get_connection
+
+DAY = 86400
+
+
+def test_downsample_stats_counts_each_delete(db):
+    now = 1000 * DAY
+    rows = [
+        # Más viejas que la retención: se borran las dos.
+        (now - 100 * DAY,), (now - 95 * DAY,),
+        # Zona diaria: tres fotos del mismo día, queda la última.
+        (now - 30 * DAY + 100,), (now - 30 * DAY + 200,), (now - 30 * DAY + 300,),
+        # Zona horaria: tres fotos de la misma hora, queda la última.
+        (now - 5 * DAY + 10,), (now - 5 * DAY + 20,), (now - 5 * DAY + 30,),
+        # Recientes: se conservan todas.
+        (now - 3600 + 10,), (now - 3600 + 20,), (now - 3600 + 30,),
+    ]
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM video_stats WHERE video_id = 'downsample'")
+        cursor.executemany("INSERT INTO video_stats (video_id, observed_at, views) VALUES ('downsample', ?, 1)", rows)
+        conn.commit()
+
+    assert video_store.downsample_stats(now) == 6
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT observed_at FROM video_stats WHERE video_id = 'downsample' ORDER BY observed_at")
+        kept = [row[0] for row in cursor.fetchall()]
+    assert kept == [now - 30 * DAY + 300, now - 5 * DAY + 30, now - 3600 + 10, now - 3600 + 20, now - 3600 + 30]
+
+
+def test_window_videos_keep_same_named_channels_apart(db):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("INSERT OR REPLACE INTO channels (channel_id, channel_name) VALUES (?, ?)",
+                           [("UCventanaA", "Noticias"), ("UCventanaB", "Noticias"), ("UCventanaC", "Deportes")])
+        conn.commit()
+    video_store.upsert_videos([
+        {'video_id': 'ventana-a', 'channel_id': 'UCventanaA', 'title': 'A', 'published_at': '2099-01-02T00:00:00Z', 'views': 10},
+        {'video_id': 'ventana-b', 'channel_id': 'UCventanaB', 'title': 'B', 'published_at': '2099-01-02T00:00:00Z', 'views': 20},
+        {'video_id': 'ventana-c', 'channel_id': 'UCventanaC', 'title': 'C', 'published_at': '2099-01-02T00:00:00Z', 'views': 30},
+    ])
+
+    grouped = video_store.get_window_videos('2099-01-01T00:00:00Z')
+
+    assert {label: [v['title'] for v in videos] for label, videos in grouped.items()} == {
+        "Noticias (UCventanaA)": ["A"], "Noticias (UCventanaB)": ["B"], "Deportes": ["C"]}
+    assert list(video_store.get_window_videos('2099-01-01T00:00:00Z', 'UCventanaA')) == ["Noticias"]
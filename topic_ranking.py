@@ -0,0 +1,261 @@
+# topic_ranking.py
+# Pre-clasificación local de los videos por tema económico. Los títulos se vectorizan
+# con TF-IDF (NumPy), cada video se asigna al tema del léxico con más peso en su título
+# y se calculan las vistas por tema. Sirve como endpoint JSON por sí solo y como resumen
+# pequeño que se manda al LLM en lugar de todos los títulos.
+import json
+import os
+import re
+import time
+import unicodedata
+
+import payload_builder
+
+TOPIC_TOP_VIDEOS = int(os.getenv("TOPIC_TOP_VIDEOS", 10))   # videos por tema en el resumen y en el JSON
+TOPIC_TOP_TERMS = int(os.getenv("TOPIC_TOP_TERMS", 15))
+# "views" ordena temas y videos por vistas totales; "velocity" por vistas por hora, que no
+# favorece a los videos más viejos solo por haber tenido más tiempo.
+TOPIC_RANK_BY = os.getenv("TOPIC_RANK_BY", "views")
+RANK_BY_OPTIONS = ("views", "velocity")
+
+OTHER_TOPIC = "other"
+
+# tema -> (etiqueta, términos). Los términos de dos palabras se comparan con los bigramas del título.
+TOPIC_LEXICON = {
+    "inflation": ("Inflación y precios", (
+        "inflation", "inflacion", "prices", "price", "precios", "cpi", "ppi", "cost of living", "costo de vida",
+        "grocery", "groceries", "food prices", "eggs", "expensive", "affordability", "shrinkflation")),
+    "jobs": ("Empleo y salarios", (
+        "jobs", "job", "jobs report", "unemployment", "layoffs", "layoff", "hiring", "payrolls", "workers",
+        "wages", "wage", "salary", "salaries", "empleo", "desempleo", "despidos", "salarios", "labor market")),
+    "housing": ("Vivienda", (
+        "housing", "home prices", "homes", "house", "mortgage", "mortgages", "rent", "rents", "renters",
+        "real estate", "homebuyers", "vivienda", "hipoteca", "hipotecas", "alquiler")),
+    "rates": ("Tipos de interés y Fed", (
+        "fed", "federal reserve", "powell", "interest rates", "interest rate", "rate cut", "rate cuts",
+        "rate hike", "rate hikes", "fomc", "tasas", "tipos de interes", "reserva federal")),
+    "markets": ("Bolsa y mercados", (
+        "stocks", "stock", "stock market", "wall street", "dow", "nasdaq", "s&p", "bonds",
+        "treasury", "yields", "selloff", "crash", "rally", "bolsa", "acciones", "mercados")),
+    "recession": ("Recesión y crecimiento", (
+        "recession", "gdp", "economy", "economic", "slowdown", "downturn", "depression", "growth",
+        "recesion", "economia", "crisis", "collapse")),
+    "trade": ("Aranceles y comercio", (
+        "tariffs", "tariff", "trade war", "trade", "imports", "exports", "china", "aranceles", "arancel",
+        "comercio", "supply chain")),
+    "taxes": ("Impuestos", (
+        "tax", "taxes", "irs", "tax cuts", "tax cut", "impuestos", "impuesto")),
+    "debt": ("Deuda y déficit", (
+        "debt", "national debt", "deficit", "debt ceiling", "shutdown", "spending", "budget", "deuda",
+        "deficit fiscal", "presupuesto", "credit card", "credit cards", "student loans", "loans")),
+    "energy": ("Energía y gasolina", (
+        "oil", "gas", "gas prices", "gasoline", "energy", "opec", "electricity", "petroleo", "gasolina", "energia")),
+    "crypto": ("Criptomonedas", (
+        "bitcoin", "crypto", "cryptocurrency", "ethereum", "btc", "criptomonedas", "cripto")),
+    "banking": ("Bancos", (
+        "bank", "banks", "banking", "bank run", "fdic", "bancos", "banco")),
+    "retirement": ("Jubilación y Seguridad Social", (
+        "social security", "retirement", "retirees", "pension", "pensions", "401k", "medicare",
+        "jubilacion", "pensiones", "seguridad social")),
+}
+
+# Palabras vacías que no aportan como términos emergentes.
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how i if in into is it its just may more new no not now of on or
+our out over so than that the their them there these they this to up us was we what when where which who why will
+with you your after before about all can could do does down get got here just like live make most news only said
+says see still time today top two very watch week what's would year years el la los las un una y o de del en por
+para con que se su sus es al lo como mas ya hoy ante sobre sin
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9&$%]+")
+
+
+def _tokens(title):
+    """Minúsculas sin tildes, unigramas y bigramas."""
+    text = unicodedata.normalize("NFKD", payload_builder.normalize_title(title).lower())
+    words = _TOKEN_RE.findall("".join(ch for ch in text if not unicodedata.combining(ch)))
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def _entries(video_data):
+    if isinstance(video_data, dict):
+        return [(name, video) for name, videos in video_data.items() for video in videos]
+    return [(None, video) for video in video_data]
+
+
+def _video_json(channel, video):
+    entry = {"title": video.get("title", ""), "views": video.get("views", 0), "url": video.get("url", "")}
+    if "views_per_hour" in video:
+        entry["views_per_hour"] = video["views_per_hour"]
+    if channel is not None:
+        entry["channel"] = channel
+    return entry
+
+
+def rank_topics(video_data, top_videos=TOPIC_TOP_VIDEOS, top_terms=TOPIC_TOP_TERMS, rank_by=TOPIC_RANK_BY):
+    """
+    Clasifica los videos (lista o dict canal -> lista) por tema y ordena los temas por
+    vistas o por vistas por hora (`rank_by`). Devuelve un dict serializable a JSON.
+    """
+    import numpy as np
+
+    if rank_by not in RANK_BY_OPTIONS:
+        raise ValueError(f"rank_by debe ser uno de {RANK_BY_OPTIONS}.")
+
+    start = time.perf_counter()
+    entries = _entries(video_data)
+    topics = list(TOPIC_LEXICON)
+    topic_index = {topic: i for i, topic in enumerate(topics)}
+    other = len(topics)
+
+    # 1. Vocabulario y matriz documento-término dispersa (filas, columnas), binaria por título.
+    vocabulary = {}
+    rows, cols = [], []
+    for row, (_, video) in enumerate(entries):
+        for term_id in {vocabulary.setdefault(term, len(vocabulary)) for term in _tokens(video.get("title", ""))}:
+            rows.append(row)
+            cols.append(term_id)
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    n_videos, n_terms = len(entries), len(vocabulary)
+    views = np.asarray([max(0, int(video.get("views") or 0)) for _, video in entries], dtype=np.float64)
+    velocity = np.asarray([max(0.0, float(video.get("views_per_hour") or 0)) for _, video in entries], dtype=np.float64)
+    has_velocity = any("views_per_hour" in video for _, video in entries)
+
+    # 2. Pesos TF-IDF normalizados por título.
+    document_frequency = np.bincount(cols, minlength=n_terms)
+    idf = np.log((1 + n_videos) / (1 + document_frequency)) + 1
+    weights = idf[cols]
+    norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=n_videos))
+    weights = weights / np.where(norms > 0, norms, 1)[rows]
+
+    # 3. Puntuación por tema: suma de los pesos de los términos del léxico presentes en el título.
+    term_topic = np.full(n_terms, -1, dtype=np.int64)
+    for topic, (_, terms) in TOPIC_LEXICON.items():
+        for term in terms:
+            term_id = vocabulary.get(" ".join(_TOKEN_RE.findall(term)))
+            if term_id is not None and term_topic[term_id] < 0:
+                term_topic[term_id] = topic_index[topic]
+    matched = term_topic[cols] >= 0
+    scores = np.zeros((n_videos, len(topics)))
+    np.add.at(scores, (rows[matched], term_topic[cols[matched]]), weights[matched])
+    assigned = np.where(scores.max(axis=1, initial=0) > 0, scores.argmax(axis=1), other)
+
+    # 4. Agregados ponderados por vistas.
+    counts = np.bincount(assigned, minlength=other + 1)
+    topic_views = np.bincount(assigned, weights=views, minlength=other + 1)
+    topic_velocity = np.bincount(assigned, weights=velocity, minlength=other + 1)
+    total_views = float(views.sum())
+    metric, topic_metric = (velocity, topic_velocity) if rank_by == "velocity" else (views, topic_views)
+    order = np.argsort(-metric, kind="stable")
+    id_to_term = list(vocabulary)
+
+    ranking = []
+    for index in np.argsort(-topic_metric[:other], kind="stable").tolist() + [other]:
+        if not counts[index]:
+            continue
+        topic = topics[index] if index < other else OTHER_TOPIC
+        members = order[assigned[order] == index]
+        keywords = []
+        if index < other:
+            hits = matched & (term_topic[cols] == index) & (assigned[rows] == index)
+            term_counts = np.bincount(cols[hits], minlength=n_terms)
+            keywords = [id_to_term[i] for i in np.argsort(-term_counts, kind="stable")[:5] if term_counts[i]]
+        entry = {
+            "topic": topic,
+            "label": TOPIC_LEXICON[topic][0] if index < other else "Otros",
+            "video_count": int(counts[index]),
+            "views": int(topic_views[index]),
+            "view_share": round(float(topic_views[index]) / total_views, 4) if total_views else 0.0,
+            "avg_views": int(topic_views[index] / counts[index]),
+        }
+        if has_velocity:
+            entry["views_per_hour"] = round(float(topic_velocity[index]), 1)
+        entry["keywords"] = keywords
+        entry["top_videos"] = [_video_json(*entries[i]) for i in members[:top_videos].tolist()]
+        ranking.append(entry)
+
+    # 5. Términos con más peso (TF-IDF x vistas) en los títulos que el léxico no reconoce.
+    emerging = []
+    untagged = assigned[rows] == other
+    if untagged.any():
+        term_weight = np.bincount(cols[untagged], weights=weights[untagged] * views[rows[untagged]], minlength=n_terms)
+        for i in np.argsort(-term_weight, kind="stable"):
+            if not term_weight[i] or len(emerging) >= top_terms:
+                break
+            term = id_to_term[i]
+            if not any(word in STOPWORDS or word.isdigit() or len(word) < 3 for word in term.split()):
+                emerging.append({"term": term, "weight": round(float(term_weight[i]), 1)})
+
+    result = {
+        "rank_by": rank_by,
+        "video_count": n_videos,
+        "total_views": int(total_views),
+        "classified_share": round(1 - float(counts[other]) / n_videos, 4) if n_videos else 0.0,
+        "topics": ranking,
+        "emerging_terms": emerging,
+    }
+    if isinstance(video_data, dict):
+        channels = [name for name, _ in entries]
+        result["channels"] = _channel_topics(np, channels, assigned, views, topics, other)
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def _channel_topics(np, channels, assigned, views, topics, other):
+    """Tema con más vistas de cada canal (sin contar 'otros' salvo que no haya otro)."""
+    names = list(dict.fromkeys(channels))
+    channel_index = {name: i for i, name in enumerate(names)}
+    codes = np.asarray([channel_index[name] for name in channels], dtype=np.int64)
+    matrix = np.zeros((len(names), other + 1))
+    np.add.at(matrix, (codes, assigned), views)
+    summary = []
+    for i, name in enumerate(names):
+        best = int(matrix[i, :other].argmax()) if matrix[i, :other].any() else other
+        summary.append({"channel": name, "top_topic": topics[best] if best < other else OTHER_TOPIC,
+                        "top_topic_views": int(matrix[i, best]), "total_views": int(matrix[i].sum())})
+    summary.sort(key=lambda entry: entry["total_views"], reverse=True)
+    return summary
+
+
+def llm_summary(ranking):
+    """Resumen compacto (JSON sin espacios) del ranking para mandar al LLM."""
+    def compact(video):
+        entry = payload_builder.compact_video(video)
+        if "channel" in video:
+            entry = entry[:3] + [video.get("views_per_hour"), video["channel"]]
+        return entry
+
+    topics = []
+    for entry in ranking["topics"]:
+        topic = {"topic": entry["topic"], "videos": entry["video_count"], "views": entry["views"],
+                 "share": entry["view_share"]}
+        if "views_per_hour" in entry:
+            topic["views_per_hour"] = entry["views_per_hour"]
+        topic["top"] = [compact(video) for video in entry["top_videos"]]
+        topics.append(topic)
+    body = {
+        "url_prefix": payload_builder.URL_PREFIX,
+        "ranked_by": ranking["rank_by"],
+        "video_count": ranking["video_count"],
+        "total_views": ranking["total_views"],
+        "topics": topics,
+    }
+    if ranking["emerging_terms"]:
+        body["unclassified_terms"] = [term["term"] for term in ranking["emerging_terms"]]
+    if "channels" in ranking:
+        body["channels"] = {entry["channel"]: [entry["top_topic"], entry["total_views"]] for entry in ranking["channels"]}
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":"))
+
+
+def format_video_list(video_data):
+    """Lista completa de videos, ordenada por vistas, que se añade al final del análisis."""
+    lines = ["", "---", "Lista completa de videos (calculada localmente):"]
+    groups = video_data.items() if isinstance(video_data, dict) else [(None, video_data)]
+    for name, videos in groups:
+        if name is not None:
+            lines.append(f"\n• {name}")
+        for video in sorted(videos, key=lambda v: v.get('views', 0), reverse=True):
+            lines.append(f"    - {video.get('title', '')} ({video.get('views', 0):,} vistas) {video.get('url', '')}")
+    return "\n".join(lines)
@@ -0,0 +1,255 @@
+# video_store.py
+# Almacén local de videos de YouTube (tabla `videos`). Cada video se guarda una sola
+# vez por ID, así la ingesta solo pide a la API los videos nuevos y las estadísticas
+# de la ventana analizada. Cada lectura de estadísticas se anota además en la serie
+# temporal `video_stats`, de la que sale la velocidad (vistas por hora) de cada video.
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from db_pool import get_connection, get_read_connection
+
+# La velocidad se mide contra la última foto anterior a esta antigüedad (horas).
+VELOCITY_WINDOW_HOURS = float(os.getenv("VELOCITY_WINDOW_HOURS", 6))
+# Con menos separación entre fotos no se mide: se usa vistas / horas desde la publicación.
+VELOCITY_MIN_HOURS = float(os.getenv("VELOCITY_MIN_HOURS", 0.25))
+# Reducción de la serie: pasados estos días se deja una foto por hora, y luego una por día.
+STATS_HOURLY_AFTER_DAYS = float(os.getenv("STATS_HOURLY_AFTER_DAYS", 2))
+STATS_DAILY_AFTER_DAYS = float(os.getenv("STATS_DAILY_AFTER_DAYS", 14))
+STATS_RETENTION_DAYS = float(os.getenv("STATS_RETENTION_DAYS", 90))
+STATS_DOWNSAMPLE_EVERY = float(os.getenv("STATS_DOWNSAMPLE_EVERY", 3600))   # segundos entre reducciones
+
+_downsample_lock = threading.Lock()
+_last_downsample = 0.0
+
+
+def utc_now_iso():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def get_uploads_playlist_id(channel_id):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT uploads_playlist_id FROM channels WHERE channel_id = ?", (channel_id,))
+        row = cursor.fetchone()
+    return row[0] if row and row[0] else None
+
+
+def save_uploads_playlist_id(channel_id, playlist_id):
+    with get_connection() as conn:
+        conn.cursor().execute("UPDATE channels SET uploads_playlist_id = ? WHERE channel_id = ?", (playlist_id, channel_id))
+        conn.commit()
+
+
+def filter_known_video_ids(video_ids):
+    """Devuelve el subconjunto de `video_ids` que ya está en el almacén."""
+    if not video_ids:
+        return set()
+    placeholders = ",".join("?" for _ in video_ids)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT video_id FROM videos WHERE video_id IN ({placeholders})", tuple(video_ids))
+        return {row[0] for row in cursor.fetchall()}
+
+
+def get_recent_video_ids(channel_id, since):
+    """IDs de los videos del canal publicados desde `since` (ISO 8601 UTC), del más nuevo al más viejo."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT video_id FROM videos WHERE channel_id = ? AND published_at >= ? ORDER BY published_at DESC",
+            (channel_id, since)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def get_window_videos(since, channel_id=None):
+    """
+    Videos publicados desde `since` agrupados por canal, en el formato del análisis
+    ({'title', 'views', 'url', 'views_per_hour'}). Los grupos van por channel_id y se
+    etiquetan con batch_analysis.channel_labels, así dos canales con el mismo nombre no
+    se mezclan. Solo lee el almacén: no gasta cuota.
+    """
+    import batch_analysis  # batch_analysis importa este módulo
+
+    by_channel, names = {}, {}
+    for video in rank_by_velocity(since, channel_id, limit=None):
+        names.setdefault(video['channel_id'], video['channel_name'] or video['channel_id'])
+        by_channel.setdefault(video['channel_id'], []).append(
+            {'title': video['title'], 'views': video['views'] or 0, 'url': video['url'],
+             'views_per_hour': video['views_per_hour']})
+    labels = batch_analysis.channel_labels([{'channel_id': cid, 'channel_name': name} for cid, name in names.items()])
+    return {labels[cid]: videos for cid, videos in by_channel.items()}
+
+
+def upsert_videos(videos):
+    """
+    Inserta o actualiza videos en un solo lote. Cada video es un dict con
+    video_id, channel_id, title, published_at y views.
+    """
+    if not videos:
+        return
+    now = utc_now_iso()
+    rows = [(v['video_id'], v['channel_id'], v['title'], v['published_at'], v['views'], now) for v in videos]
+    with get_connection() as conn:
+        conn.cursor().executemany(
+            """
+            INSERT INTO videos (video_id, channel_id, title, published_at, views, stats_updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(video_id) DO UPDATE SET
+                title = excluded.title,
+                views = excluded.views,
+                stats_updated_at = excluded.stats_updated_at
+            """,
+            rows
+        )
+        conn.commit()
+    record_snapshots(videos)
+
+
+def record_snapshots(videos, now=None):
+    """
+    Añade una foto de las vistas de cada video a `video_stats`, salvo que no hayan
+    cambiado desde la última: la serie solo guarda los cambios y la última lectura
+    queda en `videos.stats_updated_at`.
+    """
+    if not videos:
+        return
+    now = int(now if now is not None else time.time())
+    rows = [(v['video_id'], now, v['views'], v['video_id'], v['views']) for v in videos if v.get('views') is not None]
+    with get_connection() as conn:
+        conn.cursor().executemany(
+            """
+            INSERT OR IGNORE INTO video_stats (video_id, observed_at, views)
+            SELECT ?, ?, ? WHERE COALESCE(
+                (SELECT views FROM video_stats WHERE video_id = ? ORDER BY observed_at DESC LIMIT 1), -1) != ?
+            """,
+            rows
+        )
+        conn.commit()
+    _maybe_downsample(now)
+
+
+def _maybe_downsample(now):
+    global _last_downsample
+    with _downsample_lock:
+        if now - _last_downsample < STATS_DOWNSAMPLE_EVERY:
+            return
+        _last_downsample = now
+    try:
+        downsample_stats(now)
+    except Exception as e:
+        print(f"Error reduciendo la serie de vistas: {e}")
+
+
+def downsample_stats(now=None):
+    """
+    Deja una foto por hora en lo que tiene más de STATS_HOURLY_AFTER_DAYS días, una por
+    día pasados STATS_DAILY_AFTER_DAYS y borra lo anterior a STATS_RETENTION_DAYS. De
+    cada intervalo se conserva la última foto. Devuelve las filas borradas.
+    """
+    now = int(now if now is not None else time.time())
+    deleted = 0
+    with get_connection() as conn:
+        # Un cursor por sentencia: en libsql `rowcount` se acumula en el mismo cursor.
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM video_stats WHERE observed_at < ?", (now - int(STATS_RETENTION_DAYS * 86400),))
+        deleted += cursor.rowcount
+        for after_days, bucket in ((STATS_DAILY_AFTER_DAYS, 86400), (STATS_HOURLY_AFTER_DAYS, 3600)):
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                DELETE FROM video_stats WHERE observed_at < ? AND EXISTS (
+                    SELECT 1 FROM video_stats newer
+                    WHERE newer.video_id = video_stats.video_id
+                      AND newer.observed_at > video_stats.observed_at
+                      AND newer.observed_at / ? = video_stats.observed_at / ?)
+                """,
+                (now - int(after_days * 86400), bucket, bucket)
+            )
+            deleted += cursor.rowcount
+        conn.commit()
+    return deleted
+
+
+def _parse_iso(value):
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+
+
+def _velocity(row, now):
+    """(vistas_por_hora, origen) de una fila de `_VELOCITY_QUERY`."""
+    _, _, _, published_at, views, stats_updated_at, ref_at, ref_views = row
+    views = views or 0
+    current_at = _parse_iso(stats_updated_at) if stats_updated_at else now
+    if ref_at is not None and ref_views is not None and current_at - ref_at >= VELOCITY_MIN_HOURS * 3600:
+        return max(0.0, (views - ref_views) / ((current_at - ref_at) / 3600)), "snapshots"
+    hours = max((current_at - _parse_iso(published_at)) / 3600, VELOCITY_MIN_HOURS) if published_at else None
+    return (views / hours, "lifetime") if hours else (0.0, "lifetime")
+
+
+# La referencia es la última foto anterior al corte o, si no hay, la primera de la serie.
+# Todo se resuelve con el índice (channel_id, published_at) y la clave de video_stats.
+_VELOCITY_QUERY = """
+    SELECT x.video_id, x.channel_id, x.title, x.published_at, x.views, x.stats_updated_at, x.ref_at, s.views
+    FROM (
+        SELECT v.video_id, v.channel_id, v.title, v.published_at, v.views, v.stats_updated_at,
+               COALESCE(
+                   (SELECT MAX(observed_at) FROM video_stats WHERE video_id = v.video_id AND observed_at <= ?),
+                   (SELECT MIN(observed_at) FROM video_stats WHERE video_id = v.video_id)) AS ref_at
+        FROM videos v WHERE {where}
+    ) x
+    LEFT JOIN video_stats s ON s.video_id = x.video_id AND s.observed_at = x.ref_at
+"""
+
+
+def get_velocities(video_ids, now=None):
+    """Dict video_id -> vistas por hora (redondeadas) de los videos dados."""
+    if not video_ids:
+        return {}
+    now = now if now is not None else time.time()
+    video_ids = list(video_ids)
+    rows = []
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for start in range(0, len(video_ids), 500):
+            batch = video_ids[start:start + 500]
+            cursor.execute(_VELOCITY_QUERY.format(where=f"v.video_id IN ({','.join('?' for _ in batch)})"),
+                           (int(now - VELOCITY_WINDOW_HOURS * 3600), *batch))
+            rows.extend(cursor.fetchall())
+    return {row[0]: round(_velocity(row, now)[0], 1) for row in rows}
+
+
+def rank_by_velocity(since, channel_id=None, limit=50, now=None):
+    """
+    Videos publicados desde `since` ordenados por vistas por hora, con el nombre del
+    canal. Lee de la réplica si está configurada.
+    """
+    now = now if now is not None else time.time()
+    where, params = "v.published_at >= ?", [since]
+    if channel_id:
+        where, params = "v.channel_id = ? AND v.published_at >= ?", [channel_id, since]
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_VELOCITY_QUERY.format(where=where), (int(now - VELOCITY_WINDOW_HOURS * 3600), *params))
+        rows = cursor.fetchall()
+        cursor.execute("SELECT channel_id, channel_name FROM channels")
+        names = dict(cursor.fetchall())
+    ranked = []
+    for row in rows:
+        views_per_hour, source = _velocity(row, now)
+        ranked.append({
+            'video_id': row[0], 'channel_id': row[1], 'channel_name': names.get(row[1]), 'title': row[2],
+            'published_at': row[3], 'views': row[4], 'views_per_hour': round(views_per_hour, 1),
+            'velocity_source': source, 'url': f"https://www.youtube.com/watch?v={row[0]}",
+        })
+    ranked.sort(key=lambda v: v['views_per_hour'], reverse=True)
+    return ranked[:limit] if limit else ranked
+
+
+def get_view_series(video_id):
+    """Serie de vistas de un video: [(unix_ts, vistas)] de la más vieja a la más nueva."""
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT observed_at, views FROM video_stats WHERE video_id = ? ORDER BY observed_at", (video_id,))
+        return [tuple(row) for row in cursor.fetchall()]
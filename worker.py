@@ -0,0 +1,51 @@
+# worker.py
+"""
+Worker de análisis independiente de la app web. Reclama jobs pendientes de la tabla
+`analysis_jobs` mediante arrendamientos con latido (ver job_queue.DbJobQueue), así
+que se pueden lanzar tantos como haga falta, en esta u otras máquinas, contra la
+misma base de datos. Si un worker muere, sus jobs se retoman al caducar el
+arrendamiento, reutilizando los datos de YouTube que ya se hubieran guardado.
+
+La app debe usar la misma cola (JOB_QUEUE_MODE=db en su .env); con
+JOB_WORKERS_IN_WEB=0 la app solo encola y todo el trabajo lo hacen los workers.
+
+Uso:
+    python worker.py                 # ANALYSIS_WORKERS hilos
+    python worker.py --workers 4
+"""
+import argparse
+import os
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, help="Análisis simultáneos en este proceso")
+    args = parser.parse_args()
+
+    # La configuración se lee al importar: este proceso siempre usa la cola compartida.
+    # Solo se importan las tareas, no la app, así que ni el planificador ni los workers
+    # de la web arrancan aquí.
+    os.environ["JOB_QUEUE_MODE"] = "db"
+    import analysis_tasks
+
+    queue = analysis_tasks.executor
+    if args.workers:
+        queue.workers = max(1, args.workers)
+    queue.start()
+    print(f"Worker {queue.worker_id} atendiendo la cola con {queue.workers} hilos. Ctrl+C para parar.")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print("Parando: no se reclaman más jobs; se espera a que terminen los que están en curso "
+              "(otro Ctrl+C sale ya y otro worker los retomará).")
+        try:
+            queue.stop()
+        except KeyboardInterrupt:
+            pass
+    print(f"Worker parado: {queue.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# youtube_cache.py
+# Caché de las descargas de YouTube por canal: un nivel en memoria (LRU con TTL)
+# y, opcionalmente, un nivel en la base de datos que sobrevive a los reinicios.
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db_pool import get_connection
+
+YOUTUBE_CACHE_TTL = float(os.getenv("YOUTUBE_CACHE_TTL", 900))
+YOUTUBE_CACHE_MAX_SIZE = int(os.getenv("YOUTUBE_CACHE_MAX_SIZE", 256))
+YOUTUBE_CACHE_DB = os.getenv("YOUTUBE_CACHE_DB", "0") == "1"
+# TTL propio para algunos canales, p. ej. "UCabc=300,UCdef=3600"
+YOUTUBE_CACHE_TTL_OVERRIDES = os.getenv("YOUTUBE_CACHE_TTL_OVERRIDES", "")
+
+
+def parse_ttl_overrides(raw):
+    overrides = {}
+    for entry in raw.split(","):
+        if "=" in entry:
+            channel_id, seconds = entry.split("=", 1)
+            overrides[channel_id.strip()] = float(seconds)
+    return overrides
+
+
+class ChannelCache:
+    """
+    Caché LRU con TTL para las listas de videos de cada canal.
+    `get` acepta un TTL propio para decidir si la entrada sigue fresca.
+    """
+
+    def __init__(self, ttl=YOUTUBE_CACHE_TTL, max_size=YOUTUBE_CACHE_MAX_SIZE, use_db=YOUTUBE_CACHE_DB,
+                 ttl_overrides=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.use_db = use_db
+        self.ttl_overrides = ttl_overrides or {}
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # clave -> (guardado_en, valor)
+        self._hits = 0
+        self._db_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def ttl_for(self, channel_id):
+        return self.ttl_overrides.get(channel_id, self.ttl)
+
+    def get(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] <= ttl:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+
+        if self.use_db:
+            stored = self._db_get(key, now - ttl)
+            if stored is not None:
+                with self._lock:
+                    self._db_hits += 1
+                self._remember(key, *stored)
+                return stored[1]
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def set(self, key, value):
+        stored_at = time.time()
+        self._remember(key, stored_at, value)
+        if self.use_db:
+            self._db_set(key, stored_at, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.use_db:
+            with get_connection() as conn:
+                conn.cursor().execute("DELETE FROM youtube_cache WHERE cache_key = ?", (key,))
+                conn.commit()
+
+    def _remember(self, key, stored_at, value):
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def _db_get(self, key, min_stored_at):
+        try:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT stored_at, value FROM youtube_cache WHERE cache_key = ? AND stored_at >= ?",
+                               (key, min_stored_at))
+                row = cursor.fetchone()
+        except Exception as e:
+            print(f"Error leyendo la caché de YouTube en la base de datos: {e}")
+            return None
+        return (row[0], json.loads(row[1])) if row else None
+
+    def _db_set(self, key, stored_at, value):
+        try:
+            with get_connection() as conn:
+                conn.cursor().execute(
+                    "INSERT INTO youtube_cache (cache_key, stored_at, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT(cache_key) DO UPDATE SET stored_at = excluded.stored_at, value = excluded.value",
+                    (key, stored_at, json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+                )
+                # De paso limpiamos lo que ya no puede estar fresco para ningún canal.
+                max_ttl = max([self.ttl, *self.ttl_overrides.values()])
+                conn.cursor().execute("DELETE FROM youtube_cache WHERE stored_at < ?", (stored_at - max_ttl,))
+                conn.commit()
+        except Exception as e:
+            print(f"Error guardando la caché de YouTube en la base de datos: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._db_hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "db_tier": self.use_db,
+                "hits": self._hits,
+                "db_hits": self._db_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": round((self._hits + self._db_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+
+channel_cache = ChannelCache(ttl_overrides=parse_ttl_overrides(YOUTUBE_CACHE_TTL_OVERRIDES))
@@ -1,149 +1,327 @@
 # youtube_logic.py (Versión Corregida)
 import os
-import libsql
-from googleapiclient.discovery import build
+import threading
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
+import video_store
+from youtube_cache import channel_cache
+from db_pool import get_connection, get_read_connection
+
 # Cargar las variables de entorno del archivo .env
 load_dotenv()
 YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
-DB_URL = os.getenv("DB_URL")
-DB_AUTH_TOKEN = os.getenv("DB_AUTH_TOKEN")
+# Permite apuntar el cliente a otro servidor (p. ej. el YouTube falso de bench_servers.py).
+YOUTUBE_API_ENDPOINT = os.getenv('YOUTUBE_API_ENDPOINT')
+# Documento de descubrimiento en disco. Si no se indica, se usa el que trae googleapiclient.
+YOUTUBE_DISCOVERY_FILE = os.getenv('YOUTUBE_DISCOVERY_FILE')
 
 # El prompt que usaremos para el análisis
 GROK_ECONOMIC_CONCERN = """Analyze the provided JSON data and tell me, based on the number of views of the videos, what could be the topic of greatest concern for Americans regarding their economy? Use the data contained in the file. Also, give me the titles, links and number of views of the videos related to that topic. Sort the videos by views in descending order. Present the final answer in Spanish. It also includes a list at the end with all the videos that were present in the JSON data file."""
 
-youtube = None
-if YOUTUBE_API_KEY:
-    try:
-        youtube = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
-    except Exception as e:
-        print(f"Error inicializando la API de YouTube: {e}")
-else:
+# Coste en unidades de cuota de cada método de la API de YouTube Data v3.
+QUOTA_COSTS = {
+    "search.list": 100,
+    "videos.list": 1,
+    "playlistItems.list": 1,
+    "channels.list": 1,
+}
+
+# Máximo de IDs que acepta channels.list en una petición.
+CHANNELS_BATCH_SIZE = 50
+
+# Días hacia atrás que cubre cada análisis.
+ANALYSIS_WINDOW_DAYS = 3
+
+class QuotaTracker:
+    """Cuenta las llamadas a la API de YouTube y las unidades de cuota que consumen."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.units = 0
+        self.calls = {}
+
+    def record(self, method):
+        with self._lock:
+            self.units += QUOTA_COSTS.get(method, 1)
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def report(self):
+        with self._lock:
+            return {"units": self.units, "calls": dict(self.calls)}
+
+# Acumulado de todo el proceso, además del contador de cada análisis.
+quota_usage = QuotaTracker()
+
+if not YOUTUBE_API_KEY:
     print("Error: YOUTUBE_API_KEY no encontrada. Asegúrate de que está en el archivo .env")
 
-def get_db_connection():
-    """Se conecta a la base de datos de Turso en la nube."""
-    if not all([DB_URL, DB_AUTH_TOKEN]):
-        raise ValueError("DB_URL y DB_AUTH_TOKEN deben estar configurados en el archivo .env")
-    conn = libsql.connect(database=DB_URL, auth_token=DB_AUTH_TOKEN)
-    return conn
+# El cliente se construye la primera vez que se usa, no al importar el módulo: googleapiclient
+# tarda en importarse y así la app y los scripts que no llaman a YouTube arrancan antes.
+_youtube = None
+_youtube_lock = threading.Lock()
+
+def _build_youtube():
+    from googleapiclient.discovery import build, build_from_document
+
+    client_options = {"api_endpoint": YOUTUBE_API_ENDPOINT} if YOUTUBE_API_ENDPOINT else None
+    if YOUTUBE_DISCOVERY_FILE:
+        with open(YOUTUBE_DISCOVERY_FILE, encoding="utf-8") as f:
+            return build_from_document(f.read(), developerKey=YOUTUBE_API_KEY, client_options=client_options)
+    # static_discovery usa el documento incluido en la librería: no hace falta red para construirlo.
+    return build('youtube', 'v3', developerKey=YOUTUBE_API_KEY, client_options=client_options,
+                 static_discovery=True, cache_discovery=False)
+
+def get_youtube():
+    """Cliente de la API de YouTube. Lanza ConnectionError si no se puede construir."""
+    global _youtube
+    if _youtube is None:
+        with _youtube_lock:
+            if _youtube is None:
+                if not YOUTUBE_API_KEY:
+                    raise ConnectionError("La API de YouTube no está inicializada.")
+                try:
+                    _youtube = _build_youtube()
+                except Exception as e:
+                    raise ConnectionError(f"Error inicializando la API de YouTube: {e}")
+    return _youtube
 
 def get_all_saved_channels():
     """Obtiene todos los canales de la base de datos de Turso."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT channel_id, channel_name FROM channels ORDER BY channel_name')
-    channels_raw = cursor.fetchall()
-    conn.close()
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT channel_id, channel_name FROM channels ORDER BY channel_name')
+        channels_raw = cursor.fetchall()
     return [{'channel_id': row[0], 'channel_name': row[1]} for row in channels_raw]
 
 def get_channel_name_from_db(channel_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT channel_name FROM channels WHERE channel_id = ?', (channel_id,))
-    channel = cursor.fetchone()
-    conn.close()
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT channel_name FROM channels WHERE channel_id = ?', (channel_id,))
+        channel = cursor.fetchone()
     return channel[0] if channel else None
 
-# --- FUNCIÓN CORREGIDA ---
-def get_channel_videos_last_week(channel_id, include_shorts=False):
+# httplib2.Http no es seguro entre hilos: cada hilo usa el suyo para ejecutar las peticiones.
+_thread_local = threading.local()
+
+def _thread_http():
+    if not hasattr(_thread_local, "http"):
+        import httplib2
+        _thread_local.http = httplib2.Http(timeout=60)
+    return _thread_local.http
+
+def _execute(request, method, quota=None):
+    """Ejecuta una petición a la API anotando su coste (se cobra aunque la petición falle)."""
+    quota_usage.record(method)
+    if quota is not None:
+        quota.record(method)
+    return request.execute(http=_thread_http())
+
+def get_uploads_playlist_id(channel_id, quota=None):
+    """Playlist de subidas del canal. Se resuelve una vez con channels.list y se guarda en `channels`."""
+    playlist_id = video_store.get_uploads_playlist_id(channel_id)
+    if playlist_id:
+        return playlist_id
+
+    response = _execute(get_youtube().channels().list(part='contentDetails', id=channel_id), "channels.list", quota)
+    items = response.get('items', [])
+    if not items:
+        raise ValueError(f"El canal {channel_id} no existe en YouTube.")
+    playlist_id = items[0]['contentDetails']['relatedPlaylists']['uploads']
+    video_store.save_uploads_playlist_id(channel_id, playlist_id)
+    return playlist_id
+
+def _channel_info(item):
+    return {'channel_id': item['id'], 'channel_name': item['snippet']['title'],
+            'uploads_playlist_id': item['contentDetails']['relatedPlaylists']['uploads']}
+
+def fetch_channels(channel_ids, quota=None):
     """
-    Obtiene los videos de un canal de los últimos 3 días.
-    *** CORREGIDO: Ahora maneja la paginación para obtener TODOS los videos. ***
+    Título y playlist de subidas de cada canal con channels.list en lotes de 50 IDs
+    (1 unidad por lote). Devuelve {channel_id: datos}; los IDs que no existen no aparecen.
     """
-    if not youtube:
-        raise ConnectionError("La API de YouTube no está inicializada.")
-        
-    three_days_ago = (datetime.now(timezone.utc) - timedelta(days=3)).isoformat().replace('+00:00', 'Z')
-    
-    all_video_ids = []
+    found = {}
+    for i in range(0, len(channel_ids), CHANNELS_BATCH_SIZE):
+        batch_ids = channel_ids[i:i + CHANNELS_BATCH_SIZE]
+        response = _execute(get_youtube().channels().list(
+            part='snippet,contentDetails', id=','.join(batch_ids), maxResults=CHANNELS_BATCH_SIZE
+        ), "channels.list", quota)
+        for item in response.get('items', []):
+            found[item['id']] = _channel_info(item)
+    return found
+
+def find_channel(handle=None, username=None, quota=None):
+    """Resuelve un @handle (o un nombre de usuario de las URL /user/). La API solo acepta uno por petición."""
+    params = {'forHandle': handle} if handle else {'forUsername': username}
+    response = _execute(get_youtube().channels().list(part='snippet,contentDetails', **params), "channels.list", quota)
+    items = response.get('items', [])
+    return _channel_info(items[0]) if items else None
+
+def ingest_new_videos(channel_id, since, quota=None):
+    """
+    Recorre la playlist de subidas (de la más nueva a la más vieja) con playlistItems.list,
+    a 1 unidad por página, hasta llegar a un video ya conocido o anterior a `since`.
+    Devuelve los IDs nuevos encontrados.
+    """
+    playlist_id = get_uploads_playlist_id(channel_id, quota)
+    new_video_ids = []
     next_page_token = None
-    
-    try:
-        # **INICIO DE LA CORRECCIÓN: Bucle de paginación**
-        # Este bucle se ejecutará mientras la API de YouTube indique que hay más páginas de resultados.
-        while True:
-            search_response = youtube.search().list(
-                part='id',
-                channelId=channel_id,
-                publishedAfter=three_days_ago,
-                type='video',
-                order='date',
-                maxResults=50, # 50 es el máximo permitido por la API por página
-                pageToken=next_page_token # Envía el token de la página anterior para obtener la siguiente
-            ).execute()
-            
-            # Añade los IDs de video de la página actual a nuestra lista completa
-            page_video_ids = [item['id']['videoId'] for item in search_response.get('items', [])]
-            all_video_ids.extend(page_video_ids)
-            
-            # Obtenemos el token para la siguiente página. Si no existe, salimos del bucle.
-            next_page_token = search_response.get('nextPageToken')
-            if not next_page_token:
+
+    while True:
+        response = _execute(get_youtube().playlistItems().list(
+            part='contentDetails',
+            playlistId=playlist_id,
+            maxResults=50,
+            pageToken=next_page_token
+        ), "playlistItems.list", quota)
+
+        items = response.get('items', [])
+        known = video_store.filter_known_video_ids([item['contentDetails']['videoId'] for item in items])
+        reached_known = False
+        for item in items:
+            video_id = item['contentDetails']['videoId']
+            published_at = item['contentDetails'].get('videoPublishedAt')
+            if video_id in known or (published_at and published_at < since):
+                reached_known = True
                 break
-        # **FIN DE LA CORRECCIÓN**
+            new_video_ids.append(video_id)
+
+        next_page_token = response.get('nextPageToken')
+        if reached_known or not next_page_token:
+            break
+
+    return new_video_ids
+
+def latest_upload_id(channel_id, quota=None):
+    """ID del último video subido por el canal (una página de 1 elemento: 1 unidad de cuota)."""
+    playlist_id = get_uploads_playlist_id(channel_id, quota)
+    response = _execute(get_youtube().playlistItems().list(
+        part='contentDetails',
+        playlistId=playlist_id,
+        maxResults=1
+    ), "playlistItems.list", quota)
+    items = response.get('items', [])
+    return items[0]['contentDetails']['videoId'] if items else None
+
+def fetch_video_details(video_ids, quota=None):
+    """Pide snippet y estadísticas con videos.list en lotes de 50 IDs (1 unidad por lote)."""
+    details = []
+    for i in range(0, len(video_ids), 50):
+        batch_ids = video_ids[i:i+50]
+        response = _execute(get_youtube().videos().list(
+            part='snippet,statistics', # Nota: No se pide 'contentDetails', por lo que no se puede filtrar por duración.
+            id=','.join(batch_ids)
+        ), "videos.list", quota)
+        for item in response.get('items', []):
+            details.append({
+                'video_id': item['id'],
+                'channel_id': item['snippet']['channelId'],
+                'title': item['snippet']['title'],
+                'published_at': item['snippet']['publishedAt'],
+                'views': int(item['statistics'].get('viewCount', 0)),
+            })
+    return details
+
+def window_start():
+    """Inicio (ISO 8601 UTC) de la ventana que cubre cada análisis."""
+    return (datetime.now(timezone.utc) - timedelta(days=ANALYSIS_WINDOW_DAYS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def collect_window_video_ids(channel_id, since, quota=None):
+    """IDs de la ventana: los nuevos de la playlist de subidas más los que ya estaban en el almacén."""
+    new_video_ids = ingest_new_videos(channel_id, since, quota)
+    new_ids = set(new_video_ids)
+    return new_video_ids + [v for v in video_store.get_recent_video_ids(channel_id, since) if v not in new_ids]
 
-        if not all_video_ids:
+def to_analysis_videos(details, velocities=None):
+    """
+    Formato que se guarda en el job y se envía al LLM, del video más nuevo al más viejo.
+    `velocities` (video_id -> vistas por hora, de video_store.get_velocities) añade 'views_per_hour'.
+    """
+    details = sorted(details, key=lambda d: d['published_at'], reverse=True)
+    videos = []
+    for d in details:
+        video = {'title': d['title'], 'views': d['views'], 'url': f"https://www.youtube.com/watch?v={d['video_id']}"}
+        if velocities and d['video_id'] in velocities:
+            video['views_per_hour'] = velocities[d['video_id']]
+        videos.append(video)
+    return videos
+
+def _fetch_channel_videos(channel_id, quota=None):
+    """
+    Solo se descargan de YouTube los videos nuevos desde la última ingesta; del resto
+    se refrescan las estadísticas.
+    """
+    since = window_start()
+
+    try:
+        window_ids = collect_window_video_ids(channel_id, since, quota)
+        if not window_ids:
             return []
-        
-        # Ahora que tenemos TODOS los IDs, pedimos sus detalles.
-        # La API de videos.list puede aceptar hasta 50 IDs a la vez, por lo que si
-        # tenemos más, debemos hacer la petición en lotes.
-        videos_data = []
-        for i in range(0, len(all_video_ids), 50):
-            batch_ids = all_video_ids[i:i+50]
-            video_details_response = youtube.videos().list(
-                part='snippet,statistics', # Nota: No se pide 'contentDetails', por lo que no se puede filtrar por duración.
-                id=','.join(batch_ids)
-            ).execute()
-            
-            for item in video_details_response.get('items', []):
-                # El parámetro 'include_shorts' no tiene efecto aquí porque no obtenemos la duración del video.
-                # El comportamiento original se mantiene, pero ahora sobre la lista completa de videos.
-                videos_data.append({
-                    'title': item['snippet']['title'],
-                    'views': int(item['statistics'].get('viewCount', 0)),
-                    'url': f"https://www.youtube.com/watch?v={item['id']}"
-                })
 
+        details = [d for d in fetch_video_details(window_ids, quota) if d['published_at'] >= since]
+        video_store.upsert_videos(details)
+        velocities = video_store.get_velocities([d['video_id'] for d in details])
     except Exception as e:
         print(f"Error al obtener videos de YouTube para {channel_id}: {e}")
         return []
-        
-    return videos_data
+
+    return to_analysis_videos(details, velocities)
+
+def videos_cache_key(channel_id):
+    return f"videos:{channel_id}"
+
+def get_channel_videos_last_week(channel_id, include_shorts=False, quota=None, force_refresh=False):
+    """
+    Obtiene los videos de un canal de los últimos 3 días.
+    El resultado se guarda en caché (TTL por canal) porque la cuota de YouTube es el
+    recurso escaso; `force_refresh=True` la ignora. Si se pasa un `QuotaTracker`,
+    anota la cuota gastada.
+    """
+    if not YOUTUBE_API_KEY:
+        raise ConnectionError("La API de YouTube no está inicializada.")
+
+    # El parámetro 'include_shorts' no tiene efecto porque no obtenemos la duración del video.
+    cache_key = videos_cache_key(channel_id)
+    if not force_refresh:
+        cached = channel_cache.get(cache_key, channel_cache.ttl_for(channel_id))
+        if cached is not None:
+            return cached
+
+    videos = _fetch_channel_videos(channel_id, quota)
+    if videos:
+        # No guardamos listas vacías: suelen venir de un error y no queremos fijarlo en caché.
+        channel_cache.set(cache_key, videos)
+    return videos
 
 def add_channel_to_db(channel_name, channel_id, category="Noticias"):
     """Añade un nuevo canal a la base de datos. Devuelve (éxito, mensaje)."""
+    import libsql
     if not channel_name or not channel_id:
         return (False, "El nombre y el ID del canal no pueden estar vacíos.")
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "INSERT INTO channels (channel_name, channel_id, category) VALUES (?, ?, ?)",
-            (channel_name, channel_id, category)
-        )
-        conn.commit()
-        return (True, f"¡Canal '{channel_name}' añadido con éxito!")
-    except libsql.IntegrityError:
-        return (False, "Error: Ese ID de canal ya existe en la base de datos.")
-    except Exception as e:
-        return (False, f"Ocurrió un error inesperado: {e}")
-    finally:
-        conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "INSERT INTO channels (channel_name, channel_id, category) VALUES (?, ?, ?)",
+                (channel_name, channel_id, category)
+            )
+            conn.commit()
+            return (True, f"¡Canal '{channel_name}' añadido con éxito!")
+        except libsql.IntegrityError:
+            conn.rollback()
+            return (False, "Error: Ese ID de canal ya existe en la base de datos.")
+        except Exception as e:
+            conn.rollback()
+            return (False, f"Ocurrió un error inesperado: {e}")
 
 def delete_channel_from_db(channel_id):
     """Borra un canal de la base de datos por su ID. Devuelve (éxito, mensaje)."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,))
-    conn.commit()
-    
-    success = cursor.rows_affected > 0
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,))
+        conn.commit()
+        success = cursor.rows_affected > 0
     
     if success:
         return (True, f"¡Canal con ID '{channel_id}' borrado con éxito!")